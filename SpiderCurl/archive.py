@@ -0,0 +1,237 @@
+# Archive of raw fetched pages: rotating WARC-style segment files, one zstd frame per record
+import mmap
+import os
+import sys
+import time
+import uuid
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import toml
+
+try:
+    import zstandard  # pip install zstandard
+except ImportError:
+    zstandard = None
+
+config = toml.load("config.toml")
+
+ARCHIVE_PATH = config.get("archive_path", "data/archive")
+SEGMENT_BYTES = config.get("archive_segment_bytes", 1 << 30)  # A writer starts a new segment past this size
+LEVEL = config.get("archive_zstd_level", 3)
+SEGMENT_SUFFIX = ".warc.zst"
+INDEX_SUFFIX = ".idx"  # Next to every segment: "offset<TAB>length<TAB>url" per record
+
+
+@dataclass
+class ArchivedPage:
+    url: str
+    status_code: int
+    encoding: Optional[str]
+    body: bytes
+    fetched_at: Optional[str] = None  # WARC-Date, ISO 8601 UTC to the microsecond
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    truncated: bool = False  # The body was cut off at max_body_bytes when fetched
+
+
+def _headers(lines: List[str]) -> bytes:
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("utf-8")
+
+
+def _record(url, status_code, encoding, body, etag=None, last_modified=None, truncated=False, fetched_at=None) -> bytes:
+    """A WARC/1.1 response record wrapping the HTTP status line, the headers we keep and the raw body."""
+    http = [f"HTTP/1.1 {status_code}", f"Content-Type: text/html; charset={encoding or 'utf-8'}",
+            f"Content-Length: {len(body)}"]
+    if etag:
+        http.append(f"ETag: {etag}")
+    if last_modified:
+        http.append(f"Last-Modified: {last_modified}")
+    http = _headers(http)
+    warc = ["WARC/1.1", "WARC-Type: response", f"WARC-Record-ID: <urn:uuid:{uuid.uuid4()}>",
+            f"WARC-Date: {fetched_at or datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S.%fZ')}",
+            f"WARC-Target-URI: {url}", "Content-Type: application/http;msgtype=response",
+            f"Content-Length: {len(http) + len(body)}"]
+    if truncated:
+        warc.append("WARC-Truncated: length")
+    return b"".join((_headers(warc), http, body, b"\r\n\r\n"))
+
+
+def warc_time(value: Optional[str]) -> datetime:
+    """A WARC-Date as a datetime, with or without the fraction of a second; datetime.min when missing."""
+    if not value:
+        return datetime.min
+    return datetime.strptime(value, "%Y-%m-%dT%H:%M:%S.%fZ" if "." in value else "%Y-%m-%dT%H:%M:%SZ")
+
+
+def _parse_headers(block: bytes) -> Tuple[str, Dict[str, str]]:
+    first, *lines = block.decode("utf-8", "replace").split("\r\n")
+    headers = {}
+    for line in lines:
+        name, _, value = line.partition(":")
+        headers[name.strip().lower()] = value.strip()
+    return first, headers
+
+
+def parse_record(record: bytes) -> ArchivedPage:
+    warc_end = record.index(b"\r\n\r\n")
+    _, warc = _parse_headers(record[:warc_end])
+    http_end = record.index(b"\r\n\r\n", warc_end + 4)
+    status_line, http = _parse_headers(record[warc_end + 4:http_end])
+    body = record[http_end + 4:warc_end + 4 + int(warc["content-length"])]
+    encoding = None
+    for param in http.get("content-type", "").split(";")[1:]:
+        name, _, value = param.partition("=")
+        if name.strip() == "charset":
+            encoding = value.strip()
+    return ArchivedPage(url=warc["warc-target-uri"], status_code=int(status_line.split()[1]), encoding=encoding,
+                        body=body, fetched_at=warc.get("warc-date"), etag=http.get("etag"),
+                        last_modified=http.get("last-modified"), truncated="warc-truncated" in warc)
+
+
+def _require_zstandard():
+    if zstandard is None:
+        raise RuntimeError("the page archive needs the zstandard package (pip install zstandard)")
+
+
+class ArchiveWriter:
+    """
+    Appends records to segments of its own, named after the writer's start time and pid, so
+    every parser process can write without locking. Each record is a separate zstd frame,
+    which makes any record readable on its own from (segment, offset, length), the location
+    write() returns and the segment's .idx lists. A writer never appends to an older segment:
+    after a crash, the half-written record at the end of a segment is simply never indexed.
+    """
+
+    def __init__(self, path: str = ARCHIVE_PATH, segment_bytes: int = SEGMENT_BYTES, level: int = LEVEL):
+        _require_zstandard()
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.segment_bytes = segment_bytes
+        self.compressor = zstandard.ZstdCompressor(level=level)
+        self.prefix = f"{time.strftime('%Y%m%d%H%M%S', time.gmtime())}-{os.getpid()}"
+        self.sequence = 0
+        self.segment = None
+        self.file = None
+        self.index = None
+        self.offset = 0
+
+    def _rotate(self):
+        self.close()
+        self.segment = f"{self.prefix}-{self.sequence:05d}{SEGMENT_SUFFIX}"
+        self.sequence += 1
+        self.file = open(os.path.join(self.path, self.segment), "ab")
+        self.index = open(os.path.join(self.path, self.segment + INDEX_SUFFIX), "a", encoding="utf-8")
+        self.offset = self.file.tell()
+
+    def write(self, url: str, status_code: int, encoding: Optional[str], body, etag: Optional[str] = None,
+              last_modified: Optional[str] = None, truncated: bool = False) -> List:
+        """Archives one response body (bytes or a memoryview); returns [segment, offset, length]."""
+        frame = self.compressor.compress(_record(url, status_code, encoding, body, etag, last_modified, truncated))
+        if self.file is None or (self.offset and self.offset + len(frame) > self.segment_bytes):
+            self._rotate()
+        offset = self.offset
+        # Flushed per record: the location is stored with the page right after this returns
+        self.file.write(frame)
+        self.file.flush()
+        self.index.write(f"{offset}\t{len(frame)}\t{url}\n")
+        self.index.flush()
+        self.offset += len(frame)
+        return [self.segment, offset, len(frame)]
+
+    def close(self):
+        for f in (self.file, self.index):
+            if f is not None:
+                f.close()
+        self.file = self.index = None
+
+
+class ArchiveReader:
+    """Random access to archived records through one read-only mmap per segment."""
+
+    def __init__(self, path: str = ARCHIVE_PATH):
+        _require_zstandard()
+        self.path = path
+        self.decompressor = zstandard.ZstdDecompressor()
+        self.maps: Dict[str, mmap.mmap] = {}
+        self.locations: Optional[Dict[str, List[Tuple[str, int, int]]]] = None
+
+    def _map(self, segment: str, end: int) -> mmap.mmap:
+        segment_map = self.maps.get(segment)
+        if segment_map is None or len(segment_map) < end:
+            # New, or grown since it was mapped by a writer still appending to it
+            if segment_map is not None:
+                segment_map.close()
+            with open(os.path.join(self.path, segment), "rb") as f:
+                segment_map = self.maps[segment] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return segment_map
+
+    def read(self, segment: str, offset: int, length: int) -> ArchivedPage:
+        frame = self._map(segment, offset + length)[offset:offset + length]
+        return parse_record(self.decompressor.decompress(frame))
+
+    def segments(self) -> List[str]:
+        if not os.path.isdir(self.path):
+            return []
+        return sorted(name for name in os.listdir(self.path) if name.endswith(SEGMENT_SUFFIX))
+
+    def entries(self, segment: str) -> Iterator[Tuple[int, int, str]]:
+        """(offset, length, url) of a segment's records, in the order they were written."""
+        try:
+            with open(os.path.join(self.path, segment + INDEX_SUFFIX), encoding="utf-8") as index:
+                for line in index:
+                    if line.endswith("\n"):  # A line cut short by a crash has no record behind it
+                        offset, length, url = line.rstrip("\n").split("\t", 2)
+                        yield int(offset), int(length), url
+        except FileNotFoundError:
+            return
+
+    def __iter__(self) -> Iterator[Tuple[Tuple[str, int, int], ArchivedPage]]:
+        """Every record, segment by segment, with its location."""
+        for segment in self.segments():
+            for offset, length, _ in self.entries(segment):
+                yield (segment, offset, length), self.read(segment, offset, length)
+
+    def lookup(self, url: str) -> Optional[ArchivedPage]:
+        """
+        The latest archived copy of a URL by WARC-Date. Segment names do not order the copies:
+        parsers write their own segments side by side. Loads every .idx on first use; pages
+        in Mongo carry their location instead.
+        """
+        if self.locations is None:
+            self.locations = {}
+            for segment in self.segments():
+                for offset, length, entry_url in self.entries(segment):
+                    self.locations.setdefault(entry_url, []).append((segment, offset, length))
+        copies = [self.read(*location) for location in self.locations.get(url, ())]
+        return max(reversed(copies), key=lambda page: warc_time(page.fetched_at), default=None)
+
+    def close(self):
+        for segment_map in self.maps.values():
+            segment_map.close()
+        self.maps.clear()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in ("stats", "get"):
+        print("Usage: python archive.py stats | get <url>")
+        sys.exit(1)
+    reader = ArchiveReader()
+    if sys.argv[1] == "stats":
+        records = stored = raw = 0
+        for segment in reader.segments():
+            for offset, length, _ in reader.entries(segment):
+                records += 1
+                stored += length
+                raw += len(reader.read(segment, offset, length).body)
+        print(f"{len(reader.segments())} segments, {records} pages, {raw / 1e6:.1f} MB of HTML stored in {stored / 1e6:.1f} MB"
+              f" ({raw / max(stored, 1):.1f}x)")
+    else:
+        page = reader.lookup(sys.argv[2])
+        if page is None:
+            print("Not archived")
+            sys.exit(1)
+        print(f"{page.status_code} {page.url} fetched {page.fetched_at}")
+        sys.stdout.write(page.body.decode(page.encoding or "utf-8", "replace"))
+    reader.close()
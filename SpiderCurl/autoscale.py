@@ -0,0 +1,137 @@
+# Sizes the parser pool and the fetchers' in-flight limit from queue pressure and throughput
+import time
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+import toml
+
+config = toml.load("config.toml")
+
+AUTOSCALE = config.get("autoscale", True)  # Off: the crawler runs with multiprocess parsers and max_in_flight fetches
+MIN_PARSERS = config.get("autoscale_min_parsers", 2)
+MAX_PARSERS = config.get("autoscale_max_parsers", 64)
+MIN_IN_FLIGHT = config.get("autoscale_min_in_flight", 20)  # Per fetcher process
+MAX_IN_FLIGHT = config.get("autoscale_max_in_flight", 1000)
+INTERVAL = config.get("autoscale_interval", 5.0)  # Seconds between readings
+PATIENCE = config.get("autoscale_patience", 3)  # Consecutive readings a signal must hold before a size changes
+COOLDOWN = config.get("autoscale_cooldown", 30.0)  # Seconds a size is left alone after it changed
+HIGH = config.get("autoscale_high", 0.5)  # Queue fill above which the stage after the queue is behind
+LOW = config.get("autoscale_low", 0.05)  # Queue fill below which the stage before the queue is behind
+BUSY = 0.9  # Share of the fetch slots in use for more of them to be worth having
+IDLE = 0.5  # Share of their time parsers spend parsing below which the pool can shrink
+MIN_GAIN = 1.05  # Fetch rate a raised in-flight limit has to bring, relative to the rate before
+
+
+@dataclass
+class Load:
+    """One reading of the pipeline. The cumulative counts come from the metrics and are None when metrics are off."""
+
+    processing_fill: float  # webpage_processing_queue, fetchers -> parsers, as a fraction of its size
+    webpage_fill: float  # webpage_queue, parsers -> database manager
+    fetch_waiting: int  # Tasks queued for or scheduled in the fetchers
+    fetches_in_flight: Optional[float] = None
+    fetched: Optional[float] = None
+    parse_seconds: Optional[float] = None
+
+
+def _clamp(value: int, low: int, high: int) -> int:
+    return max(low, min(high, value))
+
+
+def connection_limit(in_flight: int) -> int:
+    """Connection pool size for a fetcher starting at `in_flight`: the autoscaler can raise it up to MAX_IN_FLIGHT."""
+    return max(in_flight, MAX_IN_FLIGHT)
+
+
+class Autoscaler:
+    """
+    Decides the parser count and the per-fetcher in-flight limit, one reading at a time; the
+    caller starts and stops the processes. The processing queue between the fetchers and the
+    parsers is the main signal: filling up means parsing is the bottleneck, running dry while
+    tasks wait to be fetched means fetching is. A signal has to hold for PATIENCE readings in
+    a row outside the LOW..HIGH band, and a size that just changed is left alone for COOLDOWN
+    seconds, so the sizes settle instead of oscillating. Parsers grow by a quarter and shrink
+    by an eighth. A raised in-flight limit that brought no more fetches per second (the host
+    scheduler's politeness is the limit, not concurrency) is taken back, and a limit that
+    went down is not raised again for ten cooldowns.
+    """
+
+    def __init__(self, fetchers: int, parsers: int, in_flight: int):
+        self.fetchers = fetchers
+        self.parsers = _clamp(parsers, MIN_PARSERS, MAX_PARSERS)
+        self.in_flight = _clamp(in_flight, MIN_IN_FLIGHT, MAX_IN_FLIGHT)
+        self.parser_pressure = 0  # Readings in a row that asked for more parsers (> 0) or fewer (< 0)
+        self.fetch_pressure = 0
+        self.changed = {"parsers": float("-inf"), "in_flight": float("-inf")}
+        self.last: Optional[Tuple[float, Load]] = None
+        self.raised_from: Optional[Tuple[int, float]] = None  # (limit, fetch rate) before the last raise
+        self.hold_in_flight_until = float("-inf")
+
+    def _pressure(self, current: int, up: bool, down: bool) -> int:
+        if up:
+            return max(current, 0) + 1
+        if down:
+            return min(current, 0) - 1
+        return 0
+
+    def _ready(self, name: str, pressure: int, now: float) -> bool:
+        return abs(pressure) >= PATIENCE and now - self.changed[name] >= COOLDOWN
+
+    def update(self, load: Load, now: Optional[float] = None) -> Tuple[int, int]:
+        """Takes one reading; returns the (parsers, in_flight) to run with."""
+        now = time.monotonic() if now is None else now
+        fetch_rate = parse_busy = None
+        if self.last is not None and load.fetched is not None and self.last[1].fetched is not None:
+            elapsed = max(now - self.last[0], 1e-9)
+            fetch_rate = (load.fetched - self.last[1].fetched) / elapsed
+            parse_busy = (load.parse_seconds - self.last[1].parse_seconds) / (elapsed * self.parsers)
+        self.last = (now, load)
+        slots_busy = None
+        if load.fetches_in_flight is not None:
+            slots_busy = load.fetches_in_flight / (self.in_flight * self.fetchers)
+
+        # Judge the last raise once its cooldown is over: keep it only if fetching got faster
+        if self.raised_from is not None and fetch_rate is not None and now - self.changed["in_flight"] >= COOLDOWN:
+            limit, rate_before = self.raised_from
+            self.raised_from = None
+            if fetch_rate < rate_before * MIN_GAIN:
+                print(f"Autoscaler: {self.in_flight} fetches in flight gave {fetch_rate:.1f}/s against {rate_before:.1f}/s, "
+                      f"back to {limit}")
+                self.in_flight = limit
+                self.changed["in_flight"] = now
+                self.hold_in_flight_until = now + 10 * COOLDOWN
+                self.fetch_pressure = 0
+
+        # Parsers: more while pages wait for them, unless the database side is full too
+        parsers_behind = load.processing_fill >= HIGH and load.webpage_fill < HIGH
+        parsers_idle = load.processing_fill <= LOW and (parse_busy is None or parse_busy < IDLE)
+        self.parser_pressure = self._pressure(self.parser_pressure, parsers_behind, parsers_idle)
+        if self._ready("parsers", self.parser_pressure, now):
+            step = max(1, self.parsers // 4) if self.parser_pressure > 0 else -max(1, self.parsers // 8)
+            parsers = _clamp(self.parsers + step, MIN_PARSERS, MAX_PARSERS)
+            if parsers != self.parsers:
+                print(f"Autoscaler: {self.parsers} -> {parsers} parsers (processing queue {load.processing_fill:.0%} full)")
+                self.parsers = parsers
+                self.changed["parsers"] = now
+            self.parser_pressure = 0
+
+        # Fetching: more in flight while parsers wait for pages and tasks wait for slots; fewer
+        # when the parsers cannot keep up even at their maximum or the database side is full
+        fetch_behind = (load.processing_fill <= LOW and load.fetch_waiting > 0
+                        and (slots_busy is None or slots_busy >= BUSY) and now >= self.hold_in_flight_until)
+        fetch_ahead = (load.processing_fill >= HIGH and self.parsers == MAX_PARSERS) or load.webpage_fill >= HIGH
+        self.fetch_pressure = self._pressure(self.fetch_pressure, fetch_behind, fetch_ahead)
+        if self._ready("in_flight", self.fetch_pressure, now):
+            factor = 1.25 if self.fetch_pressure > 0 else 0.8
+            in_flight = _clamp(int(self.in_flight * factor), MIN_IN_FLIGHT, MAX_IN_FLIGHT)
+            if in_flight != self.in_flight:
+                print(f"Autoscaler: {self.in_flight} -> {in_flight} fetches in flight per fetcher")
+                if in_flight > self.in_flight and fetch_rate is not None:
+                    self.raised_from = (self.in_flight, fetch_rate)
+                elif in_flight < self.in_flight:
+                    self.raised_from = None
+                    self.hold_in_flight_until = now + 10 * COOLDOWN
+                self.in_flight = in_flight
+                self.changed["in_flight"] = now
+            self.fetch_pressure = 0
+        return self.parsers, self.in_flight
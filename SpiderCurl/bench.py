@@ -0,0 +1,854 @@
+# Local micro-benchmarks for the crawler hot paths.
+# Run from the SpiderCurl folder (the modules load config.toml from the working directory):
+#   python bench.py fetch --urls 2000
+#   python bench.py canonicalize links.txt
+#   python bench.py parse --pages saved_pages/
+#   python bench.py ipc
+#   python bench.py index --docs 50000
+#   python bench.py frontier --pages 20000
+#   python bench.py archive --pages saved_pages/
+#   python bench.py metrics
+#   python bench.py crawl --target 2000 --output results.json --compare baseline.json
+
+import argparse
+import asyncio
+import heapq
+import json
+import marshal
+import math
+import multiprocessing
+import os
+import pickle
+import random
+import re
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import urllib.request
+from collections import defaultdict
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+import toml
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+import curler
+import models
+import processInfo
+import searchindex
+import archive
+import metrics
+import frontier
+import tracing
+from shmtransport import PageChannel
+from canonicalize import canonicalize_url
+
+
+def serve_pages(latency=0.0, body_size=20_000):
+    """
+    Starts a local keep-alive HTTP server in a background thread standing in for real sites.
+    Every path returns the same HTML page after `latency` seconds. Returns (server, base_url).
+    """
+    body = ("<html><head><title>bench</title></head><body>"
+            + "<p>lorem ipsum</p>" * max(1, body_size // 16)
+            + "</body></html>").encode()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            if latency:
+                time.sleep(latency)
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def _report(name, count, wall, cpu):
+    print(f"{name:>24}: {count / wall:8.1f} fetches/s wall, {count / max(cpu, 1e-9):8.1f} fetches per CPU-second")
+
+
+def _fetch_with_new_client(url):
+    # The previous fetch path: a fresh httpx.Client (new connection) for every URL
+    with httpx.Client(headers=curler.HEADERS) as client:
+        return client.get(url).status_code
+
+
+def bench_fetch(args):
+    server, base_url = serve_pages(latency=args.latency, body_size=args.body_size)
+    urls = [f"{base_url}/page/{i}" for i in range(args.urls)]
+
+    start, cpu_start = time.perf_counter(), time.process_time()
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        list(pool.map(_fetch_with_new_client, urls))
+    _report(f"client per URL x{args.threads}", len(urls), time.perf_counter() - start, time.process_time() - cpu_start)
+
+    async def run_async():
+        in_flight = asyncio.Semaphore(args.in_flight)
+        async with curler.create_async_client() as client:
+            async def one(url):
+                async with in_flight:
+                    return await curler.fetch_url(client, url)
+            return await asyncio.gather(*(one(url) for url in urls))
+
+    start, cpu_start = time.perf_counter(), time.process_time()
+    asyncio.run(run_async())
+    _report(f"shared AsyncClient x{args.in_flight}", len(urls), time.perf_counter() - start, time.process_time() - cpu_start)
+    server.shutdown()
+
+
+def bench_canonicalize(args):
+    # Corpus: one recorded link per line, e.g. exported WebPage.extracted_urls
+    with open(args.corpus, encoding="utf-8") as f:
+        links = [line.strip() for line in f if line.strip()]
+
+    start = time.perf_counter()
+    canonical = [canonicalize_url(link) for link in links]
+    elapsed = time.perf_counter() - start
+
+    raw_unique = len(set(links))
+    canonical_unique = len({url for url in canonical if url})
+    rejected = sum(1 for url in canonical if url is None)
+    print(f"{len(links)} links, {raw_unique} unique as recorded, {canonical_unique} unique after canonicalization")
+    print(f"frontier growth saved: {raw_unique - canonical_unique} tasks ({(1 - canonical_unique / max(raw_unique, 1)) * 100:.1f}%), {rejected} links rejected by scheme/host rules")
+    print(f"{len(links) / elapsed:,.0f} links/s ({elapsed / max(len(links), 1) * 1e6:.2f} us/link)")
+
+
+def _load_pages(directory, count):
+    if directory:
+        pages = []
+        for name in sorted(os.listdir(directory)):
+            if name.endswith((".html", ".htm")):
+                with open(os.path.join(directory, name), encoding="utf-8", errors="replace") as f:
+                    pages.append((f"https://example.com/{name}", f.read()))
+        return pages
+    # Synthetic pages shaped like a typical article: boilerplate, scripts, links, images
+    pages = []
+    for i in range(count):
+        paragraphs = "".join(f"<p>Paragraph {j} of page {i} with <a href='/wiki/{i}_{j}?utm_source=x'>a link</a> &amp; text.</p>" for j in range(60))
+        pages.append((f"https://example.com/page/{i}", (
+            f"<html><head><title>Page {i}</title><meta name='description' content='page {i}'>"
+            f"<meta property='og:title' content='Page {i}'><style>p {{ color: red }}</style></head><body>"
+            f"<header><nav><a href='/'>Home</a><a href='/about'>About</a></nav></header>"
+            f"<article>{paragraphs}<img src='/img/{i}.png' alt='figure' width='640' height='480'></article>"
+            f"<script>var tracking = {i};</script><aside>related</aside><footer>footer</footer></body></html>"
+        )))
+    return pages
+
+
+def _comparable(info):
+    # Image fetch timestamps differ between runs by design
+    info = dict(info)
+    info["images_info"] = [{k: v for k, v in image.items() if k != "last_fetched"} for image in info["images_info"]]
+    return info
+
+
+def bench_parse(args):
+    pages = _load_pages(args.pages, args.count)
+    reference = None
+    for backend in args.backends:
+        start = time.process_time()
+        results = [processInfo.process_html_content(html, url, backend=backend) for url, html in pages]
+        cpu = time.process_time() - start
+        line = f"{backend:>12}: {len(pages) / max(cpu, 1e-9):8.1f} pages per CPU-second"
+        if reference is None:
+            reference = results
+        else:
+            mismatched = [i for i, (a, b) in enumerate(zip(reference, results)) if _comparable(a) != _comparable(b)]
+            line += f", {len(mismatched)}/{len(pages)} pages differ from {args.backends[0]}"
+            for i in mismatched[:3]:
+                fields = [k for k in reference[i] if _comparable(reference[i])[k] != _comparable(results[i])[k]]
+                line += f"\n{'':>14}{pages[i][0]}: {', '.join(fields)}"
+        print(line)
+
+
+def _peak_rss_mib():
+    if resource is None:
+        return float("nan")
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KiB on Linux
+
+
+def _ipc_producer(processing_queue, channel, pages, use_shm):
+    for url, html in pages:
+        body = html.encode("utf-8")
+        if use_shm:
+            item = channel.store(models.webpageQueueItem(url=url), body, "utf-8")
+        else:
+            item = models.webpageQueueItem(url=url, webpage_content=body.decode("utf-8"))
+        processing_queue.put(item)
+    processing_queue.put(None)
+
+
+def _ipc_consumer(processing_queue, webpage_queue, channel, use_shm):
+    while True:
+        item = processing_queue.get()
+        if item is None:
+            break
+        html = channel.load(item) if use_shm else item.webpage_content
+        webpage = models.WebPage(url=item.url, title="title", text_content=html[:len(html) // 3],
+                                 extracted_urls=[f"{item.url}/{i}" for i in range(100)])
+        if use_shm:
+            webpage_queue.put(models.pack_webpage(webpage))
+        else:
+            pickle.dumps(webpage)  # the serialization test the worker used to do
+            webpage_queue.put(webpage)
+    webpage_queue.put(("done", _peak_rss_mib()))
+
+
+def bench_ipc(args):
+    pages = [(url, html * args.repeat) for url, html in _load_pages(None, args.count)]
+    megabytes = sum(len(html) for _, html in pages) / 1e6
+    for use_shm in (False, True):
+        processing_queue, webpage_queue = multiprocessing.Queue(maxsize=256), multiprocessing.Queue()
+        channel, slab = PageChannel.create(args.slots) if use_shm else (None, None)
+        start = time.perf_counter()
+        producer = multiprocessing.Process(target=_ipc_producer, args=(processing_queue, channel, pages, use_shm))
+        consumer = multiprocessing.Process(target=_ipc_consumer, args=(processing_queue, webpage_queue, channel, use_shm))
+        producer.start()
+        consumer.start()
+        while True:
+            record = webpage_queue.get()
+            if isinstance(record, tuple):
+                consumer_rss = record[1]
+                break
+            if use_shm:
+                models.unpack_webpage(record)
+        producer.join()
+        consumer.join()
+        elapsed = time.perf_counter() - start
+        if slab is not None:
+            slab.close()
+        name = "shared memory + packed" if use_shm else "pickled str + WebPage"
+        print(f"{name:>24}: {len(pages) / elapsed:8.1f} pages/s, {elapsed / len(pages) * 1e6:7.1f} us IPC per page, "
+              f"parser peak RSS {consumer_rss:.0f} MiB ({megabytes:.0f} MB of HTML)")
+
+
+def _zipf_corpus(docs, vocabulary, words_per_doc, seed=1):
+    # Word frequencies follow Zipf's law like real text, so postings lists have realistic skew
+    rng = random.Random(seed)
+    words = [f"w{i}" for i in range(vocabulary)]
+    weights = [1 / (rank + 1) for rank in range(vocabulary)]
+    for i in range(docs):
+        body = rng.choices(words, weights, k=words_per_doc)
+        yield f"https://example.com/doc/{i}", {"title": " ".join(body[:6]), "meta_description": " ".join(body[6:20]),
+                                               "text_content": " ".join(body)}
+
+
+def _percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def bench_index(args):
+    with tempfile.TemporaryDirectory() as path:
+        start = time.perf_counter()
+        count = searchindex.build_index(_zipf_corpus(args.docs, args.vocabulary, args.words), path, args.segment_docs)
+        elapsed = time.perf_counter() - start
+        size = sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+        print(f"build: {count / elapsed:,.0f} docs/s, {len(os.listdir(path))} segments, {size / 1e6:.1f} MB on disk")
+
+        searcher = searchindex.IndexSearcher(path)
+        rng = random.Random(2)
+        # Mix of frequent and rare terms: rank 0-50 words are in most documents
+        queries = [" ".join(f"w{int(rng.paretovariate(0.6)) % args.vocabulary}" for _ in range(rng.randint(1, 4)))
+                   for _ in range(args.queries)]
+        latencies = []
+        for query in queries:
+            start = time.perf_counter()
+            searcher.search(query, args.k)
+            latencies.append(time.perf_counter() - start)
+        latencies.sort()
+        print(f"query: {len(queries) / sum(latencies):,.0f} queries/s, p50 {_percentile(latencies, 0.5) * 1000:.2f} ms, "
+              f"p99 {_percentile(latencies, 0.99) * 1000:.2f} ms (top {args.k})")
+
+        if args.update_batches:
+            # Crawl-like updates through the index log: a third of each batch re-fetches known URLs
+            index, log = searchindex.IndexWriter(path), searchindex.IndexLog(os.path.join(path, "log"))
+            rng = random.Random(3)
+            delays = []
+            merges_before = index.next_segment
+            for batch_number in range(args.update_batches):
+                batch = []
+                for i, (url, fields) in enumerate(_zipf_corpus(args.batch_size, args.vocabulary, args.words, seed=batch_number)):
+                    if i % 3 == 0:
+                        url = f"https://example.com/doc/{rng.randrange(args.docs)}"
+                    else:
+                        url = f"https://example.com/new/{batch_number}/{i}"
+                    batch.append(models.WebPage(url=url, title=fields["title"], meta_description=fields["meta_description"],
+                                                text_content=fields["text_content"]))
+                start = time.perf_counter()
+                log.append(batch)
+                index.index_log(log)
+                searcher.refresh()
+                delays.append(time.perf_counter() - start)
+            delays.sort()
+            print(f"updates: {args.update_batches} batches of {args.batch_size}, logged to searchable p50 "
+                  f"{_percentile(delays, 0.5) * 1000:.1f} ms, p99 {_percentile(delays, 0.99) * 1000:.1f} ms, "
+                  f"{index.next_segment - merges_before - args.update_batches} merges, {len(index.segments)} segments, "
+                  f"{searcher.doc_count} live docs")
+            log.close()
+            index.close()
+        searcher.close()
+
+
+def _synthetic_web(pages, hosts, seed=4):
+    """
+    A link graph with the skew of the real web: host sizes and page popularity follow power
+    laws, most links stay on their host, and deep URLs are the unpopular ones.
+    Returns (urls, outlinks, sizes in bytes).
+    """
+    rng = random.Random(seed)
+    host_weights = [rng.paretovariate(1.2) for _ in range(hosts)]
+    page_host = rng.choices(range(hosts), host_weights, k=pages)
+    popularity = [rng.paretovariate(1.5) for _ in range(pages)]
+    host_pages = [[] for _ in range(hosts)]
+    for page, host in enumerate(page_host):
+        host_pages[host].append(page)
+    urls = []
+    for page in range(pages):
+        depth = max(0, min(6, int(4 - math.log(popularity[page]) * 2 + rng.random() * 2)))
+        path = "/".join(f"s{rng.randrange(50)}" for _ in range(depth))
+        urls.append(f"https://h{page_host[page]}.example/{path}/p{page}".replace("//p", "/p"))
+    host_popularity = [[popularity[page] for page in members] for members in host_pages]
+    outlinks = []
+    for page in range(pages):
+        links = set()
+        for _ in range(rng.randint(5, 30)):
+            host = page_host[page] if rng.random() < 0.7 else rng.choices(range(hosts), host_weights)[0]
+            if host_pages[host]:
+                links.add(rng.choices(host_pages[host], host_popularity[host])[0])
+        links.discard(page)
+        outlinks.append(list(links))
+    sizes = [int(rng.lognormvariate(10, 0.8)) for _ in range(pages)]
+    return urls, outlinks, sizes
+
+
+def _pagerank(outlinks, iterations=30, damping=0.85):
+    n = len(outlinks)
+    rank = [1 / n] * n
+    for _ in range(iterations):
+        incoming = [0.0] * n
+        dangling = 0.0
+        for page, links in enumerate(outlinks):
+            if links:
+                share = rank[page] / len(links)
+                for target in links:
+                    incoming[target] += share
+            else:
+                dangling += rank[page]
+        base = (1 - damping) / n + damping * dangling / n
+        rank = [base + damping * value for value in incoming]
+    return rank
+
+
+def _simulate_crawl(policy, urls, outlinks, sizes, seeds, budget, rng):
+    """Crawls `budget` pages of the synthetic web in `policy` order; returns the fetched pages in order."""
+    cash = defaultdict(float)
+    inlinks = defaultdict(int)
+    host_links = defaultdict(int)
+    hosts = [frontier.host_of(url) for url in urls]
+    depths = [frontier.url_depth(url) for url in urls]
+    discovered = set(seeds)
+    fetched = []
+    heap = []
+    order = 0
+
+    def push(page):
+        nonlocal order
+        order += 1
+        if policy == "fifo":
+            key = order
+        elif policy == "random":
+            key = rng.random()
+        elif policy == "inlinks":
+            key = -inlinks[page]
+        else:
+            key = -frontier.priority(cash[page], inlinks[page], depths[page], host_links[hosts[page]])
+        heapq.heappush(heap, (key, order, page))
+
+    for page in seeds:
+        cash[page] = frontier.SEED_CASH
+        push(page)
+    done = set()
+    while heap and len(fetched) < budget:
+        _, _, page = heapq.heappop(heap)
+        if page in done:
+            continue  # an older entry of a page re-pushed with a new priority
+        done.add(page)
+        fetched.append(page)
+        links = outlinks[page]
+        share = cash.pop(page, 0.0) / len(links) if links else 0.0
+        for target in links:
+            cash[target] += share
+            inlinks[target] += 1
+            if hosts[target] != hosts[page]:
+                host_links[hosts[target]] += 1
+            if target in done:
+                continue
+            if target not in discovered:
+                discovered.add(target)
+                push(target)
+            elif policy in ("inlinks", "opic"):
+                push(target)
+    return fetched
+
+
+def bench_frontier(args):
+    start = time.perf_counter()
+    urls, outlinks, sizes = _synthetic_web(args.pages, args.hosts)
+    rank = _pagerank(outlinks)
+    print(f"synthetic web: {args.pages} pages on {args.hosts} hosts, {sum(map(len, outlinks))} links "
+          f"({time.perf_counter() - start:.1f}s to build and rank)")
+    rng = random.Random(5)
+    seeds = rng.sample(range(args.pages), args.seeds)
+    budget = int(args.pages * args.budget)
+    fractions = (0.1, 0.25, 0.5, 1.0)
+    print("PageRank captured (and per fetched MB) after crawling:")
+    print(f"{'':>9}" + "".join(f"{f'{fraction * args.budget:.0%} of pages':>24}" for fraction in fractions))
+    for policy in args.policies:
+        start = time.perf_counter()
+        fetched = _simulate_crawl(policy, urls, outlinks, sizes, seeds, budget, random.Random(6))
+        elapsed = time.perf_counter() - start
+        line = f"{policy:>8}:"
+        for fraction in fractions:
+            crawled = fetched[:int(len(fetched) * fraction)]
+            value = sum(rank[page] for page in crawled)
+            megabytes = sum(sizes[page] for page in crawled) / 1e6
+            line += f"{f'{value:.1%} ({value / max(megabytes, 1e-9):.2%}/MB)':>24}"
+        print(line + f"  ({elapsed:.1f}s)")
+
+
+def bench_archive(args):
+    pages = [(url, html.encode("utf-8")) for url, html in _load_pages(args.pages, args.count)]
+    raw = sum(len(body) for _, body in pages)
+    with tempfile.TemporaryDirectory() as directory:
+        writer = archive.ArchiveWriter(directory, segment_bytes=args.segment_bytes, level=args.level)
+        start = time.perf_counter()
+        locations = [writer.write(url, 200, "utf-8", body) for url, body in pages]
+        write = time.perf_counter() - start
+        writer.close()
+        reader = archive.ArchiveReader(directory)
+        stored = sum(length for _, _, length in locations)
+        print(f"{len(pages)} pages, {raw / 1e6:.1f} MB of HTML in {stored / 1e6:.1f} MB ({raw / max(stored, 1):.1f}x, "
+              f"{stored / len(pages):,.0f} bytes/page), {len(reader.segments())} segments")
+        print(f"write: {len(pages) / write:,.0f} pages/s, {raw / write / 1e6:.0f} MB/s of HTML")
+
+        rng = random.Random(3)
+        latencies = []
+        for _ in range(args.reads):
+            location = rng.choice(locations)
+            start = time.perf_counter()
+            reader.read(*location)
+            latencies.append(time.perf_counter() - start)
+        latencies.sort()
+        print(f"random read: p50 {_percentile(latencies, 0.5) * 1e6:.0f} us, p99 {_percentile(latencies, 0.99) * 1e6:.0f} us")
+        start = time.perf_counter()
+        scanned = sum(len(page.body) for _, page in reader)
+        scan = time.perf_counter() - start
+        print(f"sequential scan: {len(pages) / scan:,.0f} pages/s, {scanned / scan / 1e6:.0f} MB/s of HTML")
+        reader.close()
+
+
+def _metrics_publisher(channel, updates):
+    metrics.start(channel, "bench", interval=0.05)
+    pages = metrics.counter("bench_pages_total", "", ("outcome",))
+    for _ in range(updates):
+        pages.inc("stored")
+    time.sleep(0.2)
+
+
+def bench_metrics(args):
+    hosts = [f"host{i}.example" for i in range(args.hosts)]
+    fetches = metrics.counter("bench_host_fetches_total", "", ("host", "status"))
+    latency = metrics.histogram("bench_fetch_seconds", "", ("status",))
+    rng = random.Random(5)
+    samples = [(rng.choice(hosts), rng.choice(("200", "200", "200", "404", "error")), rng.expovariate(5)) for _ in range(args.updates)]
+
+    start = time.perf_counter()
+    for host, status, seconds in samples:
+        pass
+    baseline = time.perf_counter() - start
+    start = time.perf_counter()
+    for host, status, seconds in samples:
+        fetches.inc(host, status)
+        latency.observe(seconds, status)
+    cost = (time.perf_counter() - start - baseline) / len(samples) / 2
+    print(f"{cost * 1e9:.0f} ns per counter increment / histogram observation")
+    print(f"instrumenting a page with ~10 updates: {cost * 10 * 1e6:.1f} us, "
+          f"{cost * 10 / (args.page_ms / 1000):.3%} of a {args.page_ms} ms page")
+
+    channel = metrics.MetricsChannel.create()
+    if channel.shm_name is None:
+        print("metrics_port is 0: shared-memory publishing not measured")
+        return
+    try:
+        start = time.perf_counter()
+        snapshot = marshal.dumps([metric.snapshot() for metric in (fetches, latency)])
+        publish = time.perf_counter() - start
+        print(f"snapshot of {len(fetches.values) + len(latency.values)} series: {len(snapshot)} bytes in {publish * 1e3:.2f} ms")
+        processes = [multiprocessing.Process(target=_metrics_publisher, args=(channel, 1000)) for _ in range(args.processes)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        start = time.perf_counter()
+        merged = metrics.collect(channel)
+        text = metrics.render(merged)
+        print(f"scrape of {args.processes} processes: {len(text)} bytes in {(time.perf_counter() - start) * 1e3:.1f} ms, "
+              f"bench_pages_total = {merged['bench_pages_total'][4].get(('stored',))}")
+    finally:
+        channel.close()
+
+
+def _free_port():
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+_WORDS = ["crawler", "index", "search", "page", "link", "graph", "host", "fetch", "parse", "rank", "query", "text",
+          "shard", "queue", "batch", "cache", "token", "score", "frontier", "politeness"]
+
+
+def _serve_synthetic_web(args, ports):
+    """
+    Child process: one keep-alive server per host on 127.0.0.1, each serving pages_per_host
+    generated pages at /p/<n>. A page's links and text depend only on (host, n), so every run
+    crawls the same web; latency, slow hosts and error responses are drawn per request.
+    """
+    servers = [ThreadingHTTPServer(("127.0.0.1", 0), BaseHTTPRequestHandler) for _ in range(args.hosts)]
+    hosts = [f"127.0.0.1:{server.server_address[1]}" for server in servers]
+    slow = set(random.Random(args.seed).sample(range(args.hosts), int(args.hosts * args.slow_hosts)))
+
+    def page(host_index, number):
+        rng = random.Random(args.seed * 1_000_003 + host_index * 100_003 + number)
+        links = []
+        for _ in range(args.links):
+            target = host_index if rng.random() > args.cross_host else rng.randrange(args.hosts)
+            links.append(f"<a href='http://{hosts[target]}/p/{rng.randrange(args.pages_per_host)}'>link</a>")
+        words = " ".join(rng.choice(_WORDS) for _ in range(max(1, args.page_bytes // 8)))
+        return (f"<html><head><title>Page {number} on host {host_index}</title>"
+                f"<meta name='description' content='synthetic page {number}'></head><body>"
+                f"<p>{words}</p>{''.join(links)}</body></html>").encode()
+
+    def handler_for(host_index):
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                delay = args.latency + (args.slow_latency if host_index in slow else 0.0)
+                if delay:
+                    time.sleep(delay)
+                match = re.fullmatch(r"/p/(\d+)", self.path)
+                if match is None or int(match.group(1)) >= args.pages_per_host:
+                    status, body = 404, b"not found"
+                elif random.random() < args.error_rate:
+                    status, body = 500, b"server error"
+                else:
+                    status, body = 200, page(host_index, int(match.group(1)))
+                self.send_response(status)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+        return Handler
+
+    for host_index, server in enumerate(servers):
+        server.RequestHandlerClass = handler_for(host_index)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    ports.put(hosts)
+    threading.Event().wait()
+
+
+def _start_mongod(mongod, directory):
+    """A throwaway mongod on a free port with its data in `directory`; returns (process, uri)."""
+    import pymongo
+    port = _free_port()
+    process = subprocess.Popen([mongod, "--dbpath", directory, "--port", str(port), "--bind_ip", "127.0.0.1", "--quiet"],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    uri = f"mongodb://127.0.0.1:{port}"
+    deadline = time.monotonic() + 30
+    while True:
+        try:
+            pymongo.MongoClient(uri, serverSelectionTimeoutMS=500).admin.command("ping")
+            return process, uri
+        except pymongo.errors.PyMongoError:
+            if process.poll() is not None or time.monotonic() > deadline:
+                process.kill()
+                raise RuntimeError(f"mongod did not start (exit code {process.poll()})")
+            time.sleep(0.5)
+
+
+def _parse_metrics(text):
+    """Prometheus text -> {name: {labels tuple: value}}, for the few series the report needs."""
+    series = defaultdict(dict)
+    for line in text.splitlines():
+        if not line or line.startswith("#"):
+            continue
+        name_labels, _, value = line.rpartition(" ")
+        name, _, labels = name_labels.partition("{")
+        series[name][tuple(re.findall(r'(\w+)="((?:[^"\\]|\\.)*)"', labels))] = float(value)
+    return series
+
+
+def _scrape(port):
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=5) as response:
+            return _parse_metrics(response.read().decode("utf-8"))
+    except OSError:
+        return {}
+
+
+def _by_role(series, name):
+    return {dict(labels)["role"]: value for labels, value in series.get(name, {}).items()}
+
+
+def _crawl_report(args, hosts, elapsed, timeline, traces, scraped, db):
+    stored = timeline[-1][1] if timeline else 0
+    # Throughput from the first stored page on, so process start-up does not count
+    first = next(((t, count) for t, count in timeline if count), None)
+    steady = (stored - first[1]) / max(timeline[-1][0] - first[0], 1e-9) if first and stored > first[1] else 0.0
+    latencies = sorted(trace[-1][1] - trace[0][1] for _, trace in traces if trace[-1][0] == "persisted")
+    stage_latencies = defaultdict(list)
+    for _, trace in traces:
+        for stage, seconds in tracing.stage_times(trace).items():
+            stage_latencies[stage].append(seconds)
+    cpu, rss, processes = (_by_role(scraped, name) for name in
+                           ("spidercurl_process_cpu_seconds", "spidercurl_process_rss_bytes", "spidercurl_processes"))
+    statuses = defaultdict(float)
+    for labels, value in scraped.get("spidercurl_host_fetches_total", {}).items():
+        statuses[dict(labels)["status"]] += value
+    return {
+        "pages_stored": stored,
+        "elapsed_seconds": round(elapsed, 2),
+        "pages_per_second": round(steady, 2),
+        "pages_per_second_overall": round(stored / max(elapsed, 1e-9), 2),
+        "traced_pages": len(latencies),
+        "page_latency_p50_seconds": round(_percentile(latencies, 0.5), 3) if latencies else None,
+        "page_latency_p99_seconds": round(_percentile(latencies, 0.99), 3) if latencies else None,
+        "stage_p99_seconds": {stage: round(_percentile(sorted(values), 0.99), 3) for stage, values in stage_latencies.items()},
+        "stages": {role: {"processes": int(processes.get(role, 0)),
+                          "cpu_seconds": round(cpu.get(role, 0.0), 2),
+                          "cpu_ms_per_page": round(cpu.get(role, 0.0) * 1000 / max(stored, 1), 3),
+                          "rss_mib": round(rss.get(role, 0.0) / 2 ** 20, 1)} for role in sorted(processes)},
+        "fetch_statuses": dict(statuses),
+        "tasks": {doc["_id"]: doc["count"] for doc in db["crawlTasks"].aggregate([{"$group": {"_id": "$status", "count": {"$sum": 1}}}])},
+        "hosts": len(hosts),
+    }
+
+
+def bench_crawl(args):
+    """
+    Runs the whole crawler (main.py as a subprocess, every process it starts) against a local
+    synthetic web until `target` pages are stored, and writes a JSON report. The crawler needs
+    a real MongoDB: its processes each open their own connection, which an in-process
+    stand-in such as mongomock cannot share, so a throwaway mongod is started unless
+    --mongo-uri points at one (its database is dropped first).
+    """
+    import pymongo
+    workdir = tempfile.mkdtemp(prefix="spidercurl-bench-")
+    ports = multiprocessing.Queue()
+    web = multiprocessing.Process(target=_serve_synthetic_web, args=(args, ports), daemon=True)
+    web.start()
+    hosts = ports.get(timeout=30)
+    mongod = None
+    crawler = None
+    try:
+        uri = args.mongo_uri
+        if uri is None:
+            mongod_path = shutil.which(args.mongod) or args.mongod
+            os.makedirs(os.path.join(workdir, "mongo"))
+            mongod, uri = _start_mongod(mongod_path, os.path.join(workdir, "mongo"))
+        db = pymongo.MongoClient(uri)[args.db]
+        db.client.drop_database(args.db)
+
+        metrics_port = _free_port()
+        bench_config = toml.load("config.toml")
+        bench_config.update({
+            "uri": uri, "db": args.db,
+            "start_urls": [f"http://{host}/p/0" for host in hosts],
+            "multiprocess": args.workers, "multiprocessForThreads": args.fetchers,
+            "max_in_flight": args.in_flight, "batch_size": args.batch_size, "autoscale": args.autoscale,
+            "crawl_delay": args.crawl_delay, "crawl_delays": {},
+            "revisit_pages": False, "metrics_port": metrics_port, "trace_sample_rate": args.trace_rate,
+            "stats_interval": 10,
+        })
+        for key in ("seen_filter_path", "index_path", "archive_path", "link_graph_path", "trace_path", "profile_path", "spill_path"):
+            bench_config[key] = os.path.join(workdir, key.rsplit("_", 1)[0])
+        with open(os.path.join(workdir, "config.toml"), "w") as f:
+            toml.dump(bench_config, f)
+
+        log = open(os.path.join(workdir, "crawler.log"), "w")
+        start = time.monotonic()
+        crawler = subprocess.Popen([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")],
+                                   cwd=workdir, stdout=log, stderr=subprocess.STDOUT, start_new_session=True)
+        print(f"Crawling {len(hosts)} hosts x {args.pages_per_host} pages with {args.fetchers} fetchers and "
+              f"{args.workers} parsers; log in {log.name}")
+        timeline = []
+        scraped = {}
+        while True:
+            time.sleep(1)
+            stored = db["webpages"].estimated_document_count()
+            timeline.append((time.monotonic() - start, stored))
+            scraped = _scrape(metrics_port) or scraped
+            if stored >= args.target or time.monotonic() - start > args.timeout or crawler.poll() is not None:
+                break
+        elapsed = time.monotonic() - start
+        if crawler.poll() is not None:
+            print(f"The crawler exited early with code {crawler.returncode}, see {log.name}")
+        traces = tracing.TraceLog(bench_config["trace_path"]).read_all()
+        report = {"parameters": {key: value for key, value in vars(args).items() if key != "func"},
+                  "started": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                  "results": _crawl_report(args, hosts, elapsed, timeline, traces, scraped, db)}
+    finally:
+        if crawler is not None and crawler.poll() is None:
+            # SIGTERM to the main process drains the crawler; its children are stopped by it
+            crawler.send_signal(signal.SIGTERM)
+            try:
+                crawler.wait(args.drain_timeout)
+            except subprocess.TimeoutExpired:
+                print("The crawler did not drain in time, killing it")
+            try:
+                os.killpg(crawler.pid, signal.SIGKILL)  # And whatever it left behind
+            except ProcessLookupError:
+                pass
+        if mongod is not None:
+            mongod.terminate()
+            mongod.wait()
+        web.terminate()
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    results = report["results"]
+    print(json.dumps(results, indent=2))
+    output = args.output or f"bench-crawl-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Report written to {output}")
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+        for key in ("pages_per_second", "page_latency_p50_seconds", "page_latency_p99_seconds"):
+            before, after = baseline.get(key), results.get(key)
+            if before and after is not None:
+                print(f"{key}: {before} -> {after} ({(after - before) / before:+.1%})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="SpiderCurl local benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    fetch = commands.add_parser("fetch", help="per-URL httpx.Client threads vs the shared asyncio client")
+    fetch.add_argument("--urls", type=int, default=2000)
+    fetch.add_argument("--threads", type=int, default=33)
+    fetch.add_argument("--in-flight", type=int, default=200)
+    fetch.add_argument("--latency", type=float, default=0.05, help="simulated server latency in seconds")
+    fetch.add_argument("--body-size", type=int, default=20_000)
+    fetch.set_defaults(func=bench_fetch)
+
+    canonical = commands.add_parser("canonicalize", help="frontier growth saved by URL canonicalization on a link corpus")
+    canonical.add_argument("corpus", help="text file with one recorded link per line")
+    canonical.set_defaults(func=bench_canonicalize)
+
+    parse = commands.add_parser("parse", help="extraction speed per parser backend and parity with the BeautifulSoup output")
+    parse.add_argument("--pages", help="folder of saved .html pages (synthetic pages when omitted)")
+    parse.add_argument("--count", type=int, default=500, help="number of synthetic pages")
+    parse.add_argument("--backends", nargs="+", default=["bs4", "lxml", "html.parser"],
+                       help="the first backend is the parity reference")
+    parse.set_defaults(func=bench_parse)
+
+    ipc = commands.add_parser("ipc", help="fetcher -> parser -> db hand-off: pickled queue items vs shared memory")
+    ipc.add_argument("--count", type=int, default=2000)
+    ipc.add_argument("--repeat", type=int, default=5, help="multiplies the synthetic page size")
+    ipc.add_argument("--slots", type=int, default=64)
+    ipc.set_defaults(func=bench_ipc)
+
+    index = commands.add_parser("index", help="search index build rate and BM25 top-k query latency on a Zipf corpus")
+    index.add_argument("--docs", type=int, default=50_000)
+    index.add_argument("--vocabulary", type=int, default=50_000)
+    index.add_argument("--words", type=int, default=300, help="words per document")
+    index.add_argument("--segment-docs", type=int, default=searchindex.SEGMENT_DOCS)
+    index.add_argument("--queries", type=int, default=1000)
+    index.add_argument("-k", type=int, default=10)
+    index.add_argument("--update-batches", type=int, default=200, help="incremental batches indexed after the build")
+    index.add_argument("--batch-size", type=int, default=100, help="pages per incremental batch")
+    index.set_defaults(func=bench_index)
+
+    simulation = commands.add_parser("frontier", help="PageRank captured per fetched byte by frontier ordering on a synthetic web")
+    simulation.add_argument("--pages", type=int, default=20_000)
+    simulation.add_argument("--hosts", type=int, default=500)
+    simulation.add_argument("--seeds", type=int, default=10)
+    simulation.add_argument("--budget", type=float, default=0.3, help="fraction of the pages the crawl may fetch")
+    simulation.add_argument("--policies", nargs="+", default=["fifo", "random", "inlinks", "opic"],
+                            help="opic is the frontier.priority ordering the task manager uses")
+    simulation.set_defaults(func=bench_frontier)
+
+    pages_archive = commands.add_parser("archive", help="page archive compression ratio, write rate and mmap read latency")
+    pages_archive.add_argument("--pages", help="folder of saved .html pages (synthetic pages when omitted)")
+    pages_archive.add_argument("--count", type=int, default=5000, help="number of synthetic pages")
+    pages_archive.add_argument("--segment-bytes", type=int, default=64 << 20)
+    pages_archive.add_argument("--level", type=int, default=archive.LEVEL)
+    pages_archive.add_argument("--reads", type=int, default=5000)
+    pages_archive.set_defaults(func=bench_archive)
+
+    metric_updates = commands.add_parser("metrics", help="cost of metric updates in a hot loop and of a scrape across processes")
+    metric_updates.add_argument("--updates", type=int, default=1_000_000)
+    metric_updates.add_argument("--hosts", type=int, default=1000, help="distinct hosts, more than metrics_max_series")
+    metric_updates.add_argument("--page-ms", type=float, default=5.0, help="typical fetch + parse cost per page to compare with")
+    metric_updates.add_argument("--processes", type=int, default=8)
+    metric_updates.set_defaults(func=bench_metrics)
+
+    crawl = commands.add_parser("crawl", help="full crawler against a local synthetic web; JSON report of throughput, latency, CPU and RSS")
+    crawl.add_argument("--hosts", type=int, default=20)
+    crawl.add_argument("--pages-per-host", type=int, default=500)
+    crawl.add_argument("--links", type=int, default=10, help="links per page")
+    crawl.add_argument("--cross-host", type=float, default=0.3, help="fraction of links to another host")
+    crawl.add_argument("--page-bytes", type=int, default=20_000)
+    crawl.add_argument("--latency", type=float, default=0.02, help="seconds every response takes")
+    crawl.add_argument("--slow-hosts", type=float, default=0.1, help="fraction of hosts with --slow-latency on top")
+    crawl.add_argument("--slow-latency", type=float, default=0.5)
+    crawl.add_argument("--error-rate", type=float, default=0.02, help="fraction of responses that are 500s")
+    crawl.add_argument("--seed", type=int, default=7)
+    crawl.add_argument("--target", type=int, default=2000, help="stop once this many pages are stored")
+    crawl.add_argument("--timeout", type=float, default=600)
+    crawl.add_argument("--fetchers", type=int, default=2)
+    crawl.add_argument("--workers", type=int, default=4)
+    crawl.add_argument("--in-flight", type=int, default=100)
+    crawl.add_argument("--batch-size", type=int, default=100)
+    crawl.add_argument("--autoscale", action="store_true", help="let the autoscaler resize from --workers and --in-flight")
+    crawl.add_argument("--crawl-delay", type=float, default=0.05)
+    crawl.add_argument("--trace-rate", type=float, default=1.0, help="trace_sample_rate, the source of the latency percentiles")
+    crawl.add_argument("--mongod", default="mongod", help="mongod binary for the throwaway database")
+    crawl.add_argument("--mongo-uri", help="use this MongoDB instead of starting one")
+    crawl.add_argument("--db", default="SpiderCurlBench")
+    crawl.add_argument("--output", help="JSON report path (default bench-crawl-<time>.json)")
+    crawl.add_argument("--compare", help="earlier JSON report to print the change against")
+    crawl.add_argument("--drain-timeout", type=float, default=120, help="seconds the crawler gets to shut down cleanly")
+    crawl.add_argument("--keep", action="store_true", help="keep the working folder (config, crawler log, data)")
+    crawl.set_defaults(func=bench_crawl)
+
+    args = parser.parse_args()
+    args.func(args)
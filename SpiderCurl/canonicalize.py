@@ -0,0 +1,126 @@
+# URL canonicalization so trivially different links map to a single crawl task
+import fnmatch
+import functools
+import re
+import urllib.parse
+from typing import Optional
+
+import toml
+
+config = toml.load("config.toml")
+rules = config.get("canonicalize", {})
+
+STRIP_FRAGMENT = rules.get("strip_fragment", True)
+SORT_QUERY = rules.get("sort_query", True)
+STRIP_TRAILING_SLASH = rules.get("strip_trailing_slash", True)
+ALLOWED_SCHEMES = tuple(rules.get("allowed_schemes", ["http", "https"]))
+QUERY_DENYLIST = rules.get("query_denylist", [
+    "utm_*", "fbclid", "gclid", "dclid", "msclkid", "mc_cid", "mc_eid", "_ga", "igshid", "yclid",
+])
+HOST_CACHE_SIZE = rules.get("host_cache_size", 65536)
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+_denied_param = re.compile("|".join(fnmatch.translate(p) for p in QUERY_DENYLIST) or r"(?!)", re.IGNORECASE)
+_percent_escape = re.compile(r"%([0-9A-Fa-f]{2})")
+_UNRESERVED = frozenset("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-._~")
+# Characters left as they are when percent-encoding a path or query (RFC 3986 reserved + '%')
+_PATH_SAFE = "/%:@!$&'()*+,;=-._~"
+_QUERY_SAFE = _PATH_SAFE + "?"
+
+
+def _normalize_escape(match) -> str:
+    char = chr(int(match.group(1), 16))
+    return char if char in _UNRESERVED else "%" + match.group(1).upper()
+
+
+def _normalize_percent_encoding(part: str, safe: str) -> str:
+    # Encode raw non-ASCII/space characters, then decode escapes of unreserved characters
+    # and upper-case the rest, so "%7e", "~" and "%7E" all become "~"
+    if not part.isascii() or " " in part:
+        part = urllib.parse.quote(part, safe=safe)
+    if "%" in part:
+        part = _percent_escape.sub(_normalize_escape, part)
+    return part
+
+
+@functools.lru_cache(maxsize=HOST_CACHE_SIZE)
+def _canonical_netloc(scheme: str, netloc: str) -> Optional[str]:
+    """Lower-cased, IDNA-encoded host with the scheme's default port removed. Cached since few hosts are hot."""
+    userinfo, _, hostport = netloc.rpartition("@")
+    if hostport.startswith("["):  # IPv6 literal
+        host, _, port = hostport.partition("]")
+        host += "]"
+        port = port[1:]
+    else:
+        host, _, port = hostport.partition(":")
+    host = host.rstrip(".").lower()
+    if not host:
+        return None
+    if not host.isascii():
+        try:
+            host = host.encode("idna").decode("ascii")
+        except UnicodeError:
+            return None
+    if port:
+        if not port.isdigit():
+            return None
+        if int(port) == DEFAULT_PORTS.get(scheme):
+            port = ""
+    netloc = host + (":" + str(int(port)) if port else "")
+    return (userinfo + "@" + netloc) if userinfo else netloc
+
+
+def _remove_dot_segments(path: str) -> str:
+    if "/." not in path:
+        return path
+    output = []
+    for segment in path.split("/"):
+        if segment == "..":
+            if len(output) > 1:
+                output.pop()
+        elif segment != ".":
+            output.append(segment)
+    if path.endswith(("/.", "/..")):
+        output.append("")
+    return "/".join(output) or "/"
+
+
+def _canonical_query(query: str) -> str:
+    params = []
+    for param in query.split("&"):
+        if not param:
+            continue
+        key = param.split("=", 1)[0]
+        if _denied_param.match(urllib.parse.unquote_plus(key)):
+            continue
+        params.append(_normalize_percent_encoding(param, _QUERY_SAFE))
+    if SORT_QUERY:
+        params.sort()
+    return "&".join(params)
+
+
+def canonicalize_url(url: str, base_url: Optional[str] = None) -> Optional[str]:
+    """
+    Returns the canonical form of `url` (resolved against `base_url` if given), or None
+    when it should not be crawled at all (scheme not allowed, no host, unparsable).
+    """
+    try:
+        if base_url:
+            url = urllib.parse.urljoin(base_url, url.strip())
+        parts = urllib.parse.urlsplit(url.strip())
+    except ValueError:
+        return None
+
+    scheme = parts.scheme.lower()
+    if scheme not in ALLOWED_SCHEMES:
+        return None
+    netloc = _canonical_netloc(scheme, parts.netloc)
+    if netloc is None:
+        return None
+
+    path = _remove_dot_segments(_normalize_percent_encoding(parts.path, _PATH_SAFE)) or "/"
+    if STRIP_TRAILING_SLASH and len(path) > 1 and path.endswith("/"):
+        path = path.rstrip("/") or "/"
+    query = _canonical_query(parts.query) if parts.query else ""
+    fragment = "" if STRIP_FRAGMENT else parts.fragment
+    return urllib.parse.urlunsplit((scheme, netloc, path, query, fragment))
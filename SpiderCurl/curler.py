@@ -1,49 +1,213 @@
 import requests
 import asyncio
+import codecs
+import re
 import httpx
+import toml
+import models
+import dnscache
+import robots
+from canonicalize import canonicalize_url
 
-def fetch_url(url):
-    with httpx.Client() as client:
-        try:
-            headers = {
-                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3"
-            }
-            response = client.get(url, headers=headers)
+config = toml.load("config.toml")
+
+MAX_BODY_BYTES = config.get("max_body_bytes", 5 * 1024 * 1024)  # Bodies are cut off after this many bytes
+MAX_REDIRECTS = config.get("max_redirects", 5)  # Redirect hops followed within one fetch
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+SNIFF_BYTES = 1024  # How far into the body a <meta charset> is looked for
+_META_CHARSET = re.compile(rb'<meta[^>]+charset\s*=\s*["\']?\s*([a-zA-Z0-9_\-:.]+)', re.IGNORECASE)
+
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3"
+}
+
+def _http2_available():
+    # HTTP/2 needs the optional h2 package (pip install httpx[http2])
+    if not config.get("http2", True):
+        return False
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+def create_async_client(dns_cache=None, max_connections=None):
+    """
+    Builds the single AsyncClient a fetch process shares between all of its fetches,
+    so connections are kept alive and pooled per host instead of re-opened per URL.
+    With a dnscache.DNSCache, new connections resolve their host through it. The pool holds
+    max_connections (default max_in_flight); it must cover every fetch that can be in
+    flight, or the ones past it fail with PoolTimeout.
+    """
+    if max_connections is None:
+        max_connections = config.get("max_in_flight", 100)
+    limits = httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=config.get("max_keepalive_connections", max_connections),
+        keepalive_expiry=config.get("keepalive_expiry", 30),
+    )
+    transport = httpx.AsyncHTTPTransport(http2=_http2_available(), limits=limits)
+    if dns_cache is not None:
+        # httpx has no public hook for the network backend; wrap the one its httpcore pool uses
+        pool = transport._pool
+        pool._network_backend = dnscache.CachingNetworkBackend(pool._network_backend, dns_cache)
+    return httpx.AsyncClient(
+        headers=HEADERS,
+        transport=transport,
+        timeout=httpx.Timeout(config.get("fetch_timeout", 20)),
+    )
+
+def _retry_after(response):
+    value = response.headers.get("Retry-After")
+    if value and value.strip().isdigit():
+        return float(value)
+    return None
+
+def _is_html(content_type):
+    return (content_type.startswith('text/html') or 
+            content_type.startswith('application/xhtml') or 
+            content_type.startswith('application/xml') or
+            'text/' in content_type)
+
+def _header_charset(content_type):
+    for param in content_type.split(';')[1:]:
+        name, _, value = param.partition('=')
+        if name.strip() == 'charset' and value.strip():
+            return value.strip().strip('"\'')
+    return None
+
+def _sniff_charset(head):
+    # BOM first, then a <meta charset> / http-equiv declaration in the first kilobyte
+    for bom, encoding in ((codecs.BOM_UTF8, 'utf-8-sig'), (codecs.BOM_UTF16_LE, 'utf-16'), (codecs.BOM_UTF16_BE, 'utf-16')):
+        if head.startswith(bom):
+            return encoding
+    match = _META_CHARSET.search(head[:SNIFF_BYTES])
+    return match.group(1).decode('ascii', 'ignore') if match else None
+
+def decode_body(body, encoding):
+    """Decodes kept body bytes (bytes or a memoryview into shared memory) with the detected charset."""
+    try:
+        return str(body, encoding or 'utf-8', 'replace')
+    except LookupError:
+        return str(body, 'utf-8', 'replace')
+
+async def _read_capped(response, max_bytes):
+    """
+    Reads the body chunk by chunk, stopping at max_bytes. The charset comes from the header,
+    or is sniffed from the first kilobyte as soon as it has arrived. Decoding is left to the
+    parser process, so only the kept bytes are ever decoded, and only once.
+    Returns (body, encoding, truncated).
+    """
+    encoding = _header_charset(response.headers.get('Content-Type', '').lower())
+    parts = []
+    size = 0
+    truncated = False
+    async for chunk in response.aiter_bytes():
+        if size + len(chunk) > max_bytes:
+            chunk = chunk[:max_bytes - size]
+            truncated = True
+        parts.append(chunk)
+        size += len(chunk)
+        if encoding is None and size >= SNIFF_BYTES:
+            encoding = _sniff_charset(b''.join(parts)[:SNIFF_BYTES]) or 'utf-8'
+        if truncated:
+            break
+    body = b''.join(parts)
+    if encoding is None:
+        encoding = _sniff_charset(body) or 'utf-8'
+    return body, encoding, truncated
+
+def _conditional_headers(validators):
+    headers = {}
+    if validators:
+        if validators.get("etag"):
+            headers["If-None-Match"] = validators["etag"]
+        if validators.get("last_modified"):
+            headers["If-Modified-Since"] = validators["last_modified"]
+    return headers
+
+async def fetch_url(client, url, validators=None, rules=None):
+    """
+    Fetches a page. With `validators` (the stored page's etag / last_modified) the request is
+    conditional and an unchanged page comes back as status 304 with no body. Redirects within
+    the URL's origin are followed up to MAX_REDIRECTS hops, where `rules` (the origin's
+    robots.RobotsRules) allow the target. Any other redirect comes back with its status,
+    the canonical target in redirect_url and no body: the caller sends it through the
+    frontier, behind the target's own robots.txt and crawl delay.
+    """
+    location = url
+    for _ in range(MAX_REDIRECTS + 1):
+        result = await _fetch_once(client, url, location, validators if location == url else None)
+        if result.status_code not in REDIRECT_STATUSES or result.redirect_url is None:
+            if location != url and result.status_code is not None:
+                result.redirected = True
+                result.redirect_url = location
+            return result
+        target = result.redirect_url
+        if robots.origin_of(target) != robots.origin_of(url) or (rules is not None and not rules.allowed(target)):
+            return result
+        location = target
+    print(f"Too many redirects for {url}")
+    return models.fetchResult(url, status_code=result.status_code, skip_reason=f"more than {MAX_REDIRECTS} redirects")
+
+async def _fetch_once(client, url, location, validators=None):
+    # One request for `url`, made to `location` (url itself, or where a redirect pointed)
+    try:
+        async with client.stream("GET", location, headers=_conditional_headers(validators)) as response:
+            etag = response.headers.get('ETag')
+            last_modified = response.headers.get('Last-Modified')
+            if response.status_code == 304 and validators:
+                return models.fetchResult(url, status_code=304, etag=etag or validators.get("etag"),
+                                          last_modified=last_modified or validators.get("last_modified"))
+            if response.status_code in REDIRECT_STATUSES:
+                target = canonicalize_url(response.headers.get("Location") or "", location)
+                if target is None:
+                    return models.fetchResult(url, status_code=response.status_code, skip_reason="redirect without a crawlable Location")
+                return models.fetchResult(url, status_code=response.status_code, redirected=True, redirect_url=target)
             response.raise_for_status()
             
-            # Check if the response is HTML - if not, skip it
+            # Decide from the headers alone whether the body is worth downloading
             content_type = response.headers.get('Content-Type', '').lower()
-            if not (content_type.startswith('text/html') or 
-                    content_type.startswith('application/xhtml') or 
-                    content_type.startswith('application/xml') or
-                    'text/' in content_type):
+            if not _is_html(content_type):
                 print(f"Skipping non-HTML URL: {url} (Content-Type: {content_type})")
-                return False, None, None
+                return models.fetchResult(url, status_code=response.status_code, skip_reason=f"non-HTML content type: {content_type or 'none'}")
+            content_length = response.headers.get('Content-Length', '')
+            if content_length.isdigit() and int(content_length) > MAX_BODY_BYTES:
+                print(f"Skipping oversized URL: {url} ({content_length} bytes)")
+                return models.fetchResult(url, status_code=response.status_code, skip_reason=f"body of {content_length} bytes exceeds max_body_bytes")
             
-            return False, response, None
-        except httpx.HTTPStatusError as e:
-            # Handle HTTP errors (4xx, 5xx)
-            if e.response.status_code == 301 or e.response.status_code == 302:
-                redirect_url = e.response.headers.get("Location")
-                if redirect_url:
-                    doesnt, response, matter = fetch_url(redirect_url)  # Recursively follow redirect
-                    return True, response, redirect_url
-            print(f"HTTP {e.response.status_code} error for {url}")
-            return False, None, None
-        except (httpx.UnsupportedProtocol, httpx.ReadTimeout, httpx.ConnectTimeout) as e:
-            print(f"Network error for {url}: {type(e).__name__}")
-            return False, None, None
-        except Exception as e:
-            print(f"Unexpected error for {url}: {e}")
-            return False, None, None
+            body, encoding, truncated = await _read_capped(response, MAX_BODY_BYTES)
+            if truncated:
+                print(f"Truncated {url} at {MAX_BODY_BYTES} bytes")
+            return models.fetchResult(url, response=response, status_code=response.status_code, body=body, encoding=encoding,
+                                      truncated=truncated, etag=etag, last_modified=last_modified)
+    except httpx.HTTPStatusError as e:
+        # Handle HTTP errors (4xx, 5xx)
+        print(f"HTTP {e.response.status_code} error for {url}")
+        return models.fetchResult(url, status_code=e.response.status_code, retry_after=_retry_after(e.response))
+    except (httpx.UnsupportedProtocol, httpx.ReadTimeout, httpx.ConnectTimeout) as e:
+        print(f"Network error for {url}: {type(e).__name__}")
+        return models.fetchResult(url)
+    except Exception as e:
+        print(f"Unexpected error for {url}: {e}")
+        return models.fetchResult(url)
+
+async def fetch_robots(client, origin):
+    """Fetches an origin's robots.txt, following redirects. Returns (status_code, text), status None on network errors."""
+    try:
+        async with client.stream("GET", robots.robots_url(origin), follow_redirects=True) as response:
+            if not 200 <= response.status_code < 300:
+                return response.status_code, None
+            body, encoding, _ = await _read_capped(response, robots.MAX_BYTES)
+            return response.status_code, decode_body(body, encoding)
+    except Exception as e:
+        print(f"robots.txt fetch error for {origin}: {type(e).__name__}")
+        return None, None
 
 def get_image_size(url):
     try:
-        headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3"
-        }
         # Use a HEAD request to only fetch headers
-        response = requests.head(url, headers=headers)
+        response = requests.head(url, headers=HEADERS)
         # Raise an exception for bad status codes
         response.raise_for_status()
 
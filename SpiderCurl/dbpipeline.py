@@ -0,0 +1,201 @@
+# Batching and pipelined Mongo writes for the database manager process
+import queue
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import List
+
+import metrics
+import mongo
+import models
+import revisit
+import tracing
+import frontier
+
+
+BATCH_SECONDS = metrics.histogram("spidercurl_db_batch_seconds", "Time of one database pipeline stage on a batch", ("stage",))
+BATCH_PAGES = metrics.counter("spidercurl_db_pages_total", "Pages through each database pipeline stage", ("stage",))
+BATCH_ERRORS = metrics.counter("spidercurl_db_batch_errors_total", "Batches a database pipeline stage failed on", ("stage",))
+
+
+def next_batch(webpage_queue, batch_size: int, max_wait: float) -> List[models.WebPage]:
+    """
+    Blocks until batch_size pages have arrived or max_wait seconds have passed since the
+    first one, whichever comes first. Returns an empty list if nothing arrived in max_wait.
+    """
+    try:
+        batch = [models.unpack_webpage(webpage_queue.get(timeout=max_wait))]
+    except queue.Empty:
+        return []
+    deadline = time.monotonic() + max_wait
+    while len(batch) < batch_size:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            batch.append(models.unpack_webpage(webpage_queue.get(timeout=remaining)))
+        except queue.Empty:
+            break
+    return batch
+
+
+class StageStats:
+    """Batch latency and throughput of one pipeline stage since the last report."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.latencies = deque(maxlen=1000)
+        self.pages = 0
+        self.errors = 0
+        self.lock = threading.Lock()
+
+    def record(self, pages: int, seconds: float):
+        with self.lock:
+            self.latencies.append(seconds)
+            self.pages += pages
+            BATCH_SECONDS.observe(seconds, self.name)
+            BATCH_PAGES.inc(self.name, amount=pages)
+
+    def report(self, elapsed: float) -> str:
+        with self.lock:
+            latencies = sorted(self.latencies)
+            pages, errors = self.pages, self.errors
+            self.latencies.clear()
+            self.pages = self.errors = 0
+        if not latencies:
+            return f"{self.name}: idle" + (f", {errors} errors" if errors else "")
+        p50 = latencies[len(latencies) // 2] * 1000
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000
+        return (f"{self.name}: {len(latencies)} batches, {pages / elapsed:.1f} pages/s, "
+                f"p50 {p50:.0f} ms, p99 {p99:.0f} ms" + (f", {errors} errors" if errors else ""))
+
+
+class WritePipeline:
+    """
+    Runs the three writes of a batch on their own threads so ingest is not held up by the
+    slowest query: page upserts and link dedup / task creation run side by side, and task
+    removal follows a batch's upsert (a task is only deleted once its page is stored). Each
+    stage holds at most in_flight_batches waiting batches; submit() blocks beyond that, which
+    in turn stops the database manager from draining webpage_queue. Upserted batches are also
+    appended to index_log, if given, for the indexer process.
+
+    With a near_duplicates SimHashIndex, a page whose text nearly matches a stored page is
+    kept only as a pointer to it (duplicate_of), is not indexed, and its links are dropped
+    unless expand_duplicate_links.
+
+    With track_freshness, every stored page (or 304) also gets its change counters, change
+    rate and next_revisit_at updated for the revisit scheduler. Outlinks go to link_log, if
+    given, for the link graph; with robots (a robots.RobotsCache) links their robots.txt
+    disallows are not turned into tasks. Sampled pages' traces go to trace_log once stored.
+    """
+
+    def __init__(self, db, seen, in_flight_batches: int = 2, index_log=None, near_duplicates=None,
+                 expand_duplicate_links: bool = False, track_freshness: bool = False, link_log=None, robots=None, trace_log=None):
+        self.db = db
+        self.trace_log = trace_log
+        self.robots = robots
+        self.link_log = link_log
+        self.track_freshness = track_freshness
+        self.seen = seen
+        self.index_log = index_log
+        self.near_duplicates = near_duplicates
+        self.expand_duplicate_links = expand_duplicate_links
+        self.duplicates = 0
+        self.upserts = queue.Queue(maxsize=in_flight_batches)
+        self.links = queue.Queue(maxsize=in_flight_batches)
+        self.removals = queue.Queue(maxsize=in_flight_batches)
+        self.stats = [StageStats("upsert"), StageStats("links"), StageStats("remove")]
+        self.last_report = time.monotonic()
+        for stage_queue, stage, stats in zip((self.upserts, self.links, self.removals),
+                                             (self._upsert, self._create_tasks, self._remove_tasks), self.stats):
+            threading.Thread(target=self._run_stage, args=(stage_queue, stage, stats), daemon=True).start()
+
+    def submit(self, batch: List[models.WebPage]):
+        for webpage in batch:
+            tracing.mark(webpage.trace, "batched")
+        if self.near_duplicates is not None:
+            self._mark_duplicates(batch)
+        self.upserts.put(batch)
+        self.links.put(batch)
+
+    def drain(self):
+        """Waits until every submitted batch has gone through all stages."""
+        self.upserts.join()
+        self.links.join()
+        self.removals.join()
+
+    def report(self) -> str:
+        now = time.monotonic()
+        elapsed, self.last_report = max(now - self.last_report, 1e-9), now
+        duplicates, self.duplicates = self.duplicates, 0
+        return ("Database pipeline | " + " | ".join(stats.report(elapsed) for stats in self.stats)
+                + (f" | {duplicates} near-duplicates" if self.near_duplicates is not None else ""))
+
+    def _run_stage(self, stage_queue, stage, stats):
+        while True:
+            batch = stage_queue.get()
+            start = time.perf_counter()
+            try:
+                stage(batch)
+                stats.record(len(batch), time.perf_counter() - start)
+            except Exception as e:
+                # The batch's tasks stay in_progress and are re-claimed when their lease expires
+                with stats.lock:
+                    stats.errors += 1
+                    BATCH_ERRORS.inc(stats.name)
+                print(f"Database pipeline {stats.name} error: {e}")
+            finally:
+                stage_queue.task_done()
+
+    def _mark_duplicates(self, batch):
+        # Runs on the submitting thread only, so the fingerprint index needs no lock
+        for webpage in batch:
+            if webpage.not_modified:
+                continue
+            if webpage.simhash is None:
+                self.near_duplicates.remove(webpage.url)
+                continue
+            original = self.near_duplicates.find(webpage.simhash, exclude=webpage.url)
+            if original is None:
+                self.near_duplicates.add(webpage.url, webpage.simhash)
+                continue
+            self.near_duplicates.remove(webpage.url)
+            webpage.duplicate_of = original
+            webpage.text_content = None
+            webpage.image_data = []
+            if not self.expand_duplicate_links:
+                webpage.extracted_urls = []
+            self.duplicates += 1
+
+    def _upsert(self, batch):
+        freshness = None
+        if self.track_freshness:
+            previous = mongo.page_freshness(self.db, [webpage.url for webpage in batch])
+            now = datetime.utcnow()
+            freshness = {webpage.url: revisit.freshness_update(previous.get(webpage.url), webpage, now) for webpage in batch}
+        mongo.insert_many_webpages(self.db, batch, freshness)
+        traced = [webpage for webpage in batch if webpage.trace]
+        if traced and self.trace_log is not None:
+            for webpage in traced:
+                tracing.mark(webpage.trace, "persisted")
+            self.trace_log.append([(webpage.url, webpage.trace) for webpage in traced])
+        if self.index_log is not None:
+            self.index_log.append([webpage for webpage in batch if webpage.duplicate_of is None and not webpage.not_modified])
+            # A page that turned into a near-duplicate must stop matching with its old text
+            self.index_log.remove([webpage.url for webpage in batch if webpage.duplicate_of is not None])
+        # Redirect targets are stored pages too, so links to them must not become tasks
+        self.seen.add_many([webpage.redirect_url for webpage in batch if webpage.redirect_url])
+        self.removals.put([webpage.url for webpage in batch])
+
+    def _create_tasks(self, batch):
+        # Every fetched page passes its OPIC cash on to the pages it links to
+        mongo.add_host_links(self.db, frontier.cross_host_links(batch))
+        credits = frontier.credit_outlinks(batch)
+        if credits:
+            mongo.create_many_tasks(self.db, list(credits), self.seen, credits, self.robots)
+        if self.link_log is not None:
+            self.link_log.append(batch)
+
+    def _remove_tasks(self, urls):
+        mongo.remove_tasks(self.db, urls)
@@ -0,0 +1,183 @@
+# Caching DNS resolver for the fetchers: one lookup per host and TTL instead of one per connection
+import asyncio
+import ipaddress
+import socket
+import time
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+import httpcore
+import toml
+
+try:
+    import aiodns  # Optional: asynchronous lookups through c-ares that come with the record TTLs
+except ImportError:
+    aiodns = None
+
+config = toml.load("config.toml")
+
+DEFAULT_TTL = config.get("dns_default_ttl", 300)  # Seconds an answer is kept when the lookup gives no TTL
+MIN_TTL = config.get("dns_min_ttl", 30)
+MAX_TTL = config.get("dns_max_ttl", 3600)
+NEGATIVE_TTL = config.get("dns_negative_ttl", 60)  # Seconds a failed lookup is remembered
+MAX_ENTRIES = config.get("dns_cache_size", 100000)
+LATENCY_SAMPLES = 1000  # Lookup latencies kept for the p50 / p99 report
+
+
+def _is_ip(host: str) -> bool:
+    try:
+        ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    return True
+
+
+class DNSCache:
+    """
+    Resolver of one fetcher process. Hosts are sharded over the fetchers
+    (scheduler.shard_for_host), so each host is only ever looked up by one process and the
+    per-process cache is already the crawl-wide one. Answers are kept for their TTL
+    (aiodns) or DEFAULT_TTL (getaddrinfo), failures for NEGATIVE_TTL, and concurrent
+    lookups of a host share one query.
+    """
+
+    def __init__(self):
+        self.entries: Dict[str, Tuple[float, Optional[List[str]], Optional[str]]] = {}  # host -> (expires, addresses, error)
+        self.pending: Dict[str, asyncio.Future] = {}
+        self.resolver = None  # aiodns.DNSResolver, created by the first lookup: it needs the running loop
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.prefetches = 0
+        self.failures = 0
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _cached(self, host: str):
+        entry = self.entries.get(host)
+        if entry is not None and entry[0] > time.monotonic():
+            return entry
+        return None
+
+    async def resolve(self, host: str) -> List[str]:
+        """Addresses of `host`; raises socket.gaierror when it does not resolve."""
+        if _is_ip(host):
+            return [host]
+        entry = self._cached(host)
+        if entry is not None:
+            if entry[1] is None:
+                self.negative_hits += 1
+                raise socket.gaierror(socket.EAI_NONAME, entry[2])
+            self.hits += 1
+            return entry[1]
+        lookup = self.pending.get(host)
+        if lookup is None:
+            self.misses += 1
+            lookup = self._start(host)
+        else:
+            self.hits += 1  # Answered by a lookup already under way
+        # Shielded: a caller timing out must not cancel the lookup others are waiting for
+        return await asyncio.shield(lookup)
+
+    def prefetch(self, host: str):
+        """Starts looking up a host coming up in the frontier, so its first fetch finds it cached."""
+        if _is_ip(host) or host in self.pending or self._cached(host) is not None:
+            return
+        self.prefetches += 1
+        self._start(host)
+
+    def _start(self, host: str) -> asyncio.Future:
+        lookup = self.pending[host] = asyncio.ensure_future(self._lookup(host))
+        lookup.add_done_callback(lambda done: self._finished(host, done))
+        return lookup
+
+    def _finished(self, host: str, lookup: asyncio.Future):
+        self.pending.pop(host, None)
+        if not lookup.cancelled():
+            lookup.exception()  # A failed prefetch nobody awaited is not an unhandled error
+
+    async def _lookup(self, host: str) -> List[str]:
+        start = time.monotonic()
+        try:
+            addresses, ttl = await self._query(host)
+        except OSError as e:
+            self.failures += 1
+            self._store(host, None, NEGATIVE_TTL, e.strerror or str(e))
+            raise
+        finally:
+            self.latencies.append(time.monotonic() - start)
+        self._store(host, addresses, min(max(ttl, MIN_TTL), MAX_TTL))
+        return addresses
+
+    async def _query(self, host: str) -> Tuple[List[str], float]:
+        if self.resolver is None and aiodns is not None:
+            self.resolver = aiodns.DNSResolver()
+        if self.resolver is not None:
+            try:
+                records = await self.resolver.query(host, "A")
+                if records:
+                    return [record.host for record in records], min(record.ttl for record in records)
+            except aiodns.error.DNSError:
+                pass  # No A record over DNS: getaddrinfo still sees /etc/hosts and IPv6-only hosts
+        infos = await asyncio.get_running_loop().getaddrinfo(host, None, type=socket.SOCK_STREAM)
+        return list(dict.fromkeys(info[4][0] for info in infos)), DEFAULT_TTL
+
+    def _store(self, host: str, addresses: Optional[List[str]], ttl: float, error: Optional[str] = None):
+        self.entries.pop(host, None)  # Re-inserted, so the dict stays in order of insertion time
+        if len(self.entries) >= MAX_ENTRIES:
+            now = time.monotonic()
+            for expired in [key for key, entry in self.entries.items() if entry[0] <= now]:
+                del self.entries[expired]
+            # Still full of live answers: drop the oldest
+            while len(self.entries) >= MAX_ENTRIES:
+                del self.entries[next(iter(self.entries))]
+        self.entries[host] = (time.monotonic() + ttl, addresses, error)
+
+    def report(self) -> str:
+        requests = self.hits + self.negative_hits + self.misses
+        hit_rate = (self.hits + self.negative_hits) / requests if requests else 0.0
+        latencies = sorted(self.latencies)
+        self.hits = self.negative_hits = self.misses = self.prefetches = self.failures = 0
+        self.latencies.clear()
+        line = f"DNS cache: {requests} resolutions, {hit_rate:.1%} hits, {len(self.entries)} hosts cached"
+        if latencies:
+            p50 = latencies[len(latencies) // 2] * 1000
+            p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000
+            line += f", {len(latencies)} lookups p50 {p50:.1f} ms p99 {p99:.1f} ms"
+        return line
+
+
+class CachingNetworkBackend(httpcore.AsyncNetworkBackend):
+    """
+    httpcore network backend that resolves through a DNSCache and connects to the addresses
+    in turn. TLS still verifies and sends SNI for the URL's host name, which httpcore passes
+    to start_tls separately from the address connected to.
+    """
+
+    def __init__(self, backend: httpcore.AsyncNetworkBackend, cache: DNSCache):
+        self.backend = backend
+        self.cache = cache
+
+    async def connect_tcp(self, host, port, timeout=None, local_address=None, socket_options=None):
+        try:
+            addresses = await asyncio.wait_for(self.cache.resolve(host), timeout)
+        except asyncio.TimeoutError as e:
+            raise httpcore.ConnectTimeout(f"DNS lookup of {host} timed out") from e
+        except OSError as e:
+            raise httpcore.ConnectError(f"DNS lookup of {host} failed: {e}") from e
+        error = None
+        for address in addresses:
+            try:
+                return await self.backend.connect_tcp(address, port, timeout=timeout, local_address=local_address,
+                                                      socket_options=socket_options)
+            except httpcore.ConnectError as e:
+                error = e
+        raise error
+
+    async def connect_unix_socket(self, path, timeout=None, socket_options=None):
+        return await self.backend.connect_unix_socket(path, timeout=timeout, socket_options=socket_options)
+
+    async def sleep(self, seconds):
+        await self.backend.sleep(seconds)
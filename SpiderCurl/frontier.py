@@ -0,0 +1,73 @@
+# Crawl frontier scoring: which pending task is worth fetching next
+import math
+import urllib.parse
+from collections import defaultdict
+from typing import Dict, List
+
+import toml
+
+config = toml.load("config.toml")
+weights = config.get("frontier", {})
+
+CASH_WEIGHT = weights.get("cash_weight", 1.0)
+INLINK_WEIGHT = weights.get("inlink_weight", 0.5)
+HOST_WEIGHT = weights.get("host_weight", 0.25)
+PAGERANK_WEIGHT = weights.get("pagerank_weight", 1.0)
+DEPTH_WEIGHT = weights.get("depth_weight", 0.3)
+CASH_SCALE = weights.get("cash_scale", 10000.0)  # Cash is a fraction of a seed's; scaled so log1p separates small amounts
+SEED_CASH = 1.0
+
+
+def url_depth(url: str) -> int:
+    """Path segments of the URL, plus one for a query string: deep and parameterised URLs rank lower."""
+    parts = urllib.parse.urlsplit(url)
+    return sum(1 for segment in parts.path.split("/") if segment) + (1 if parts.query else 0)
+
+
+def priority(cash: float, inlinks: int, depth: int, host_inlinks: int, pagerank: float = 0.0) -> float:
+    """
+    Frontier priority of a task, highest fetched first. `cash` is its OPIC importance: every
+    fetched page splits its own cash evenly over its outlinks, so a URL accumulates cash in
+    proportion to how important the pages linking to it are. Inlinks and the host's
+    cross-host inlinks stand in for importance the cash has not caught up with yet.
+    `pagerank` is the last batch PageRank of the URL (1 is average, see linkgraph).
+    """
+    return (CASH_WEIGHT * math.log1p(cash * CASH_SCALE)
+            + INLINK_WEIGHT * math.log1p(inlinks)
+            + HOST_WEIGHT * math.log1p(host_inlinks)
+            + PAGERANK_WEIGHT * math.log1p(pagerank)
+            - DEPTH_WEIGHT * depth)
+
+
+def host_of(url: str) -> str:
+    return urllib.parse.urlsplit(url).netloc.lower()
+
+
+def credit_outlinks(webpages) -> Dict[str, List[float]]:
+    """
+    OPIC step for a batch of fetched pages: url -> [cash, inlinks] gained by each linked URL.
+    A page without cash (fetched before cash existed) counts as holding a seed's share.
+    """
+    credits = defaultdict(lambda: [0.0, 0])
+    for webpage in webpages:
+        outlinks = set(webpage.extracted_urls)
+        outlinks.discard(webpage.url)
+        if not outlinks:
+            continue
+        share = (webpage.cash if webpage.cash is not None else SEED_CASH) / len(outlinks)
+        for url in outlinks:
+            credit = credits[url]
+            credit[0] += share
+            credit[1] += 1
+    return credits
+
+
+def cross_host_links(webpages) -> Dict[str, int]:
+    """Links per target host coming from other hosts in the batch, the host authority signal."""
+    counts = defaultdict(int)
+    for webpage in webpages:
+        source = host_of(webpage.url)
+        for host in {host_of(url) for url in webpage.extracted_urls}:
+            if host != source:
+                counts[host] += 1
+    return counts
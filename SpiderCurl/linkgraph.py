@@ -0,0 +1,309 @@
+# Link graph of the crawl in compressed sparse row form, and PageRank over it
+#   python linkgraph.py update     fold the link log written while crawling into the graph
+#   python linkgraph.py pagerank   recompute PageRank and re-score the pending crawl tasks
+import argparse
+import hashlib
+import json
+import os
+import time
+from typing import Dict, Iterable, List
+
+import numpy as np
+import toml
+
+from recordlog import RecordLog
+
+config = toml.load("config.toml")
+
+GRAPH_PATH = config.get("link_graph_path", "data/graph")
+DAMPING = config.get("pagerank_damping", 0.85)
+TOLERANCE = config.get("pagerank_tolerance", 1e-6)  # L1 change between iterations at which PageRank stops
+MAX_ITERATIONS = config.get("pagerank_max_iterations", 100)
+UPDATE_RECORDS = 200000  # Pages folded into the graph per pass over the stored edges
+
+
+def url_hash(url: str) -> int:
+    return int.from_bytes(hashlib.blake2b(url.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+class LinkLog(RecordLog):
+    """
+    Log of fetched pages and their outlinks, (url, [linked urls]) per page, appended by the
+    database manager and folded into the graph by LinkGraph.update. A page's record replaces
+    the outlinks it had in the graph, so a re-fetch that lost links drops their edges.
+    """
+
+    def __init__(self, path: str = os.path.join(GRAPH_PATH, "log")):
+        super().__init__(path)
+
+    def append(self, webpages):
+        super().append([(webpage.url, webpage.extracted_urls) for webpage in webpages
+                        if not webpage.not_modified and webpage.duplicate_of is None])
+
+
+def _save(path: str, name: str, array: np.ndarray):
+    # np.save appends .npy to names without it, so write to a .tmp.npy and rename
+    np.save(os.path.join(path, name + ".tmp.npy"), array)
+    os.replace(os.path.join(path, name + ".tmp.npy"), os.path.join(path, name + ".npy"))
+
+
+class LinkGraph:
+    """
+    The crawl's link graph on disk, memory-mapped when opened:
+      node_hashes   64-bit URL hash of every node, indexed by node id (ids never change)
+      lookup        node hashes sorted, with their ids, to map hashes to ids by binary search
+      urls          the node URLs, one per line, with url_offsets into the file by node id
+      indptr        CSR row pointers: node i links to indices[indptr[i]:indptr[i + 1]]
+      indices       CSR column indices, the linked node ids
+                    (both rewritten whole, so saved under the manifest's edges_version)
+      pagerank      last PageRank, scaled so the average node scores 1
+    """
+
+    def __init__(self, path: str = GRAPH_PATH):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.manifest = self._read_manifest()
+        self._load()
+
+    def _read_manifest(self) -> dict:
+        try:
+            with open(os.path.join(self.path, "manifest.json"), encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"nodes": 0, "edges": 0, "edges_version": 0, "log_position": [0, 0], "pagerank_iterations": None}
+
+    def _write_manifest(self):
+        manifest_path = os.path.join(self.path, "manifest.json")
+        with open(manifest_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(self.manifest, f)
+        os.replace(manifest_path + ".tmp", manifest_path)
+
+    def _edges_name(self, name: str, version: int) -> str:
+        return f"{name}.{version}" if version else name
+
+    def _remove_stale_edges(self):
+        # Edge arrays of versions other than the committed one, left by earlier or interrupted updates
+        current = {self._edges_name(name, self.manifest.get("edges_version", 0)) + ".npy" for name in ("indices", "indptr")}
+        for file_name in os.listdir(self.path):
+            if file_name.startswith(("indices.", "indptr.")) and file_name.endswith(".npy") and file_name not in current:
+                os.remove(os.path.join(self.path, file_name))
+
+    def _array(self, name: str, dtype, empty_length: int = 0) -> np.ndarray:
+        path = os.path.join(self.path, name + ".npy")
+        if not os.path.exists(path):
+            return np.zeros(empty_length, dtype=dtype)
+        return np.load(path, mmap_mode="r")
+
+    def _load(self):
+        # Arrays run ahead of the manifest when an update was interrupted: the manifest's node
+        # count is the commit point, and the update replays the log from its committed position.
+        # The edge arrays cannot be cut back that way, so each update writes a new version of
+        # them and the manifest names the committed one
+        nodes = self.manifest["nodes"]
+        self.node_hashes = self._array("node_hashes", np.uint64)[:nodes]
+        self.url_offsets = self._array("url_offsets", np.int64, 1)[:nodes + 1]
+        self.lookup_hashes = self._array("lookup_hashes", np.uint64)
+        self.lookup_ids = self._array("lookup_ids", np.int64)
+        if len(self.lookup_ids) > nodes:
+            committed = self.lookup_ids < nodes
+            self.lookup_hashes, self.lookup_ids = self.lookup_hashes[committed], self.lookup_ids[committed]
+        version = self.manifest.get("edges_version", 0)
+        self.indptr = self._array(self._edges_name("indptr", version), np.int64, 1)[:nodes + 1]
+        self.indices = self._array(self._edges_name("indices", version), np.int64)
+        self.pagerank = self._array("pagerank", np.float64)
+
+    @property
+    def node_count(self) -> int:
+        return len(self.node_hashes)
+
+    def node_ids(self, hashes: np.ndarray) -> np.ndarray:
+        """Node id of each hash, -1 for hashes not in the graph."""
+        if not len(self.lookup_hashes):
+            return np.full(len(hashes), -1, dtype=np.int64)
+        positions = np.searchsorted(self.lookup_hashes, hashes)
+        positions[positions == len(self.lookup_hashes)] = 0
+        found = self.lookup_hashes[positions] == hashes
+        return np.where(found, self.lookup_ids[positions], -1)
+
+    def url(self, node: int) -> str:
+        with open(os.path.join(self.path, "urls.txt"), "rb") as f:
+            f.seek(self.url_offsets[node])
+            return f.read(self.url_offsets[node + 1] - self.url_offsets[node] - 1).decode("utf-8")
+
+    def iter_urls(self):
+        with open(os.path.join(self.path, "urls.txt"), encoding="utf-8") as f:
+            for line in f:
+                yield line.rstrip("\n")
+
+    def ranks(self, urls: Iterable[str]) -> np.ndarray:
+        """PageRank of each URL (1 is average), 0 for URLs not in the graph or before the first run."""
+        hashes = np.fromiter((url_hash(url) for url in urls), dtype=np.uint64)
+        if not len(self.pagerank):
+            return np.zeros(len(hashes))
+        ids = self.node_ids(hashes)
+        ranks = np.zeros(len(hashes))
+        known = (ids >= 0) & (ids < len(self.pagerank))
+        ranks[known] = self.pagerank[ids[known]]
+        return ranks
+
+    def update(self, log: LinkLog, max_records: int = UPDATE_RECORDS) -> int:
+        """Folds the log into the graph; returns the number of pages read. Only one process may update."""
+        total = 0
+        while True:
+            records, position = log.read(tuple(self.manifest["log_position"]), max_records)
+            if not records:
+                return total
+            self._apply(records)
+            self.manifest["log_position"] = list(position)
+            self._write_manifest()
+            self._remove_stale_edges()
+            log.trim(position)
+            total += len(records)
+
+    def _apply(self, records: List[tuple]):
+        # Hash every URL of the batch once; later records of the same page win
+        outlinks: Dict[int, List[int]] = {}
+        new_urls: Dict[int, str] = {}
+        for url, links in records:
+            source = url_hash(url)
+            new_urls.setdefault(source, url)
+            targets = []
+            for link in links:
+                target = url_hash(link)
+                new_urls.setdefault(target, link)
+                targets.append(target)
+            outlinks[source] = targets
+
+        # New nodes get the next ids, in the order they were first seen
+        batch_hashes = np.fromiter(new_urls.keys(), dtype=np.uint64, count=len(new_urls))
+        unknown = self.node_ids(batch_hashes) < 0
+        added = batch_hashes[unknown]
+        node_hashes = np.concatenate([np.asarray(self.node_hashes), added])
+        if len(added):
+            urls_path = os.path.join(self.path, "urls.txt")
+            with open(urls_path, "r+b" if os.path.exists(urls_path) else "wb") as f:
+                # Cut off lines an interrupted update wrote past the committed offsets
+                f.truncate(int(self.url_offsets[-1]))
+                f.seek(0, os.SEEK_END)
+                lines = [new_urls[int(value)].encode("utf-8") + b"\n" for value in added]
+                f.write(b"".join(lines))
+            lengths = np.fromiter((len(line) for line in lines), dtype=np.int64, count=len(lines))
+            url_offsets = np.concatenate([np.asarray(self.url_offsets), self.url_offsets[-1] + np.cumsum(lengths)])
+            order = np.argsort(node_hashes, kind="stable")
+            _save(self.path, "url_offsets", url_offsets)
+            _save(self.path, "node_hashes", node_hashes)
+            _save(self.path, "lookup_hashes", node_hashes[order])
+            _save(self.path, "lookup_ids", order.astype(np.int64))
+        nodes = self.manifest["nodes"] = len(node_hashes)
+        self._load()
+
+        # New edges: the fetched pages' outlinks, self links left out
+        sources = self.node_ids(np.fromiter(outlinks.keys(), dtype=np.uint64, count=len(outlinks)))
+        counts = np.fromiter((len(targets) for targets in outlinks.values()), dtype=np.int64, count=len(outlinks))
+        new_src = np.repeat(sources, counts)
+        new_dst = self.node_ids(np.fromiter((t for targets in outlinks.values() for t in targets), dtype=np.uint64, count=int(counts.sum())))
+        keep = new_src != new_dst
+
+        # Existing edges of the fetched pages are replaced, the rest carried over
+        old_nodes = len(self.indptr) - 1
+        old_src = np.repeat(np.arange(old_nodes, dtype=np.int64), np.diff(self.indptr))
+        replaced = np.zeros(max(old_nodes, 1), dtype=bool)
+        replaced[sources[sources < old_nodes]] = True
+        carried = ~replaced[old_src] if len(old_src) else np.zeros(0, dtype=bool)
+
+        # Sorting by src * nodes + dst gives CSR order and drops duplicate links in one pass
+        keys = np.unique(np.concatenate([old_src[carried] * nodes + np.asarray(self.indices)[carried],
+                                         new_src[keep] * nodes + new_dst[keep]]))
+        src, dst = np.divmod(keys, nodes)
+        if nodes < 2 ** 31:
+            dst = dst.astype(np.int32)
+        indptr = np.zeros(nodes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(src, minlength=nodes), out=indptr[1:])
+        version = self.manifest.get("edges_version", 0) + 1
+        _save(self.path, self._edges_name("indices", version), dst)
+        _save(self.path, self._edges_name("indptr", version), indptr)
+        self.manifest["edges"] = len(dst)
+        self.manifest["edges_version"] = version
+        self._load()
+
+    def compute_pagerank(self, damping: float = DAMPING, tolerance: float = TOLERANCE,
+                         max_iterations: int = MAX_ITERATIONS) -> np.ndarray:
+        """
+        Power iteration over the CSR arrays: each round spreads every node's rank over its
+        out-edges with one bincount, and the rank of nodes without out-edges (not fetched yet,
+        mostly) is spread over all nodes. Saved scaled by the node count, so 1 is average.
+        """
+        nodes = len(self.indptr) - 1
+        if nodes <= 0:
+            return np.zeros(0)
+        out_degree = np.diff(self.indptr)
+        sources = np.repeat(np.arange(nodes, dtype=np.int64), out_degree)
+        indices = np.asarray(self.indices)
+        dangling = out_degree == 0
+        inverse_degree = np.zeros(nodes)
+        inverse_degree[~dangling] = 1.0 / out_degree[~dangling]
+        rank = np.full(nodes, 1.0 / nodes)
+        for iteration in range(1, max_iterations + 1):
+            share = rank * inverse_degree
+            new_rank = np.bincount(indices, weights=share[sources], minlength=nodes) * damping
+            new_rank += (1 - damping + damping * rank[dangling].sum()) / nodes
+            change = np.abs(new_rank - rank).sum()
+            rank = new_rank
+            if change < tolerance:
+                break
+        _save(self.path, "pagerank", rank * nodes)
+        self.manifest["pagerank_iterations"] = iteration
+        self._write_manifest()
+        self._load()
+        return self.pagerank
+
+    def rescore_tasks(self, db, batch_size: int = 1000) -> int:
+        """Stores the PageRank on the pending crawl tasks and recomputes their frontier priority."""
+        import mongo
+        import pymongo
+        import frontier
+
+        updated = 0
+        cursor = db["crawlTasks"].find({"status": "pending"}, {"url": 1, "cash": 1, "inlinks": 1}, batch_size=batch_size)
+        while True:
+            tasks = [task for _, task in zip(range(batch_size), cursor)]
+            if not tasks:
+                return updated
+            ranks = self.ranks(task["url"] for task in tasks)
+            authority = mongo.host_authority(db, {frontier.host_of(task["url"]) for task in tasks})
+            operations = []
+            for task, rank in zip(tasks, ranks):
+                url = task["url"]
+                score = frontier.priority(task.get("cash") or 0.0, task.get("inlinks") or 0, frontier.url_depth(url),
+                                          authority.get(frontier.host_of(url), 0), float(rank))
+                operations.append(pymongo.UpdateOne({"_id": task["_id"], "status": "pending"},
+                                                    {"$set": {"pagerank": float(rank), "priority": score}}))
+            db["crawlTasks"].bulk_write(operations, ordered=False)
+            updated += len(operations)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="NeuroSeek link graph")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("update", help="fold the crawler's link log into the graph")
+    commands.add_parser("pagerank", help="update the graph, recompute PageRank and re-score pending tasks")
+    top = commands.add_parser("top", help="highest ranked URLs")
+    top.add_argument("-n", type=int, default=20)
+    args = parser.parse_args()
+
+    graph = LinkGraph()
+    if args.command in ("update", "pagerank"):
+        start = time.perf_counter()
+        pages = graph.update(LinkLog())
+        print(f"Folded {pages} pages into the graph in {time.perf_counter() - start:.1f}s: "
+              f"{graph.manifest['nodes']} nodes, {graph.manifest['edges']} edges")
+    if args.command == "pagerank":
+        start = time.perf_counter()
+        graph.compute_pagerank()
+        print(f"PageRank converged in {graph.manifest['pagerank_iterations']} iterations, {time.perf_counter() - start:.1f}s")
+        import mongo
+        start = time.perf_counter()
+        print(f"Re-scored {graph.rescore_tasks(mongo.get_db())} pending tasks in {time.perf_counter() - start:.1f}s")
+    if args.command == "top":
+        for node in np.argsort(-np.asarray(graph.pagerank))[:args.n]:
+            print(f"{graph.pagerank[node]:10.2f}  {graph.url(int(node))}")
@@ -1,4 +1,3 @@
-import threading
 import _asyncio
 from django import urls
 from matplotlib.pyplot import title
@@ -9,75 +8,143 @@ import mongo
 import curler
 import processInfo
 import models
+import simhash
+import revisit
+import archive
+import metrics
+import tracing
+import autoscale
+import robots
 import time
 import queue
 import multiprocessing
+import os
+import signal
+import socket
 from collections import defaultdict
+from datetime import datetime
 from urllib.parse import urlparse
-import random
+from canonicalize import canonicalize_url
+from dnscache import DNSCache
+from supervisor import Supervisor, SpillLog, crawler_lock, drain_on_sigterm
+from robots import RobotsCache
+from scheduler import HostScheduler, shard_for_host, host_of
+from seenfilter import open_seen_filter, backfill
+from shmtransport import PageChannel
+from dbpipeline import WritePipeline, next_batch
+from searchindex import IndexLog, IndexWriter
+from simhash import SimHashIndex
+from linkgraph import LinkLog
 
 config = toml.load("config.toml")
 
 StartUrls = config.get("start_urls", ["https://www.en.wikipedia.org", "https://www.wikipedia.org","https://www.nytimes.com/international/"])
+# Seeded and marked seen in the same canonical form as every discovered link
+StartUrls = [url for url in map(canonicalize_url, StartUrls) if url]
 
 multiprocessingThreadsCount = config.get("multiprocessForThreads", 1)
 multiprocessingCount = config.get("multiprocess", 15)
-threadCount = config.get("threads", 5)
+maxInFlight = config.get("max_in_flight", 100)
 batchSize = config.get("batch_size", 1000)
+maxQueuedTasks = config.get("max_queued_tasks", 5000)  # Claimed tasks outstanding at most: queued, scheduled, fetching or being stored
+claimBatch = config.get("claim_batch", 1000)  # Tasks claimed from Mongo per round trip
+batchMaxWait = config.get("batch_max_wait", 2.0)  # Seconds the database manager waits to fill a batch
+dbInFlightBatches = config.get("db_in_flight_batches", 2)  # Batches waiting per database pipeline stage
+statsInterval = config.get("stats_interval", 30)  # Seconds between pipeline throughput reports
+incrementalIndex = config.get("incremental_index", True)  # Index stored pages while crawling
+indexPollSeconds = config.get("index_poll_seconds", 1.0)  # How often the indexer looks for new pages
+expandDuplicateLinks = config.get("expand_duplicate_links", False)  # Queue the links of near-duplicate pages too
+revisitPages = config.get("revisit_pages", True)  # Re-fetch stored pages once they have probably changed
+revisitCheckSeconds = config.get("revisit_check_seconds", 60)  # How often the task manager looks for due revisits
+revisitBatch = config.get("revisit_batch", 500)  # Revisit tasks queued per check at most
+linkGraph = config.get("link_graph", True)  # Log outlinks for linkgraph.py
+robotsTxt = config.get("robots_txt", True)  # Obey robots.txt: fetched once per origin by its fetcher, checked on every link
+archivePages = config.get("archive_pages", True)  # Keep raw bodies in the zstd page archive (see archive.py)
+dnsCache = config.get("dns_cache", True)  # Resolve hosts through a per-fetcher DNS cache (see dnscache.py)
+processingQueueSize = config.get("processing_queue_size", 1000)
+webpageQueueSize = config.get("webpage_queue_size", 1000)
+startMethod = config.get("start_method", "forkserver")  # How processes start; a forkserver has this module imported already
+
+# Metrics (see metrics.py): plain dict updates in the hot loops, published by each process
+fetchSeconds = metrics.histogram("spidercurl_fetch_seconds", "Time to fetch a page by HTTP status (error: no response)", ("status",))
+hostFetches = metrics.counter("spidercurl_host_fetches_total", "Fetches by host and HTTP status", ("host", "status"))
+hostFetchSeconds = metrics.counter("spidercurl_host_fetch_seconds_total", "Seconds spent fetching by host", ("host",))
+scheduledUrls = metrics.gauge("spidercurl_scheduled_urls", "URLs waiting in the fetchers' host schedulers")
+fetchesInFlight = metrics.gauge("spidercurl_fetches_in_flight", "Fetches under way in the fetchers")
+parseSeconds = metrics.histogram("spidercurl_parse_seconds", "Time to extract one page")
+pageBytes = metrics.histogram("spidercurl_page_bytes", "Body size of the pages parsed", buckets=metrics.BYTES_BUCKETS)
+parsedPages = metrics.counter("spidercurl_parsed_pages_total", "Pages through the parser workers by outcome", ("outcome",))
+queueDepth = metrics.gauge("spidercurl_queue_depth", "Items waiting in the inter-process queues", ("queue",))
+unpublishedProcesses = metrics.gauge("spidercurl_unpublished_processes", "Running processes without a metrics slot, missing from every sum")
 
 # Rate limiting configuration
-MAX_URLS_PER_DOMAIN = config.get("max_urls_per_domain", 10)  # Maximum URLs from same domain in task_queue
-domain_queue_counts = defaultdict(int)
-domain_lock = threading.Lock()
-
-task_queue = multiprocessing.JoinableQueue()
-webpage_processing_queue = multiprocessing.JoinableQueue()
-#queues for storing intermediate results
-webpage_queue = multiprocessing.JoinableQueue()
-
-# Sets to track URLs that have been added to queues to prevent duplicates
-task_urls_added = set()
-processing_urls_added = set()
-webpage_urls_added = set()
-url_tracking_lock = multiprocessing.Lock()
-
-def worker(webpage_processing_queue, webpage_queue):
+MAX_URLS_PER_DOMAIN = config.get("max_urls_per_domain", 10)  # Most claimed tasks of one domain outstanding at a time
+maxScheduledUrls = config.get("max_scheduled_urls", 10000)  # URLs a fetcher holds in its host scheduler
+def worker(webpage_processing_queue, webpage_queue, page_channel, metrics_channel, stop=None):
     print(f"Worker {multiprocessing.current_process().name} started")
-    while True:
+    metrics.start(metrics_channel, "parser")
+    tracing.install_profiler()
+    # Every worker appends to archive segments of its own
+    archive_writer = archive.ArchiveWriter() if archivePages and archive.zstandard is not None else None
+    # A page dropped here never reaches the database manager, so its task is settled from here
+    status_writer = mongo.StatusWriter()
+    # The autoscaler or a shutdown sets stop to retire the worker; it finishes the page it has first
+    while stop is None or not stop.is_set():
+        webpage_item = None
         try:
             webpage_item = webpage_processing_queue.get(timeout=1)
+            tracing.mark(webpage_item.trace, "parse_start")
+            webpage_content = page_channel.load(webpage_item, archive_writer if webpage_item.status_code == 200 else None)
             
-            if webpage_item.webpage_content:
+            # A 304 has no content but still records that the page was checked
+            if not webpage_content and webpage_item.status_code != 304:
+                if webpage_content is None:
+                    # The slot was reclaimed and the body is gone: fetch it again, no attempt lost
+                    status_writer.release(webpage_item.url)
+                else:
+                    status_writer.retry(webpage_item.url, "Empty body", True)
+                parsedPages.inc("dropped")
+            else:
+                start = time.perf_counter()
                 webpage = process_url(
-                    webpage_item.webpage_content, 
+                    webpage_content, 
                     webpage_item.status_code,
                     webpage_item.url, 
-                    webpage_item.redirect_url
+                    webpage_item.redirect_url,
+                    webpage_item.truncated,
+                    webpage_item.etag,
+                    webpage_item.last_modified,
+                    webpage_item.cash,
+                    webpage_item.archive
                 )
+                tracing.mark(webpage_item.trace, "parse_end")
+                if webpage:
+                    webpage.trace = webpage_item.trace
+                if webpage_item.status_code != 304:
+                    parseSeconds.observe(time.perf_counter() - start)
+                    pageBytes.observe(webpage_item.content_length or len(webpage_content))
+                parsedPages.inc("stored" if webpage else "dropped")
                 
                 if webpage:
-                    # Test serialization before putting in queue
                     try:
-                        import pickle
-                        pickle.dumps(webpage)
-                        webpage_queue.put(webpage)
-                        # Update URL tracking
-                        with url_tracking_lock:
-                            processing_urls_added.discard(webpage_item.url)
-                            webpage_urls_added.add(webpage_item.url)
+                        webpage_queue.put(models.pack_webpage(webpage))
                         print(f"Worker processed: {webpage_item.url}")
                     except Exception as queue_error:
                         print(f"Queue serialization error for {webpage_item.url}: {type(queue_error).__name__} - {str(queue_error)[:200]}")
+                        status_writer.retry(webpage_item.url, f"Queue error: {type(queue_error).__name__}", True)
+                else:
+                    status_writer.retry(webpage_item.url, f"HTTP {webpage_item.status_code} not parsed", False)
                     
         except queue.Empty:
             time.sleep(0.5)
         except Exception as e:
             error_type = type(e).__name__
             error_msg = str(e) if str(e) else "No error message"
+            if webpage_item is not None:
+                status_writer.retry(webpage_item.url, f"Parse error: {error_type}", True)
             if "timeout" not in str(e).lower() and "empty" not in str(e).lower():
-                # Only try to access webpage_item if it exists
-                url_info = f" for {webpage_item.url}" if 'webpage_item' in locals() else ""
-                status_code = f"{webpage_item.status_code}" if 'webpage_item' in locals() and hasattr(webpage_item, 'status_code') else ""
+                url_info = f" for {webpage_item.url}" if webpage_item is not None else ""
+                status_code = f"{webpage_item.status_code}" if webpage_item is not None and hasattr(webpage_item, 'status_code') else ""
                 if status_code and status_code != "200":
                     print(f"Worker error ({status_code}){url_info}: {error_msg[:100]}")
                 else:
@@ -88,57 +155,246 @@ def worker(webpage_processing_queue, webpage_queue):
                 traceback.print_exc()
             
             time.sleep(0.5)
+    if archive_writer is not None:
+        archive_writer.close()
+    status_writer.close()
+    metrics.stop()
+    print(f"Worker {multiprocessing.current_process().name} stopped")
+
+async def robots_allow(client, url, robots_cache, scheduler, status_writer):
+    """
+    Checks url against its origin's robots.txt, fetching that first if no process has yet,
+    and applies the origin's Crawl-delay to the scheduler. Marks the task when it may not be fetched.
+    """
+    loop = asyncio.get_running_loop()
+    origin = robots.origin_of(url)
+    known, rules = robots_cache.get(origin)
+    if not known:
+        rules = await loop.run_in_executor(None, robots_cache.rules_for, origin)
+    if rules is None:
+        status, text = await curler.fetch_robots(client, origin)
+        rules, ttl = robots.rules_from_response(status, text)
+        await loop.run_in_executor(None, robots_cache.store, origin, rules, ttl)
+    if rules.crawl_delay is not None:
+        scheduler.set_robots_delay(host_of(url), rules.crawl_delay)
+    if not rules.available:
+        status_writer.retry(url, "robots.txt unreachable", True)
+        return False
+    if not rules.allowed(url):
+        print(f"{multiprocessing.current_process().name} skipping {url} - disallowed by robots.txt")
+        status_writer.status(url, "skipped", "disallowed by robots.txt")
+        return False
+    return True
+
+async def fetch_one(client, url, task, fetch_queue, webpage_processing_queue, page_channel, status_writer, scheduler, in_flight, wakeup, robots_cache):
+    loop = asyncio.get_running_loop()
+    name = multiprocessing.current_process().name
+    result = None
+    handed_off = False  # On the processing queue: the parser settles the task from there
+    try:
+        if robots_cache is not None and not await robots_allow(client, url, robots_cache, scheduler, status_writer):
+            return
+        trace = task.get("trace") if task else None
+        tracing.mark(trace, "fetch_start")
+        start = time.perf_counter()
+        rules = robots_cache.get(robots.origin_of(url))[1] if robots_cache is not None else None
+        result = await curler.fetch_url(client, url, task, rules)
+        elapsed = time.perf_counter() - start
+        tracing.mark(trace, "fetch_end")
+        status = str(result.status_code) if result.status_code else "error"
+        fetchSeconds.observe(elapsed, status)
+        host = host_of(url)
+        hostFetches.inc(host, status)
+        hostFetchSeconds.inc(host, amount=elapsed)
+        cash = task.get("cash") if task else None
+        print(f"{name} fetched {url}")
+
+        if result.status_code == 304:
+            # Unchanged since the stored copy: nothing to parse, only the freshness update to store
+            webpageQueueItem = models.webpageQueueItem(url=url, status_code=304, etag=result.etag, last_modified=result.last_modified, cash=cash, trace=trace)
+            tracing.mark(trace, "handoff")
+            await loop.run_in_executor(None, webpage_processing_queue.put, webpageQueueItem)
+            handed_off = True
+            print(f"{name} {url} not modified")
+        elif result.body is not None and (result.status_code != 200 or not result.body):
+            # Nothing to parse: a 2xx other than 200 fails the task, an empty body is retried
+            reason = f"HTTP {result.status_code}" if result.status_code != 200 else "Empty body"
+            print(f"{name} skipping {url} - {reason}")
+            status_writer.retry(url, reason, result.status_code == 200)
+        elif result.body is not None:
+            webpageQueueItem = models.webpageQueueItem(
+                url=url,
+                redirected=result.redirected,
+                redirect_url=result.redirect_url,
+                status_code=result.status_code,
+                truncated=result.truncated,
+                etag=result.etag,
+                last_modified=result.last_modified,
+                cash=cash,
+                trace=trace
+            )
+            # Only a small descriptor goes through the queue; the body waits in shared memory
+            await loop.run_in_executor(None, page_channel.store, webpageQueueItem, result.body, result.encoding)
+            tracing.mark(trace, "handoff")
+            try:
+                await loop.run_in_executor(None, webpage_processing_queue.put, webpageQueueItem)
+            except BaseException:
+                page_channel.discard(webpageQueueItem)
+                raise
+            handed_off = True
+            page_channel.queued(webpageQueueItem)
+            print(f"{name} successfully queued {url}")
+        elif result.status_code in curler.REDIRECT_STATUSES and result.redirect_url:
+            # Redirected elsewhere: the target becomes a task of its own, behind its origin's
+            # robots.txt and crawl delay, and takes over the cash this task carried
+            target = result.redirect_url
+            print(f"{name} {url} redirects to {target}")
+            await loop.run_in_executor(None, mongo.create_many_tasks, mongo.get_db(), [target], None,
+                                       {target: [cash or 0.0, 1]}, robots_cache)
+            status_writer.status(url, "skipped", f"redirected to {target}")
+        elif result.skip_reason:
+            # Not worth downloading (wrong content type or too large): keep the reason on the task
+            print(f"{name} skipping {url} - {result.skip_reason}")
+            status_writer.status(url, "skipped", result.skip_reason)
+        else:
+            print(f"{name} skipping {url} - invalid response")
+            # Network errors, 429 and 5xx are retried with backoff; other errors fail the task
+            status = result.status_code
+            retryable = status is None or status == 429 or status >= 500
+            error_message = f"HTTP {status}" if status else "Network error"
+            status_writer.retry(url, error_message, retryable)
+    except Exception as fetch_error:
+        print(f"{name} fetch error for {url}: {fetch_error}")
+        if not handed_off:
+            # Settled here, or the task would sit on its lease and count against the caps
+            status_writer.retry(url, f"Fetch error: {type(fetch_error).__name__}", True)
+    finally:
+        if result is not None:
+            scheduler.done(url, result.status_code, result.retry_after)
+        else:
+            scheduler.done(url)
+        fetch_queue.task_done()
+        in_flight.release()
+        wakeup.set()
+
+async def feed_scheduler(fetch_queue, scheduler, tasks, wakeup, dns_cache, drain=None):
+    loop = asyncio.get_running_loop()
+    while drain is None or not drain.is_set():
+        if len(scheduler) >= maxScheduledUrls:
+            await asyncio.sleep(0.5)
+            continue
+        try:
+            url, task = await loop.run_in_executor(None, fetch_queue.get, True, 5)
+        except queue.Empty:
+            continue
+        except Exception as e:
+            print(f"Error in fetcher {multiprocessing.current_process().name}: {e}")
+            await asyncio.sleep(1)
+            continue
+        if task:
+            tracing.mark(task.get("trace"), "dequeue")
+            tasks[url] = task
+        if dns_cache is not None:
+            # The host usually waits for its crawl delay first; the lookup runs meanwhile
+            host = urlparse(url).hostname
+            if host:
+                dns_cache.prefetch(host)
+        scheduler.add(url)
+        wakeup.set()
+    wakeup.set()  # Lets fetch_loop see the drain without waiting for a crawl delay
+
+async def report_dns(dns_cache):
+    while True:
+        await asyncio.sleep(statsInterval)
+        print(f"{multiprocessing.current_process().name} {dns_cache.report()}")
 
-def thread_worker(task_queue, webpage_processing_queue):
-    thread_name = threading.current_thread().name
-    print(f"curl thread {thread_name} started")
+async def renew_leases(scheduler):
+    """Keeps the tasks waiting in the host scheduler leased; a fetcher that dies stops renewing and they are claimed again."""
+    loop = asyncio.get_running_loop()
     while True:
+        await asyncio.sleep(mongo.LEASE_SECONDS / 4)
+        urls = scheduler.pending_urls()
         try:
-            url = task_queue.get(timeout=5)
-            
-            # Decrement domain count when taking URL from queue
-            domain = urlparse(url).netloc
-            with domain_lock:
-                if domain_queue_counts[domain] > 0:
-                    domain_queue_counts[domain] -= 1
-
-            # Add random jitter between 0.1-2 seconds before curling
-            jitter = random.uniform(0.1, 2.0)
-            time.sleep(jitter)
-            
-            try:
-                redirected, response, redirectLink = curler.fetch_url(url)
-                print(f"{thread_name} fetched {url}")
-                
-                if response is not None and hasattr(response, 'text') and hasattr(response, 'status_code'):
-                    webpageQueueItem = models.webpageQueueItem(
-                        url=url,
-                        redirected=redirected,
-                        redirect_url=redirectLink,
-                        webpage_content=response.text,
-                        status_code=response.status_code
-                    )
-                    webpage_processing_queue.put(webpageQueueItem)
-                    # Update URL tracking
-                    with url_tracking_lock:
-                        task_urls_added.discard(url)
-                        processing_urls_added.add(url)
-                    print(f"{thread_name} successfully queued {url}")
-                else:
-                    print(f"{thread_name} skipping {url} - invalid response")
-                    with url_tracking_lock:
-                        task_urls_added.discard(url)
-                        mongo.update_task_status(mongo.connect_to_mongo(), [url], status="failed", error_message="Invalid response or non-HTML content")
-            except Exception as fetch_error:
-                print(f"{thread_name} fetch error for {url}: {fetch_error}")
-            
-            task_queue.task_done()
-
+            await loop.run_in_executor(None, mongo.renew_leases, mongo.get_db(), urls)
         except Exception as e:
-            print(f"Error in {thread_name}: {e}")
-            time.sleep(1)
+            print(f"{multiprocessing.current_process().name} lease renewal error: {e}")
 
-def process_url(webpage_content, status_code, url, redirectLink):
+async def follow_in_flight_limit(in_flight, in_flight_limit, limit):
+    """Resizes the in-flight semaphore to the limit the autoscaler sets: released to grow, held to shrink."""
+    while True:
+        await asyncio.sleep(1)
+        while limit < in_flight_limit.value:
+            in_flight.release()
+            limit += 1
+        while limit > in_flight_limit.value:
+            await in_flight.acquire()  # Waits for a fetch to finish
+            limit -= 1
+
+async def fetch_loop(fetch_queue, webpage_processing_queue, page_channel, in_flight_limit=None, drain=None):
+    loop = asyncio.get_running_loop()
+    scheduler = HostScheduler()
+    tasks = {}  # url -> what the task carries besides the url: validators of the stored copy, OPIC cash
+    wakeup = asyncio.Event()
+    limit = in_flight_limit.value if in_flight_limit is not None else maxInFlight
+    in_flight = asyncio.Semaphore(limit)
+    pending = set()
+    status_writer = mongo.StatusWriter()
+    dns_cache = DNSCache() if dnsCache else None
+    robots_cache = RobotsCache() if robotsTxt else None
+    try:
+        connections = autoscale.connection_limit(limit) if in_flight_limit is not None else limit
+        async with curler.create_async_client(dns_cache, connections) as client:
+            print(f"Fetcher {multiprocessing.current_process().name} started with up to {limit} fetches in flight")
+            feeder = asyncio.create_task(feed_scheduler(fetch_queue, scheduler, tasks, wakeup, dns_cache, drain))
+            # Helpers that run until the fetcher stops, cancelled once it has drained
+            helpers = [asyncio.create_task(renew_leases(scheduler))]
+            if dns_cache is not None:
+                helpers.append(asyncio.create_task(report_dns(dns_cache)))
+            if in_flight_limit is not None:
+                helpers.append(asyncio.create_task(follow_in_flight_limit(in_flight, in_flight_limit, limit)))
+            # The feeder stops when the crawler drains, and then so does this loop
+            while not feeder.done():
+                await in_flight.acquire()
+                # Hand the free slot to whichever host is eligible first; only wait when none is
+                while not feeder.done():
+                    wakeup.clear()
+                    url, wait = scheduler.next_url()
+                    scheduledUrls.set(len(scheduler))
+                    fetchesInFlight.set(len(pending))
+                    if url is not None:
+                        break
+                    try:
+                        await asyncio.wait_for(wakeup.wait(), timeout=wait)
+                    except asyncio.TimeoutError:
+                        pass
+                else:
+                    break
+
+                fetch = asyncio.create_task(fetch_one(client, url, tasks.pop(url, None), fetch_queue, webpage_processing_queue, page_channel, status_writer, scheduler, in_flight, wakeup, robots_cache))
+                pending.add(fetch)
+                fetch.add_done_callback(pending.discard)
+
+            # Draining: fetches under way finish and hand their pages on; the tasks never
+            # fetched go back to pending for the next run instead of waiting out their lease
+            await asyncio.gather(*pending, return_exceptions=True)
+            unfetched = scheduler.pending_urls()
+            await loop.run_in_executor(None, mongo.release_tasks, mongo.get_db(), unfetched)
+            for helper in helpers:
+                helper.cancel()
+            print(f"Fetcher {multiprocessing.current_process().name} drained, {len(unfetched)} unfetched tasks released")
+    finally:
+        status_writer.close()
+
+def process_url(webpage_content, status_code, url, redirectLink, truncated=False, etag=None, last_modified=None, cash=None, archive_location=None):
+    if status_code == 304:
+        return models.WebPage(
+            url=url,
+            last_fetched=time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime()),
+            etag=etag,
+            last_modified=last_modified,
+            not_modified=True,
+            cash=cash
+        )
     if status_code == 200:
         info = processInfo.process_html_content(webpage_content, url)
         if not info:
@@ -154,198 +410,370 @@ def process_url(webpage_content, status_code, url, redirectLink):
             extracted_urls=info.get("extracted_urls"),
             image_data=info.get("images_info"),
             metadata=info.get("metadata"),
-            last_fetched=time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime())
+            last_fetched=time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime()),
+            truncated=truncated,
+            simhash=simhash.fingerprint(info.get("text_content")),
+            etag=etag,
+            last_modified=last_modified,
+            content_hash=revisit.content_hash(info.get("text_content")),
+            cash=cash,
+            archive=archive_location
         )
         return webpage
     return None
 
-def task_manager_process(task_queue):
-    limit = config.get("limit", 1000)
-    db = mongo.connect_to_mongo()
-    while True:
+def task_manager_process(fetch_queues, seen_filter_lock, metrics_channel, owner, drain):
+    metrics.start(metrics_channel, "task_manager")
+    tracing.install_profiler()
+    db = mongo.get_db()
+    seen = open_seen_filter(seen_filter_lock)
+    last_revisit_check = 0.0
+    # Claims nothing more once the crawler drains
+    while not drain.is_set():
         try:
             print(f"Task manager checking for new tasks.")
-            # Check for new tasks from the database
-            new_tasks = mongo.get_waiting_tasks(db, limit=limit)
-            if not new_tasks:
-                print(f"No new tasks found.")
-                # If no new tasks, check for start URLs
-                new_tasks = StartUrls
-            urlsToRemove = []
-            
-            # Create a list of all URLs to check against the database
-            all_urls = [task_url.get("url") if isinstance(task_url, dict) else task_url for task_url in new_tasks]
-
-            #groups urls by domain and limit to MAX_URLS_PER_DOMAIN for less 432 errors
-            domain_groups = defaultdict(list)
-            for url in all_urls:
-                domain = urlparse(url).netloc
-                domain_groups[domain].append(url)
-
-            urls_to_add = []
-            for domain, urls in domain_groups.items():
-                urls_to_add.extend(urls[:MAX_URLS_PER_DOMAIN])
-
-            print(f"Parsed {len(urls_to_add)} URLs to add to the task queue after domain limiting")
-
-
-            # Get all URLs currently in the database to avoid duplicates, using a single query
-            existing_documents = db.get_collection('tasks').find({"url": {"$in": urls_to_add}}, {"url": 1})
-            existing_urls = {doc['url'] for doc in existing_documents}
-            print(f"Task manager parsed existing URLs from database")
-
-
-
-            # check if the urls are already in the task queue or processing queue or webpage queue / alr done
-            for url in urls_to_add:
-                if url not in existing_urls:
-                    if url.startswith(('http://', 'https://')):
-                        domain = urlparse(url).netloc
-                        # Check if it's processing the data already
-                        with url_tracking_lock:
-                            if url not in task_urls_added and url not in processing_urls_added and url not in webpage_urls_added:
-                                task_queue.put(url)
-                                task_urls_added.add(url)
-                                domain_queue_counts[domain] += 1              
-                    else:
+            # Everything claimed and not finished counts, wherever it is: in the fetch queues, the
+            # fetchers' host schedulers, in flight or on its way to the database. The owner is
+            # the crawler's, so leases survive a restart of this process
+            leased = mongo.leased_urls(db, owner)
+            queued = len(leased)
+            domain_counts = defaultdict(int)
+            for url in leased:
+                domain_counts[urlparse(url).netloc.lower()] += 1
+
+            # Turn the stored pages most likely to have changed into (conditional) crawl tasks
+            if revisitPages and time.monotonic() - last_revisit_check >= revisitCheckSeconds and queued < maxQueuedTasks:
+                last_revisit_check = time.monotonic()
+                limit = min(revisitBatch, maxQueuedTasks - queued)
+                due = revisit.pick_revisits(mongo.due_revisits(db, limit * 4), datetime.utcnow(), limit)
+                mongo.queue_revisits(db, due)
+                if due:
+                    print(f"Queued {len(due)} revisits")
+
+            # Claim due tasks page by page until the fetchers have enough queued; claimed
+            # tasks are in_progress under our lease, so they are never handed out twice
+            claimed = 0
+            while queued + claimed < maxQueuedTasks:
+                tasks = mongo.claim_tasks(db, owner, limit=min(claimBatch, maxQueuedTasks - queued - claimed))
+                if not tasks:
+                    break
+                urlsToRemove = []
+                urlsToRelease = []
+
+                # Tasks come highest priority first, so a domain with MAX_URLS_PER_DOMAIN tasks
+                # outstanding keeps its most valuable URLs and gives back the rest (fewer 429
+                # errors, and no backlog that waits out its lease behind the crawl delay)
+                for task in tasks:
+                    url = task["url"]
+                    if not url.startswith(('http://', 'https://')):
                         print(f"Skipping invalid URL: {url}")
                         urlsToRemove.append(url)
-            if urlsToRemove:
-                mongo.remove_tasks(db, urlsToRemove)
-            
-            # Check for new tasks every 10 seconds (or adjust as needed)
-            print(f"Task queue size: {task_queue.qsize()}")
-            if task_queue.qsize() < batchSize:
-                time.sleep(1)
+                        continue
+                    domain = urlparse(url).netloc.lower()
+                    if domain_counts[domain] >= MAX_URLS_PER_DOMAIN:
+                        urlsToRelease.append(url)
+                        continue
+                    domain_counts[domain] += 1
+                    details = {key: task[key] for key in ("etag", "last_modified", "cash") if task.get(key) is not None}
+                    trace = tracing.new_trace()
+                    if trace:
+                        details["trace"] = trace
+                    fetch_queues[shard_for_host(domain, len(fetch_queues))].put((url, details or None))
+                    claimed += 1
+
+                # Over-limit URLs go back to pending, out of reach of the rest of this pass
+                mongo.release_tasks(db, urlsToRelease, delay_seconds=30)
+                if urlsToRemove:
+                    mongo.remove_tasks(db, urlsToRemove)
+                if len(urlsToRelease) + len(urlsToRemove) == len(tasks):
+                    break  # Every due task is on a domain that is full for this pass
+
+            if claimed == 0 and queued == 0 and not mongo.has_open_tasks(db):
+                print(f"No new tasks found.")
+                # If no new tasks, start again from the start URLs
+                mongo.seed_tasks(db, StartUrls)
+                seen.add_many(StartUrls)
+
+            print(f"Claimed {claimed} tasks, {queued + claimed} outstanding")
+            if queued + claimed < batchSize:
+                drain.wait(1)
             else:
-                time.sleep(5)
+                drain.wait(5)
         except Exception as e:
             print(f"Task manager process error: {e}")
-            time.sleep(60) # Sleep longer on error to prevent tight loops
-
-def databases_manager_process(webpage_queue, task_queue):
-    db = mongo.connect_to_mongo()
+            drain.wait(60) # Sleep longer on error to prevent tight loops
+    seen.flush()
+    print("Task manager stopped")
+
+def databases_manager_process(webpage_queue, seen_filter_lock, metrics_channel, drain):
+    metrics.start(metrics_channel, "database")
+    tracing.install_profiler()
+    db = mongo.get_db()
+    seen = open_seen_filter(seen_filter_lock)
+    near_duplicates = None
+    if simhash.MAX_DISTANCE:
+        near_duplicates = SimHashIndex()
+        mongo.load_fingerprints(db, near_duplicates)
+        print(f"Loaded {len(near_duplicates)} page fingerprints for near-duplicate detection")
+    pipeline = WritePipeline(db, seen, in_flight_batches=dbInFlightBatches,
+                             index_log=IndexLog() if incrementalIndex else None,
+                             near_duplicates=near_duplicates, expand_duplicate_links=expandDuplicateLinks,
+                             track_freshness=revisitPages, link_log=LinkLog() if linkGraph else None,
+                             robots=RobotsCache(db) if robotsTxt else None,
+                             trace_log=tracing.TraceLog() if tracing.SAMPLE_RATE else None)
     
-    while True:
+    # Once the crawler drains, what is left in webpage_queue is spilled by the main process
+    while not drain.is_set():
         try:
-            print(f"Database manager webpage queue size: {webpage_queue.qsize()}")
-            if webpage_queue.qsize() >= batchSize or (webpage_queue.qsize() > 0 and task_queue.qsize() < batchSize):
-                print(f"Webpage queue size before processing: {webpage_queue.qsize()}")
-                # Process available items up to batchSize
-                batch = []
-                processed_urls = []
-                
-                items_to_process = min(batchSize, webpage_queue.qsize())
-                while not webpage_queue.empty():
-                    try:
-                        webpage = webpage_queue.get_nowait()  # Non-blocking get
-                        batch.append(webpage)
-                        processed_urls.append(webpage.url)
-                    except queue.Empty:
-                        break  # Queue became empty while processing
-                
-                if batch:
-                    print(f"Processing batch of {len(batch)} webpages")
-                    
-                    # Bulk database operations
-                    mongo.insert_many_webpages(db, batch)
-                    
-                    # Extract URLs and create tasks in bulk
-                    extracted_urls = []
-                    for webpage in batch:
-                        if hasattr(webpage, 'extracted_urls'):
-                            extracted_urls.extend(webpage.extracted_urls)
-                    
-                    if extracted_urls:
-                        mongo.create_many_tasks(db, extracted_urls)
-                    
-                    # Clean up tasks
-                    if processed_urls:
-                        mongo.remove_tasks(db, processed_urls)
-                    
-                    # Clean up URL tracking
-                    with url_tracking_lock:
-                        for url in processed_urls:
-                            webpage_urls_added.discard(url)
-                else:
-                    print("Database manager waiting for more webpages")
-            time.sleep(1)
+            # Wait for a full batch, or for whatever arrived within batch_max_wait
+            batch = next_batch(webpage_queue, batchSize, batchMaxWait)
+            if batch:
+                pipeline.submit(batch)
+            if time.monotonic() - pipeline.last_report >= statsInterval:
+                print(pipeline.report())
             
         except Exception as e:
             print(f"Database manager error: {e}")
-            time.sleep(5)
+            drain.wait(5)
+    pipeline.drain()
+    seen.flush()
+    print(pipeline.report())
+    print("Database manager stopped with every submitted batch stored")
+
+
+def indexer_process(metrics_channel, drain):
+    metrics.start(metrics_channel, "indexer")
+    tracing.install_profiler()
+    index = IndexWriter()
+    index_log = IndexLog()
+    # The log is on disk: whatever is not indexed when the crawler drains is indexed next time
+    while not drain.is_set():
+        try:
+            # New pages become searchable as soon as their segment is committed
+            if not index.index_log(index_log):
+                drain.wait(indexPollSeconds)
+        except Exception as e:
+            print(f"Indexer error: {e}")
+            drain.wait(5)
+    index.close()
 
 
-def worker_threads_process(task_queue, webpage_processing_queue):
-    threads = []
-    for i in range(threadCount):
-        thread = threading.Thread(target=thread_worker, args=(task_queue,webpage_processing_queue), daemon=True)
-        threads.append(thread)
-        thread.start()
-    print(f"Started {threadCount} worker threads for URL fetching")
-    
-    # Keep the process alive
+def fetcher_process(fetch_queue, webpage_processing_queue, page_channel, metrics_channel, in_flight_limit=None, drain=None):
+    metrics.start(metrics_channel, "fetcher")
+    tracing.install_profiler()
     try:
-        while True:
-            time.sleep(1)
+        asyncio.run(fetch_loop(fetch_queue, webpage_processing_queue, page_channel, in_flight_limit, drain))
     except KeyboardInterrupt:
         pass
 
 
+def resize_workers(supervisor, target, worker_args):
+    """Starts or retires parser workers until `target` are running; the newest are retired first."""
+    running = supervisor.running("parser")
+    for name in running[target:]:
+        supervisor.retire(name)
+    for _ in range(target - len(running)):
+        supervisor.add("parser", worker, worker_args, stop=multiprocessing.Event())
+
+
+def take_all(shared_queue):
+    """Empties a queue no process puts into any more."""
+    items = []
+    while True:
+        try:
+            items.append(shared_queue.get(timeout=0.1))
+        except queue.Empty:
+            return items
+
+
+def requeue_spill(webpage_processing_queue, webpage_queue):
+    """Queues what the last shutdown spilled again, ahead of new work, and removes the spill."""
+    spill = SpillLog()
+    records = spill.read_all()
+    for kind, record in records:
+        if kind == "page":
+            webpage_processing_queue.put(models.unpack_queue_item(record))
+        else:
+            webpage_queue.put(record)
+    spill.clear()
+    if records:
+        print(f"Queued {len(records)} pages spilled by the last shutdown again")
+
+
+def shut_down(supervisor, drain_fetch, drain_store, fetch_queues, webpage_processing_queue, webpage_queue, page_channel):
+    """
+    Takes the crawler down stage by stage without losing fetched work. The task manager stops
+    claiming, the fetchers finish their fetches (the parsers keep going meanwhile) and give
+    the tasks they never fetched back, the parsers finish the page they hold, and the
+    database manager stores every batch it took. What is still queued between the stages
+    is spilled to spill_path and queued again by the next start, so nothing is re-fetched.
+    """
+    supervisor.draining = True
+    drain_fetch.set()
+    supervisor.stop("task_manager")
+    supervisor.stop("fetcher")
+    unfetched = [url for fetch_queue in fetch_queues for url, _ in take_all(fetch_queue)]
+    mongo.release_tasks(mongo.get_db(), unfetched)
+
+    supervisor.stop("parser")
+    spilled = []
+    for item in take_all(webpage_processing_queue):
+        # The body leaves shared memory: spilled items carry it decoded, like with shm_slots = 0
+        item.webpage_content = page_channel.load(item)
+        item.slot = None
+        spilled.append(("page", models.pack_queue_item(item)))
+
+    drain_store.set()
+    supervisor.stop("database")
+    supervisor.stop("indexer")
+    spilled.extend(("webpage", record) for record in take_all(webpage_queue))
+    spill = SpillLog()
+    spill.append(spilled)
+    spill.close()
+    print(f"Shut down: {len(unfetched)} unfetched tasks released, {len(spilled)} queued pages spilled to {spill.path}")
+
+
+def read_load(fetch_queues, webpage_processing_queue, webpage_queue, metrics_channel, pids):
+    """
+    What the autoscaler decides on: queue depths, and throughput from the metrics of every
+    process. When some of the processes (`pids`, up for a while) publish no metrics for lack
+    of a slot, the sums would under-report, so the reading is left to the queue depths.
+    """
+    load = autoscale.Load(
+        processing_fill=webpage_processing_queue.qsize() / processingQueueSize,
+        webpage_fill=webpage_queue.qsize() / webpageQueueSize,
+        fetch_waiting=sum(fetch_queue.qsize() for fetch_queue in fetch_queues),
+    )
+    if metrics_channel.shm_name is not None:
+        unpublished = len(set(pids) - metrics_channel.owned(pids))
+        unpublishedProcesses.set(unpublished)
+        if unpublished:
+            print(f"Autoscaler: {unpublished} processes have no metrics slot, scaling on queue depths only: raise metrics_slots")
+            return load
+        merged = metrics.collect(metrics_channel)
+        load.fetch_waiting += int(metrics.total(merged, "spidercurl_scheduled_urls"))
+        load.fetches_in_flight = metrics.total(merged, "spidercurl_fetches_in_flight")
+        load.fetched = metrics.total(merged, "spidercurl_host_fetches_total")
+        load.parse_seconds = metrics.total(merged, "spidercurl_parse_seconds")
+    return load
+
 
 if __name__ == "__main__":
     print("Starting SpiderCurl...")
-    task_manager_proc = multiprocessing.Process(target=task_manager_process, args=(task_queue,), daemon=True)
-    task_manager_proc.start()
+    # Held until the main process exits
+    lock_file = crawler_lock()
+    if lock_file is None:
+        raise SystemExit("Another crawler, or reparse --index, is running on this data folder")
+    if startMethod in multiprocessing.get_all_start_methods():
+        multiprocessing.set_start_method(startMethod)
+        if startMethod == "forkserver":
+            # The forkserver imports this module, and with it every dependency, once; processes
+            # fork from it, so a parser the autoscaler adds is up without paying for the imports.
+            # Preloaded by file name: multiprocessing skips a preloaded "__main__"
+            multiprocessing.set_forkserver_preload([os.path.splitext(os.path.basename(__file__))[0]])
+
+    # One task queue per fetcher process; a host always maps to the same fetcher (see scheduler.shard_for_host)
+    fetch_queues = [multiprocessing.JoinableQueue() for _ in range(multiprocessingThreadsCount)]
+    # Bounded, so a slow stage makes the ones before it wait instead of piling up pages in memory
+    webpage_processing_queue = multiprocessing.JoinableQueue(maxsize=processingQueueSize)
+    #queues for storing intermediate results
+    webpage_queue = multiprocessing.JoinableQueue(maxsize=webpageQueueSize)
+    # Guards writes to the seen-URL filter shared by the task manager and the database manager
+    seen_filter_lock = multiprocessing.Lock()
+
+    # Shared-memory slab the fetchers hand raw page bodies to the parser workers through
+    page_channel, page_slab = PageChannel.create()
+    # Every process publishes its metrics to a slot of this block; one endpoint serves their sum
+    metrics_channel = metrics.MetricsChannel.create()
+    metrics.start(metrics_channel, "main")
+    tracing.install_profiler()
+    metrics.serve(metrics_channel)
+
+    # Set to wind the pipeline down: drain_fetch stops claiming and fetching, drain_store the database manager and indexer
+    drain_fetch = multiprocessing.Event()
+    drain_store = multiprocessing.Event()
+    def release_process(pid):
+        # A reaped process's page slots and metrics slot go back before its replacement starts;
+        # its metric counts are kept in slot 0
+        pages = page_channel.reclaim(pid)
+        if pages:
+            print(f"Reclaimed {pages} page slots from exited process {pid}")
+        metrics_channel.release(pid)
+
+    supervisor = Supervisor(on_exit=release_process)
+
+    # A seen filter created on an existing database learns its pages and tasks before anything is claimed
+    seen = open_seen_filter(seen_filter_lock)
+    if not seen.backfilled:
+        print("Seen filter is new, loading the stored pages and crawl tasks into it...")
+        print(f"Added {backfill(seen, mongo.known_urls(mongo.get_db()))} URLs to the seen filter")
+    seen.close()
+
+    # Tasks are leased to the crawler as a whole: every claim of this run counts against max_queued_tasks
+    task_owner = f"{socket.gethostname()}:{os.getpid()}"
+    supervisor.add("task_manager", task_manager_process, (fetch_queues, seen_filter_lock, metrics_channel, task_owner, drain_fetch))
     print("Started task manager process")
 
     time.sleep(1)  # Give some time for the task manager to populate the queue
 
-    # start the worker thread processes for curling urls
-    thread_manager_processes = []
-    for i in range(multiprocessingThreadsCount):
-        process = multiprocessing.Process(target=worker_threads_process, args=(task_queue, webpage_processing_queue), daemon=True)
-        thread_manager_processes.append(process)
-        process.start()
-    print(f"Started {multiprocessingThreadsCount} thread manager processes")
+    # The autoscaler sizes the parser pool and, through in_flight_limit, every fetcher's concurrency
+    autoscaler = autoscale.Autoscaler(multiprocessingThreadsCount, multiprocessingCount, maxInFlight) if autoscale.AUTOSCALE else None
+    in_flight_limit = multiprocessing.Value("i", autoscaler.in_flight) if autoscaler is not None else None
+
+    # start the asyncio fetcher processes for curling urls
+    for fetch_queue in fetch_queues:
+        supervisor.add("fetcher", fetcher_process, (fetch_queue, webpage_processing_queue, page_channel, metrics_channel, in_flight_limit, drain_fetch))
+    print(f"Started {multiprocessingThreadsCount} fetcher processes")
 
     # start the worker processes for processing the webpages
-    worker_processes = []
-    for i in range(multiprocessingCount):
-        process = multiprocessing.Process(target=worker, args=(webpage_processing_queue, webpage_queue), daemon=True)
-        worker_processes.append(process)
-        process.start()
-    print(f"Started {multiprocessingCount} worker processes for webpage processing")
-
-    db_manager_proc = multiprocessing.Process(target=databases_manager_process, args=(webpage_queue, task_queue), daemon=True)
-    db_manager_proc.start()
+    worker_args = (webpage_processing_queue, webpage_queue, page_channel, metrics_channel)
+    resize_workers(supervisor, autoscaler.parsers if autoscaler is not None else multiprocessingCount, worker_args)
+    print(f"Started {len(supervisor.running('parser'))} worker processes for webpage processing")
+
+    supervisor.add("database", databases_manager_process, (webpage_queue, seen_filter_lock, metrics_channel, drain_store))
     print("Started database manager process")
+
+    if archivePages and archive.zstandard is None:
+        print("archive_pages is on but zstandard is not installed (pip install zstandard): raw pages are not archived")
+
+    if incrementalIndex:
+        supervisor.add("indexer", indexer_process, (metrics_channel, drain_store))
+        print("Started indexer process")
     
-    total_processes = 1 + multiprocessingThreadsCount + multiprocessingCount + 1  # task manager + thread managers + worker processes + db manager
-    print(f"Total processes running: {total_processes}")
+    print(f"Total processes running: {len(supervisor.children)}")
 
+    # SIGTERM drains like Ctrl-C; children ignore both and wait to be drained
+    drain_on_sigterm()
     try:
+        requeue_spill(webpage_processing_queue, webpage_queue)
+        last_scale = time.monotonic()
         while True:
             time.sleep(1)
+            # Restart processes that died, after their backoff
+            supervisor.check()
+            # A parser killed between taking a page and loading it leaves the page's slot behind
+            pages = page_channel.sweep(processingQueueSize + max(multiprocessingCount, autoscale.MAX_PARSERS))
+            if pages:
+                print(f"Freed {pages} page slots taken off the queue by parsers that died")
+            queueDepth.set(sum(fetch_queue.qsize() for fetch_queue in fetch_queues), "fetch")
+            queueDepth.set(webpage_processing_queue.qsize(), "processing")
+            queueDepth.set(webpage_queue.qsize(), "webpage")
+            if autoscaler is not None and time.monotonic() - last_scale >= autoscale.INTERVAL:
+                last_scale = time.monotonic()
+                # Processes up for a few seconds have taken their metrics slot, if there was one
+                load = read_load(fetch_queues, webpage_processing_queue, webpage_queue, metrics_channel, supervisor.pids(min_age=5.0))
+                parsers, in_flight = autoscaler.update(load)
+                in_flight_limit.value = in_flight
+                resize_workers(supervisor, parsers, worker_args)
     except KeyboardInterrupt:
         print("Shutting down...")
-        db = mongo.connect_to_mongo()
-        batch = []
-        for _ in range(batchSize):
-            if not webpage_queue.empty():
-                batch.append(webpage_queue.get())
-        mongo.insert_many_webpages(db, batch)
-        extracted_urls = []
-        for webpage in batch:
-            for url in webpage.extracted_urls:
-                extracted_urls.append(url)
-
-        mongo.create_many_tasks(db, extracted_urls)
-
-        urls = []
-        for webpage in batch:
-            urls.append(webpage.url)
-        mongo.remove_tasks(db, urls)
-
+        # A second Ctrl-C or SIGTERM is ignored: the drain is what saves the queued work
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        shut_down(supervisor, drain_fetch, drain_store, fetch_queues, webpage_processing_queue, webpage_queue, page_channel)
     except Exception as e:
-        print(f"Main thread error: {e}")
\ No newline at end of file
+        print(f"Main thread error: {e}")
+    finally:
+        if page_slab is not None:
+            page_slab.close()
+        metrics_channel.close()
@@ -0,0 +1,393 @@
+# Counters, gauges and histograms shared by every SpiderCurl process, served in Prometheus text format
+import bisect
+import marshal
+import multiprocessing
+import os
+import struct
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import shared_memory
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import toml
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+config = toml.load("config.toml")
+
+METRICS_PORT = config.get("metrics_port", 9108)  # Local port of the /metrics endpoint; 0 disables metrics
+METRICS_SLOTS = config.get("metrics_slots", 512)  # Processes that can publish at once; a reaped process's slot is reused
+SLOT_BYTES = config.get("metrics_slot_bytes", 65536)  # Room for one process's snapshot
+PUBLISH_SECONDS = config.get("metrics_publish_seconds", 1.0)
+MAX_SERIES = config.get("metrics_max_series", 200)  # Label sets per metric and process; more are counted as "other"
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+BYTES_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+_HEADER = struct.Struct("<QI")  # Version (odd while the snapshot is being written), snapshot length
+_metrics: Dict[str, "Metric"] = {}
+_publisher: Dict[str, object] = {}  # channel, slot, role and next version of this process once start() has run
+_publish_lock = threading.Lock()  # The publisher thread and stop() write the slot one at a time
+
+
+class Metric:
+    """
+    A metric of this process: a dict from label values to a number (or, for histograms, a list
+    of bucket counts, sum and count). Updating it is a dict operation and nothing else; a
+    publisher thread copies all metrics into the process's shared-memory slot every
+    PUBLISH_SECONDS.
+    """
+
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}
+
+    def _key(self, labels: tuple) -> tuple:
+        if labels not in self.values and len(self.values) >= MAX_SERIES:
+            return ("other",) * len(labels)
+        return labels
+
+    def snapshot(self) -> tuple:
+        return (self.name, self.kind, self.help, self.labels, None, dict(self.values))
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount: float = 1):
+        key = labels if labels in self.values else self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """
+    Set per process; the endpoint shows the sum over processes (e.g. URLs held by all
+    fetchers). A process that died keeps its last values until the supervisor reaps it.
+    """
+
+    kind = "gauge"
+
+    def set(self, value: float, *labels):
+        self.values[labels if labels in self.values else self._key(labels)] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, *labels):
+        counts = self.values.get(labels)
+        if counts is None:
+            # Per bucket counts, then +Inf, sum and count
+            counts = self.values.setdefault(self._key(labels), [0] * (len(self.buckets) + 1) + [0.0, 0])
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-2] += value
+        counts[-1] += 1
+
+    def snapshot(self) -> tuple:
+        return (self.name, self.kind, self.help, self.labels, self.buckets,
+                {key: list(counts) for key, counts in list(self.values.items())})
+
+
+def _register(metric: Metric) -> Metric:
+    return _metrics.setdefault(metric.name, metric)
+
+
+def counter(name: str, help: str, labels: Sequence[str] = ()) -> Counter:
+    return _register(Counter(name, help, labels))
+
+
+def gauge(name: str, help: str, labels: Sequence[str] = ()) -> Gauge:
+    return _register(Gauge(name, help, labels))
+
+
+def histogram(name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+    return _register(Histogram(name, help, labels, buckets))
+
+
+class MetricsChannel:
+    """
+    What the processes share to publish metrics: the name of a shared-memory block with one
+    slot per process, and the table of which process owns which slot. Passed to the processes
+    as an argument, like shmtransport.PageChannel. Each slot has a single writer and is guarded
+    by a version number (a seqlock), so neither side ever takes a lock to publish or read.
+
+    Slot 0 holds what reaped processes counted: release() folds the last snapshot of a dead
+    process's slot into it, counters and histograms only (gauges describe a running process),
+    and frees the slot for the next process. Only the main process releases.
+    """
+
+    def __init__(self, shm: Optional[shared_memory.SharedMemory], owners):
+        self.shm_name = shm.name if shm is not None else None
+        self.owners = owners  # Pid owning each slot, 0 when free; slot 0 is never handed out
+        self.shm = shm
+        self.retired: Dict[str, list] = {}  # Main process only: the merged metrics behind slot 0
+        self.retired_version = 0
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state["shm"] = None  # Children attach by name
+        state["retired"] = {}
+        return state
+
+    @classmethod
+    def create(cls, slots: int = METRICS_SLOTS):
+        """Called once in the main process; a channel that publishes nothing when metrics are off."""
+        if not METRICS_PORT:
+            return cls(None, None)
+        return cls(shared_memory.SharedMemory(create=True, size=(slots + 1) * SLOT_BYTES), multiprocessing.Array("i", slots + 1))
+
+    def _attach(self) -> shared_memory.SharedMemory:
+        if self.shm is None:
+            self.shm = shared_memory.SharedMemory(name=self.shm_name)
+        return self.shm
+
+    def allocate(self) -> Optional[int]:
+        """A free slot for the calling process, None when every slot is taken."""
+        with self.owners.get_lock():
+            for slot in range(1, len(self.owners)):
+                if not self.owners[slot]:
+                    self.owners[slot] = os.getpid()
+                    return slot
+        return None
+
+    def next_version(self, slot: int) -> int:
+        """Snapshot number a new owner continues from, so the slot's version never goes back."""
+        return (_HEADER.unpack_from(self._attach().buf, slot * SLOT_BYTES)[0] + 1) // 2
+
+    def owned(self, pids) -> set:
+        """The pids among `pids` that own a slot."""
+        with self.owners.get_lock():
+            return set(pids) & set(self.owners[1:])
+
+    def release(self, pid: int) -> int:
+        """Folds the slots of an exited process into slot 0 and frees them; returns how many it had."""
+        if self.owners is None:
+            return 0
+        slots = [slot for slot in range(1, len(self.owners)) if self.owners[slot] == pid]
+        for slot in slots:
+            data = self.read(slot)
+            if data is not None:
+                for name, kind, help, labels, buckets, values in marshal.loads(data):
+                    if kind != "gauge":
+                        _merge(self.retired, name, kind, help, labels, buckets, values)
+            # The writer is gone: empty the slot under a version past its last one
+            buffer = self._attach().buf
+            version = _HEADER.unpack_from(buffer, slot * SLOT_BYTES)[0]
+            _HEADER.pack_into(buffer, slot * SLOT_BYTES, version + 2 - version % 2, 0)
+            self.owners[slot] = 0
+        if slots:
+            data = marshal.dumps([(name, kind, help, labels, buckets, values)
+                                  for name, (kind, help, labels, buckets, values) in self.retired.items()])
+            if len(data) <= SLOT_BYTES - _HEADER.size:
+                self.write(0, data, self.retired_version)
+                self.retired_version += 1
+            else:
+                print(f"Metrics of reaped processes exceed metrics_slot_bytes ({len(data)} bytes)")
+        return len(slots)
+
+    def write(self, slot: int, data: bytes, version: int):
+        """Writes snapshot number `version` (0, 1, ...) of the slot's only writer."""
+        buffer = self._attach().buf
+        offset = slot * SLOT_BYTES
+        _HEADER.pack_into(buffer, offset, 2 * version + 1, 0)  # Odd: readers skip the slot
+        buffer[offset + _HEADER.size:offset + _HEADER.size + len(data)] = data
+        _HEADER.pack_into(buffer, offset, 2 * version + 2, len(data))
+
+    def read(self, slot: int) -> Optional[bytes]:
+        buffer = self._attach().buf
+        offset = slot * SLOT_BYTES
+        for _ in range(3):
+            version, length = _HEADER.unpack_from(buffer, offset)
+            if version % 2:
+                time.sleep(0.001)
+                continue
+            data = bytes(buffer[offset + _HEADER.size:offset + _HEADER.size + length])
+            if _HEADER.unpack_from(buffer, offset)[0] == version:
+                return data if length else None
+        return None
+
+    def slots_in_use(self) -> List[int]:
+        """Slot 0 and the slots owned by a process, running or not yet reaped."""
+        with self.owners.get_lock():
+            return [0] + [slot for slot in range(1, len(self.owners)) if self.owners[slot]]
+
+    def close(self):
+        if self.shm is not None:
+            self.shm.close()
+            self.shm.unlink()
+
+
+def _merge(merged: Dict[str, list], name: str, kind: str, help: str, labels, buckets, values: dict):
+    entry = merged.setdefault(name, [kind, help, labels, buckets, {}])
+    totals = entry[4]
+    for key, value in values.items():
+        if kind == "histogram":
+            current = totals.get(key)
+            totals[key] = value if current is None else [a + b for a, b in zip(current, value)]
+        else:
+            totals[key] = totals.get(key, 0) + value
+
+
+def _rss_bytes() -> float:
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * _PAGE_SIZE
+    except OSError:
+        # Peak instead of current RSS where there is no /proc; kilobytes on Linux, bytes on macOS
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 if resource is not None else 0.0
+
+
+_processes = gauge("spidercurl_processes", "Running processes by role", ("role",))
+# A counter, so the CPU time of reaped processes stays in the sum; set from process_time() on every publish
+_cpu = counter("spidercurl_process_cpu_seconds", "CPU time used by the processes of a role", ("role",))
+_rss = gauge("spidercurl_process_rss_bytes", "Resident memory of the processes of a role", ("role",))
+
+
+def _publish(running: bool = True):
+    role = _publisher["role"]
+    with _publish_lock:
+        _cpu.values[(role,)] = time.process_time()
+        _rss.set(_rss_bytes() if running else 0, role)
+        # Every snapshot copies its dict in one C call, which updates from other threads cannot interleave with
+        try:
+            data = marshal.dumps([metric.snapshot() for metric in list(_metrics.values())])
+        except Exception as e:
+            print(f"Metrics snapshot error: {e}")
+            return
+        if len(data) > SLOT_BYTES - _HEADER.size:
+            if not _publisher["warned"]:
+                print(f"Metrics of {multiprocessing.current_process().name} exceed metrics_slot_bytes ({len(data)} bytes)")
+                _publisher["warned"] = True
+            return
+        _publisher["channel"].write(_publisher["slot"], data, _publisher["version"])
+        _publisher["version"] += 1
+
+
+def start(channel: Optional[MetricsChannel], role: str, interval: float = PUBLISH_SECONDS):
+    """
+    Starts publishing this process's metrics to a slot of its own; called once at the start of
+    every process. `role` labels the process's CPU time and RSS, summed per role at the endpoint.
+    """
+    if channel is None or channel.shm_name is None:
+        return
+    _processes.set(1, role)
+    slot = channel.allocate()
+    if slot is None:
+        print(f"No metrics slot left for {multiprocessing.current_process().name}: raise metrics_slots")
+        return
+    _publisher.update(channel=channel, slot=slot, role=role, version=channel.next_version(slot), warned=False)
+
+    def publish():
+        while True:
+            time.sleep(interval)
+            _publish()
+
+    threading.Thread(target=publish, daemon=True).start()
+
+
+def stop():
+    """
+    Publishes a last snapshot for a process that is about to exit on purpose: its counters
+    and CPU time stay in the sums, while it no longer counts as running or holding memory.
+    """
+    if _publisher:
+        _processes.set(0, _publisher["role"])
+        _publish(running=False)
+
+
+def collect(channel: MetricsChannel) -> Dict[str, list]:
+    """Merges the snapshots of every process: counters, gauges and histogram buckets are summed."""
+    merged: Dict[str, list] = {}
+    for slot in channel.slots_in_use():
+        data = channel.read(slot)
+        if data is None:
+            continue
+        for name, kind, help, labels, buckets, values in marshal.loads(data):
+            _merge(merged, name, kind, help, labels, buckets, values)
+    return merged
+
+
+def total(merged: Dict[str, list], name: str) -> float:
+    """Sum of a merged metric over all its label sets; for a histogram, the sum of what it observed."""
+    entry = merged.get(name)
+    if entry is None:
+        return 0.0
+    kind, values = entry[0], entry[4]
+    return sum(value[-2] if kind == "histogram" else value for value in values.values())
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _labels(names: Tuple[str, ...], values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def render(merged: Dict[str, list]) -> str:
+    """Prometheus text exposition format."""
+    lines: List[str] = []
+    for name in sorted(merged):
+        kind, help, labels, buckets, values = merged[name]
+        lines.append(f"# HELP {name} {help}")
+        lines.append(f"# TYPE {name} {kind}")
+        for key in sorted(values, key=str):
+            value = values[key]
+            if kind != "histogram":
+                lines.append(f"{name}{_labels(labels, key)} {value}")
+                continue
+            cumulative = 0
+            for bound, count in zip(buckets + ("+Inf",), value):
+                cumulative += count
+                le = 'le="%s"' % bound
+                lines.append(f"{name}_bucket{_labels(labels, key, le)} {cumulative}")
+            lines.append(f"{name}_sum{_labels(labels, key)} {value[-2]}")
+            lines.append(f"{name}_count{_labels(labels, key)} {value[-1]}")
+    return "\n".join(lines) + "\n"
+
+
+def serve(channel: MetricsChannel, port: int = METRICS_PORT):
+    """Serves GET /metrics on 127.0.0.1:port from a daemon thread of the calling process; None if it could not listen."""
+    if channel.shm_name is None:
+        return None
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = render(collect(channel)).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    try:
+        server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    except OSError as e:
+        # Port taken (a second crawler, another exporter): crawl on without the endpoint
+        print(f"Metrics endpoint not started on port {port}: {e}")
+        return None
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Metrics on http://127.0.0.1:{port}/metrics")
+    return server
@@ -1,6 +1,7 @@
 # models for mongo db storing of the html data
 
-from dataclasses import dataclass, field
+import marshal
+from dataclasses import dataclass, field, fields
 from typing import Any, List, Dict, Optional
 from urllib import response
 
@@ -16,11 +17,21 @@ class WebPage:
     image_data: List[Dict[str, Any]] = field(default_factory=list)  # Changed this line
     metadata: Dict[str, str] = field(default_factory=dict)
     last_fetched: Optional[str] = None
+    truncated: bool = False  # text_content comes from a body cut off at max_body_bytes
+    simhash: Optional[int] = None  # Fingerprint of text_content, see simhash.fingerprint
+    duplicate_of: Optional[str] = None  # Near-duplicate of this stored page: its text and images are not kept
+    etag: Optional[str] = None  # Validators sent back on the next conditional fetch
+    last_modified: Optional[str] = None
+    content_hash: Optional[int] = None  # Hash of text_content, compared across fetches to estimate the change rate
+    not_modified: bool = False  # A 304 to a conditional fetch: only the freshness fields are stored
+    cash: Optional[float] = None  # OPIC cash of the task when fetched, split over extracted_urls (see frontier)
+    archive: Optional[List] = None  # [segment, offset, length] of the raw response in the page archive
+    trace: Optional[List] = None  # Sampled pipeline timeline, (event, time) pairs (see tracing); not stored in Mongo
     
 @dataclass
 class crawlTask:
     url: str
-    status: str = "pending"  # could be 'pending', 'in_progress', 'completed', 'failed'
+    status: str = "pending"  # could be 'pending', 'in_progress', 'completed', 'failed', 'skipped'
     attempts: int = 0
     last_attempted: Optional[str] = None  # ISO formatted date string
     error_message: Optional[str] = None
@@ -28,7 +39,51 @@ class crawlTask:
 @dataclass
 class webpageQueueItem:
     url: str
-    webpage_content: str  # Store the HTML content as a string
+    webpage_content: Optional[str] = None  # The HTML as a string, only when shared memory is disabled
     status_code: int = 200  # Store the HTTP status code
     redirected: bool = False
-    redirect_url: Optional[str] = None
\ No newline at end of file
+    redirect_url: Optional[str] = None
+    truncated: bool = False
+    slot: Optional[int] = None  # PageSlab slot holding the raw body
+    content_length: int = 0  # Bytes of the body in the slot
+    encoding: Optional[str] = None  # Charset to decode the slot with
+    etag: Optional[str] = None  # ETag / Last-Modified response headers
+    last_modified: Optional[str] = None
+    cash: Optional[float] = None  # OPIC cash the task carried
+    archive: Optional[List] = None  # Where the parser archived the raw body, see archive.ArchiveWriter
+    trace: Optional[List] = None  # Sampled pipeline timeline carried to the WebPage, see tracing
+    slot_generation: int = 0  # Generation of the slot when the body was stored, see shmtransport.PageChannel
+
+@dataclass
+class fetchResult:
+    url: str
+    response: Optional[Any] = None  # httpx.Response when the page should be processed
+    status_code: Optional[int] = None  # HTTP status of the last response, None on network errors
+    redirected: bool = False
+    redirect_url: Optional[str] = None
+    retry_after: Optional[float] = None  # Seconds from a Retry-After header, if the server sent one
+    body: Optional[bytes] = None  # Raw body, only set when the page should be processed
+    encoding: Optional[str] = None  # Charset from the headers or sniffed from the body
+    truncated: bool = False  # Body was cut off at max_body_bytes
+    skip_reason: Optional[str] = None  # Why the body was not downloaded
+    etag: Optional[str] = None  # Validators of the response, for the next conditional fetch
+    last_modified: Optional[str] = None
+
+
+_WEBPAGE_FIELDS = [f.name for f in fields(WebPage)]
+
+def pack_webpage(webpage: WebPage) -> bytes:
+    """Compact binary record of a parsed page for the webpage queue: its field values, marshalled."""
+    return marshal.dumps(tuple(getattr(webpage, name) for name in _WEBPAGE_FIELDS))
+
+def unpack_webpage(record: bytes) -> WebPage:
+    return WebPage(*marshal.loads(record))
+
+_QUEUE_ITEM_FIELDS = [f.name for f in fields(webpageQueueItem)]
+
+def pack_queue_item(item: webpageQueueItem) -> bytes:
+    """Compact binary record of a fetched page waiting to be parsed, for spilling it at shutdown (see supervisor.SpillLog)."""
+    return marshal.dumps(tuple(getattr(item, name) for name in _QUEUE_ITEM_FIELDS))
+
+def unpack_queue_item(record: bytes) -> webpageQueueItem:
+    return webpageQueueItem(*marshal.loads(record))
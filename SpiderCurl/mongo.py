@@ -1,9 +1,14 @@
 # MongoDB connection and data insertion
-from datetime import datetime
+from datetime import datetime, timedelta
+import os
+import threading
 import pymongo
+from bson import ObjectId
 from pymongo import MongoClient
 import toml
 import models
+import frontier
+from canonicalize import canonicalize_url
 
 # get the database connection from config.toml
 
@@ -11,6 +16,25 @@ config = toml.load("config.toml")
 mongo_uri = config["uri"]
 mongo_db = config["db"]
 
+LEASE_SECONDS = config.get("lease_seconds", 3600)  # How long a claimed task stays reserved for its crawler unless renewed
+MAX_ATTEMPTS = config.get("max_attempts", 3)  # Failed fetches are retried until this many attempts
+RETRY_BACKOFF = config.get("retry_backoff", 60)  # Seconds before the first retry, doubled for every further attempt
+
+_db = None
+_db_pid = None
+
+def get_db():
+    """
+    The process's long-lived database handle: one MongoClient (and one round of index
+    checks) per process instead of one per call. MongoClient is not fork-safe, so a forked
+    child opens its own.
+    """
+    global _db, _db_pid
+    if _db is None or _db_pid != os.getpid():
+        _db = connect_to_mongo()
+        _db_pid = os.getpid()
+    return _db
+
 def connect_to_mongo():
     client = MongoClient(
         mongo_uri,
@@ -30,6 +54,15 @@ def connect_to_mongo():
         db["webpages"].create_index([("url", 1), ("last_fetched", -1)], background=True)
         db["crawlTasks"].create_index("url", unique=True, background=True)
         db["crawlTasks"].create_index([("status", 1), ("url", 1)], background=True)
+        db["crawlTasks"].create_index([("status", 1), ("next_attempt_at", 1)], background=True)
+        db["crawlTasks"].create_index([("status", 1), ("lease_expires", 1)], background=True)
+        db["crawlTasks"].create_index("claim_id", sparse=True, background=True)
+        db["crawlTasks"].create_index([("lease_owner", 1), ("status", 1)], background=True)
+        # The frontier: pending tasks in priority order straight off this index, however many there are
+        db["crawlTasks"].create_index([("status", 1), ("priority", -1)], background=True)
+        db["hosts"].create_index("host", unique=True, background=True)
+        db["webpages"].create_index("next_revisit_at", sparse=True, background=True)
+        db["robots"].create_index("origin", unique=True, background=True)
     except:
         pass  # Indexes might already exist
     
@@ -45,14 +78,117 @@ def insert_webpage(db, webpage):
 def check_url_exists(db, url):
     return db["webpages"].count_documents({"url": url}, limit=1) > 0
 
-def get_waiting_tasks(db, limit=1000):
-    return list(db["crawlTasks"].find({"status": "pending"}).limit(limit))
+def _due_tasks_filter(now):
+    # Pending tasks whose retry backoff has passed, plus claims whose lease ran out (crashed or stuck owner)
+    return {"$or": [
+        {"status": "pending", "$or": [{"next_attempt_at": None}, {"next_attempt_at": {"$lte": now}}]},
+        {"status": "in_progress", "lease_expires": {"$lt": now}},
+    ]}
+
+def claim_tasks(db, owner, limit=1000, lease_seconds=LEASE_SECONDS):
+    """
+    Claims up to `limit` due tasks for `owner`, highest priority first: they move to
+    in_progress with a lease that expires after `lease_seconds`, after which any task
+    manager may claim them again.
+    Only _ids are read to pick candidates, and the update re-checks the due filter, so two
+    task managers racing for the same tasks never both get one.
+    """
+    now = datetime.utcnow()
+    due = _due_tasks_filter(now)
+    candidates = [doc["_id"] for doc in db["crawlTasks"].find(due, {"_id": 1}).sort("priority", -1).limit(limit)]
+    if not candidates:
+        return []
+
+    claim_id = ObjectId()
+    db["crawlTasks"].update_many(
+        {"$and": [{"_id": {"$in": candidates}}, due]},
+        {"$set": {
+            "status": "in_progress",
+            "lease_owner": owner,
+            "lease_expires": now + timedelta(seconds=lease_seconds),
+            "claim_id": claim_id,
+            "last_attempted": now.isoformat()
+        }}
+    )
+    projection = {"url": 1, "attempts": 1, "etag": 1, "last_modified": 1, "cash": 1, "priority": 1}
+    return list(db["crawlTasks"].find({"claim_id": claim_id}, projection).sort("priority", -1))
+
+def leased_urls(db, owner):
+    """URLs of the tasks `owner` holds a lease on: claimed, and not yet fetched and stored, failed or given back."""
+    return [doc["url"] for doc in db["crawlTasks"].find({"lease_owner": owner, "status": "in_progress"}, {"_id": 0, "url": 1})]
+
+def renew_leases(db, urls, lease_seconds=LEASE_SECONDS):
+    """Extends the leases of claimed tasks still waiting to be fetched to `lease_seconds` from now."""
+    if urls:
+        db["crawlTasks"].update_many(
+            {"url": {"$in": urls}, "status": "in_progress"},
+            {"$set": {"lease_expires": datetime.utcnow() + timedelta(seconds=lease_seconds)}}
+        )
+
+def release_tasks(db, urls, delay_seconds=0):
+    """Gives claimed tasks back to the pending pool, due again after `delay_seconds`, without counting an attempt."""
+    if urls:
+        db["crawlTasks"].update_many({"url": {"$in": urls}, "status": "in_progress"}, _release_update(delay_seconds))
+
+def _release_task_op(url, delay_seconds=0):
+    return pymongo.UpdateOne({"url": url, "status": "in_progress"}, _release_update(delay_seconds))
+
+def _release_update(delay_seconds):
+    return {"$set": {"status": "pending", "next_attempt_at": datetime.utcnow() + timedelta(seconds=delay_seconds)},
+            "$unset": {"lease_owner": "", "lease_expires": "", "claim_id": ""}}
+
+def retry_task(db, url, error_message=None, retryable=True):
+    """
+    Records a failed attempt. Retryable failures go back to pending with exponential backoff
+    (retry_backoff * 2**attempts seconds) until max_attempts, then the task is failed for good.
+    """
+    db["crawlTasks"].bulk_write([_retry_task_op(url, error_message, retryable)])
+
+def _retry_task_op(url, error_message, retryable):
+    now = datetime.utcnow()
+    attempts = {"$add": [{"$ifNull": ["$attempts", 0]}, 1]}
+    give_up = {"$or": [not retryable, {"$gte": [attempts, MAX_ATTEMPTS]}]}
+    return pymongo.UpdateOne({"url": url}, [
+        {"$set": {
+            "status": {"$cond": [give_up, "failed", "pending"]},
+            # now + backoff, written as a subtraction: the one date arithmetic mongomock evaluates too
+            "next_attempt_at": {"$subtract": [now, {"$multiply": [-RETRY_BACKOFF * 1000, {"$pow": [2, {"$ifNull": ["$attempts", 0]}]}]}]},
+            "attempts": attempts,
+            "last_attempted": now.isoformat(),
+            "error_message": error_message
+        }},
+        {"$project": {"lease_owner": 0, "lease_expires": 0, "claim_id": 0}}  # $unset, in a stage mongomock knows
+    ])
+
+def seed_tasks(db, urls):
+    """(Re)queues the start URLs as pending tasks, used when the frontier has run dry."""
+    operations = [
+        pymongo.UpdateOne(
+            {"url": url, "status": {"$ne": "in_progress"}},
+            {"$set": {"status": "pending", "next_attempt_at": None, "cash": frontier.SEED_CASH,
+                      "priority": frontier.priority(frontier.SEED_CASH, 0, frontier.url_depth(url), 0)},
+             "$setOnInsert": {"attempts": 0, "last_attempted": None, "error_message": None}},
+            upsert=True
+        )
+        for url in urls
+    ]
+    if operations:
+        try:
+            db["crawlTasks"].bulk_write(operations, ordered=False)
+        except pymongo.errors.BulkWriteError:
+            pass  # Seed already claimed by a fetcher (upsert hit the unique url index)
+
+def has_open_tasks(db):
+    return db["crawlTasks"].count_documents({"status": {"$in": ["pending", "in_progress"]}}, limit=1) > 0
 
 def update_task_status(db, url, status, error_message=None):
+    db["crawlTasks"].bulk_write([_task_status_op(url, status, error_message)])
+
+def _task_status_op(url, status, error_message=None):
     update_fields = {"status": status}
     if error_message:
         update_fields["error_message"] = error_message
-    db["crawlTasks"].update_one({"url": url}, {"$set": update_fields})
+    return pymongo.UpdateOne({"url": url}, {"$set": update_fields, "$unset": {"lease_owner": "", "lease_expires": "", "claim_id": ""}})
 
 def create_task(db, url):
     if db["crawlTasks"].count_documents({"url": url}) == 0:
@@ -65,21 +201,93 @@ def create_task(db, url):
         })
 
 def update_task_attempt(db, url, status):
-    db["crawlTasks"].update_one(
+    db["crawlTasks"].bulk_write([_task_attempt_op(url, status)])
+
+def _task_attempt_op(url, status):
+    return pymongo.UpdateOne(
         {"url": url},
         {
-            "status": status,
-            "$inc": {"attempts": 1},
-            "$set": {"last_attempted": datetime.datetime.utcnow().isoformat()}
+            "$set": {"status": status, "last_attempted": datetime.utcnow().isoformat()},
+            "$inc": {"attempts": 1}
         }
     )
 
+class StatusWriter:
+    """
+    Buffers crawl task transitions (status changes, attempts, retries, releases) of one process and
+    writes them with a single unordered bulk_write once status_batch_size are waiting or
+    every status_flush_seconds. Callers only append to the buffer; a background thread does
+    the writes, so it is safe to use from the fetchers' event loop.
+    """
+
+    def __init__(self, db=None, batch_size=None, flush_seconds=None):
+        self.db = db if db is not None else get_db()
+        self.batch_size = batch_size or config.get("status_batch_size", 500)
+        self.flush_seconds = flush_seconds or config.get("status_flush_seconds", 2.0)
+        self.operations = []
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.closed = False
+        self.thread = threading.Thread(target=self._run, name="status-writer", daemon=True)
+        self.thread.start()
+
+    def status(self, url, status, error_message=None):
+        self._add(_task_status_op(url, status, error_message))
+
+    def attempt(self, url, status):
+        self._add(_task_attempt_op(url, status))
+
+    def retry(self, url, error_message=None, retryable=True):
+        self._add(_retry_task_op(url, error_message, retryable))
+
+    def release(self, url, delay_seconds=0):
+        self._add(_release_task_op(url, delay_seconds))
+
+    def _add(self, operation):
+        with self.lock:
+            self.operations.append(operation)
+            full = len(self.operations) >= self.batch_size
+        if full:
+            self.wakeup.set()
+
+    def _run(self):
+        while not self.closed:
+            self.wakeup.wait(self.flush_seconds)
+            self.wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            operations, self.operations = self.operations, []
+        if not operations:
+            return
+        try:
+            self.db["crawlTasks"].bulk_write(operations, ordered=False)
+        except pymongo.errors.BulkWriteError as e:
+            print(f"Status writer: {len(e.details.get('writeErrors', []))} of {len(operations)} task updates failed")
+        except pymongo.errors.PyMongoError as e:
+            # Keep the transitions for the next flush instead of losing them
+            print(f"Status writer error: {e}")
+            with self.lock:
+                self.operations[:0] = operations
+
+    def close(self):
+        self.closed = True
+        self.wakeup.set()
+        self.thread.join()
+        self.flush()
+
 def get_image_by_url_count(db, image_url):
     return db["webpages"].count_documents({"image_data.url": image_url})
 
 
 
-def insert_many_webpages(db, webpages):
+def insert_many_webpages(db, webpages, freshness=None):
+    """
+    Upserts pages by url. `freshness` maps urls to the revisit fields to store with them (see
+    revisit.freshness_update); a not_modified page only updates those and its validators.
+    A page's stored cash is OPIC's history, the cash it has paid out over all its fetches.
+    """
     if not webpages:
         return
     
@@ -88,10 +296,19 @@ def insert_many_webpages(db, webpages):
     # Use upsert operations in bulk
     operations = []
     for webpage in webpage_dicts:
+        if webpage.get("not_modified"):
+            document = {key: webpage[key] for key in ("last_fetched", "etag", "last_modified") if webpage.get(key) is not None}
+        else:
+            document = {key: value for key, value in webpage.items() if key not in ("not_modified", "trace", "cash")}
+        if freshness:
+            document.update(freshness.get(webpage["url"], {}))
+        update = {"$set": document}
+        if webpage.get("cash"):
+            update["$inc"] = {"cash": webpage["cash"]}
         operations.append(
             pymongo.UpdateOne(
                 {"url": webpage["url"]}, 
-                {"$set": webpage}, 
+                update, 
                 upsert=True
             )
         )
@@ -100,9 +317,121 @@ def insert_many_webpages(db, webpages):
         db["webpages"].bulk_write(operations, ordered=False)
 
 
-def create_many_tasks(db, urls):
+def page_freshness(db, urls):
+    """Stored revisit counters and content hash of the given pages, by url."""
+    projection = {"_id": 0, "url": 1, "content_hash": 1, "first_checked": 1, "checks": 1, "changes": 1}
+    return {page["url"]: page for page in db["webpages"].find({"url": {"$in": urls}}, projection)}
+
+
+def due_revisits(db, limit):
+    """Stored pages whose next_revisit_at has passed, earliest first."""
+    projection = {"_id": 0, "url": 1, "etag": 1, "last_modified": 1, "change_rate": 1, "last_checked": 1, "cash": 1}
+    return list(db["webpages"].find({"next_revisit_at": {"$lte": datetime.utcnow()}}, projection)
+                .sort("next_revisit_at", 1).limit(limit))
+
+
+def queue_revisits(db, pages, hold_seconds=LEASE_SECONDS):
+    """
+    Adds crawl tasks for the pages, carrying their validators so the fetch is conditional,
+    and moves their next_revisit_at out of the way until the revisit has been stored.
+    """
+    if not pages:
+        return
+    operations = [
+        pymongo.UpdateOne(
+            {"url": page["url"], "status": {"$ne": "in_progress"}},
+            {"$set": {"status": "pending", "next_attempt_at": None, "attempts": 0, "error_message": None,
+                      "etag": page.get("etag"), "last_modified": page.get("last_modified"),
+                      # The page paid its cash out when it was fetched: a revisit starts with none to
+                      # hand on, and competes with new URLs on the cash it has paid out so far
+                      "cash": 0.0,
+                      "priority": frontier.priority(page.get("cash") or 0.0, 0, frontier.url_depth(page["url"]), 0)},
+             "$setOnInsert": {"last_attempted": None}},
+            upsert=True
+        )
+        for page in pages
+    ]
+    try:
+        db["crawlTasks"].bulk_write(operations, ordered=False)
+    except pymongo.errors.BulkWriteError:
+        pass  # Already being fetched (upsert hit the unique url index)
+    db["webpages"].update_many(
+        {"url": {"$in": [page["url"] for page in pages]}},
+        {"$set": {"next_revisit_at": datetime.utcnow() + timedelta(seconds=hold_seconds)}}
+    )
+
+
+def load_fingerprints(db, index):
+    """Fills a simhash.SimHashIndex with the fingerprints of the stored pages that are not duplicates."""
+    cursor = db["webpages"].find({"simhash": {"$ne": None}, "duplicate_of": None},
+                                 {"_id": 0, "url": 1, "simhash": 1}, batch_size=10000)
+    for page in cursor:
+        index.add(page["url"], page["simhash"])
+
+
+def known_urls(db, batch_size=10000):
+    """Batches of the URLs of every stored page and crawl task, to fill a fresh seen filter."""
+    for collection in ("webpages", "crawlTasks"):
+        batch = []
+        for doc in db[collection].find({}, {"_id": 0, "url": 1}, batch_size=batch_size):
+            batch.append(doc["url"])
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+
+def archive_locations(db, urls):
+    """Archive location ([segment, offset, length]) of the given stored pages that are not near-duplicate pointers, by url."""
+    return {doc["url"]: doc.get("archive") for doc in db["webpages"].find({"url": {"$in": list(urls)}, "duplicate_of": None},
+                                                                            {"_id": 0, "url": 1, "archive": 1})}
+
+
+def load_robots(db, origins):
+    """Stored robots.txt rules (see robots.RobotsRules.to_doc) of the given origins."""
+    return db["robots"].find({"origin": {"$in": list(origins)}}, {"_id": 0})
+
+
+def save_robots(db, doc):
+    db["robots"].update_one({"origin": doc["origin"]}, {"$set": doc}, upsert=True)
+
+
+def add_host_links(db, counts):
+    """Adds cross-host link counts to the hosts collection (see frontier.cross_host_links)."""
+    if counts:
+        db["hosts"].bulk_write([pymongo.UpdateOne({"host": host}, {"$inc": {"inlinks": count}}, upsert=True)
+                                for host, count in counts.items()], ordered=False)
+
+
+def host_authority(db, hosts):
+    """Cross-host inlinks of the given hosts, by host."""
+    return {doc["host"]: doc["inlinks"] for doc in db["hosts"].find({"host": {"$in": list(hosts)}}, {"_id": 0})}
+
+
+def create_many_tasks(db, urls, seen=None, credits=None, robots=None):
+    """
+    Adds tasks for the URLs not crawled or queued yet. `credits` (url -> [cash, inlinks], see
+    frontier.credit_outlinks) sets the priority of new tasks and is added to pending ones.
+    With a robots.RobotsCache, URLs their robots.txt disallows never become tasks.
+    """
+    urls = [url for url in map(canonicalize_url, urls) if url]
+    if robots is not None:
+        urls = robots.allowed_urls(urls)
     if not urls:
         return
+    authority = host_authority(db, {frontier.host_of(url) for url in urls}) if credits else {}
+    
+    if seen is not None:
+        # The seen filter already knows every URL that ever became a task or a page, so new
+        # URLs can be inserted straight away without the dedup queries below
+        new_urls = seen.missing(urls)
+        _insert_new_tasks(db, new_urls, credits, authority)
+        seen.add_many(new_urls)
+        if credits:
+            new = set(new_urls)
+            _credit_tasks(db, {url: credit for url, credit in credits.items() if url not in new}, authority)
+        return
     
     # Single aggregation to get all existing URLs
     pipeline = [
@@ -125,25 +454,51 @@ def create_many_tasks(db, urls):
     existing_tasks = set(doc["url"] for doc in db["crawlTasks"].find({"url": {"$in": urls}}, {"url": 1}))
     
     # Filter new URLs
+    _insert_new_tasks(db, [url for url in dict.fromkeys(urls) if url not in existing_tasks and url not in existing_urls],
+                      credits, authority)
+
+def _insert_new_tasks(db, urls, credits=None, authority=None):
     new_tasks = []
     for url in urls:
-        if url not in existing_tasks and url not in existing_urls:
-            new_tasks.append({
-                "url": url,
-                "status": "pending",
-                "attempts": 0,
-                "last_attempted": None,
-                "error_message": None
-            })
+        cash, inlinks = credits.get(url, (0.0, 0)) if credits else (0.0, 0)
+        new_tasks.append({
+            "url": url,
+            "status": "pending",
+            "attempts": 0,
+            "last_attempted": None,
+            "error_message": None,
+            "cash": cash,
+            "inlinks": inlinks,
+            "priority": frontier.priority(cash, inlinks, frontier.url_depth(url), (authority or {}).get(frontier.host_of(url), 0))
+        })
     
     # Bulk insert with ignore duplicates
     if new_tasks:
         try:
             db["crawlTasks"].insert_many(new_tasks, ordered=False)
-        except pymongo.errors.BulkWriteError as e:
+        except pymongo.errors.BulkWriteError:
             # Ignore duplicate key errors
             pass
 
+def _credit_tasks(db, credits, authority):
+    """Adds cash and inlinks to the pending tasks among `credits` and re-scores them."""
+    if not credits:
+        return
+    operations = []
+    for task in db["crawlTasks"].find({"url": {"$in": list(credits)}, "status": "pending"}, {"url": 1, "cash": 1, "inlinks": 1, "pagerank": 1}):
+        url = task["url"]
+        cash, inlinks = credits[url]
+        total_cash = (task.get("cash") or 0.0) + cash
+        total_inlinks = (task.get("inlinks") or 0) + inlinks
+        operations.append(pymongo.UpdateOne(
+            {"_id": task["_id"]},
+            {"$inc": {"cash": cash, "inlinks": inlinks},
+             "$set": {"priority": frontier.priority(total_cash, total_inlinks, frontier.url_depth(url),
+                                                    authority.get(frontier.host_of(url), 0), task.get("pagerank") or 0.0)}}
+        ))
+    if operations:
+        db["crawlTasks"].bulk_write(operations, ordered=False)
+
 def remove_tasks(db, urls):
     if urls:
         db["crawlTasks"].delete_many({"url": {"$in": urls}})
\ No newline at end of file
@@ -1,14 +1,216 @@
 from bs4 import BeautifulSoup
+from html.parser import HTMLParser
 import urllib.parse
 import time
+import toml
 import curler
 import mongo
+from canonicalize import canonicalize_url
 from typing import Dict, List, Any
 
-def process_html_content(content: str, base_url: str) -> Dict[str, Any]:
+try:
+    from lxml import etree
+except ImportError:
+    etree = None
+
+config = toml.load("config.toml")
+
+# "lxml" (C parser, falls back to "html.parser" when lxml is missing), "html.parser" or
+# "bs4" (the original BeautifulSoup extraction, kept as the reference for parity checks)
+PARSER_BACKEND = config.get("parser_backend", "lxml")
+
+# Tags whose text is left out of text_content (img is dropped too, but has no text)
+SKIPPED_TEXT_TAGS = frozenset(['script', 'style', 'header', 'footer', 'nav', 'aside', 'form'])
+
+# libxml2 reads these as raw text up to their end tag; html.parser (and so BeautifulSoup) parses markup in them
+RAW_TEXT_TAGS = frozenset(['title', 'textarea', 'iframe', 'noembed', 'noframes', 'xmp'])
+
+def process_html_content(content: str, base_url: str, backend: str = None) -> Dict[str, Any]:
     """
     Parses HTML content once and extracts all relevant information.
     """
+    backend = backend or PARSER_BACKEND
+    if backend == "bs4":
+        return _process_with_soup(content, base_url)
+
+    extractor = _PageExtractor(base_url)
+    if backend == "lxml" and etree is not None:
+        parser = etree.HTMLParser(target=extractor)
+        parser.feed(content)
+        result = parser.close()
+        if not extractor.raw_markup:
+            return result
+        # Markup inside a title, textarea or iframe (or one left open) comes out of lxml as
+        # text; such pages go through html.parser to get the tags in it parsed like the reference
+        extractor = _PageExtractor(base_url)
+
+    parser = _StdlibParser(extractor)
+    parser.feed(content)
+    parser.close()
+    return extractor.close()
+
+class _PageExtractor:
+    """
+    Parser target that collects title, meta tags, links, images and visible text in the
+    single pass of the parser's start/end/data events, without building a tree. It follows
+    lxml's target interface; _StdlibParser drives it from html.parser. Comments, processing
+    instructions and CDATA sections end the text before them, as separate nodes do in soup.
+    """
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url
+        self.title = None
+        self.meta_description = None
+        self.metadata = {}
+        self.urls = {}  # dict keeps first-seen order while dropping repeats
+        self.images = []
+        self.texts = []
+        self._chunks = []  # pieces of the current text node, parsers may split one node
+        self._title_chunks = None
+        self._in_title = False
+        self._in_raw_text = False
+        self._skip_depth = 0
+        self.raw_markup = False  # Saw '<' in the text of a RAW_TEXT_TAGS element
+
+    def _flush_text(self):
+        if self._chunks:
+            text = ''.join(self._chunks).strip()
+            if text and not self._skip_depth:
+                self.texts.append(text)
+            self._chunks = []
+
+    def start(self, tag, attrs):
+        self._flush_text()
+        if tag in RAW_TEXT_TAGS:
+            self._in_raw_text = True
+        if tag in SKIPPED_TEXT_TAGS:
+            self._skip_depth += 1
+        elif tag == 'a':
+            href = attrs.get('href')
+            if href is not None:
+                abs_url = canonicalize_url(href, self.base_url)
+                if abs_url:
+                    self.urls[abs_url] = None
+        elif tag == 'meta':
+            self._meta(attrs)
+        elif tag == 'img':
+            self._image(attrs)
+        elif tag == 'title' and self.title is None and self._title_chunks is None:
+            self._title_chunks = []
+            self._in_title = True
+
+    def end(self, tag):
+        self._flush_text()
+        if tag in RAW_TEXT_TAGS:
+            self._in_raw_text = False
+        if tag in SKIPPED_TEXT_TAGS:
+            if self._skip_depth:
+                self._skip_depth -= 1
+        elif tag == 'title' and self._in_title:
+            self._in_title = False
+            self.title = ''.join(self._title_chunks)
+
+    def data(self, data):
+        self._chunks.append(data)
+        if self._in_title:
+            self._title_chunks.append(data)
+        if self._in_raw_text and '<' in data:
+            self.raw_markup = True
+
+    def comment(self, text):
+        # libxml2 hands CDATA sections over as comments, "[CDATA[...]]"
+        if text.startswith('[CDATA[') and text.endswith(']]'):
+            self.cdata(text[7:-2])
+        else:
+            self._flush_text()
+
+    def pi(self, target, data=None):
+        self._flush_text()
+
+    def cdata(self, text):
+        # Text of its own, like soup's CData node
+        self._flush_text()
+        self.data(text)
+        self._flush_text()
+
+    def close(self) -> Dict[str, Any]:
+        self._flush_text()
+        if self._in_title:
+            self.title = ''.join(self._title_chunks)
+        return {
+            "title": self.title if self.title is not None else 'No title found',
+            "meta_description": self.meta_description if self.meta_description is not None else 'No description found',
+            "metadata": self.metadata,
+            "extracted_urls": list(self.urls),
+            "images_info": self.images,
+            "text_content": ' '.join(self.texts)
+        }
+
+    def _meta(self, attrs):
+        name = attrs.get('name')
+        content = attrs.get('content')
+        # Only the first description meta counts, as with soup.find
+        if name == 'description' and self.meta_description is None:
+            self.meta_description = content if content is not None else 'No description found'
+        if content is not None:
+            if name is not None:
+                self.metadata[name] = content
+            elif attrs.get('property') is not None:
+                self.metadata[attrs['property']] = content
+
+    def _image(self, attrs):
+        src = attrs.get('src')
+        if not src:
+            return
+        self.images.append(_image_info(
+            urllib.parse.urljoin(self.base_url, src), attrs.get('alt'), attrs.get('title'),
+            attrs.get('width'), attrs.get('height')
+        ))
+
+class _StdlibParser(HTMLParser):
+    """Feeds html.parser events into a _PageExtractor when lxml is not installed."""
+
+    def __init__(self, target: _PageExtractor):
+        super().__init__(convert_charrefs=True)
+        self.target = target
+
+    def handle_starttag(self, tag, attrs):
+        # Valueless attributes come through as None; BeautifulSoup reports them as ''
+        self.target.start(tag, {name: value if value is not None else '' for name, value in attrs})
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        self.target.end(tag)
+
+    def handle_endtag(self, tag):
+        self.target.end(tag)
+
+    def handle_data(self, data):
+        self.target.data(data)
+
+    def handle_comment(self, data):
+        self.target.comment(data)
+
+    def handle_pi(self, data):
+        self.target.pi(data)
+
+    def unknown_decl(self, data):
+        if data.startswith('CDATA['):
+            self.target.cdata(data[6:])
+
+def _image_info(url, alt_text, title, width, height) -> Dict[str, Any]:
+    return {
+        "url": url,
+        "alt_text": alt_text,
+        "title": title,
+        "width": int(width) if width and width.isdigit() else None,
+        "height": int(height) if height and height.isdigit() else None,
+        "file_size": None,
+        "format": None,
+        "last_fetched": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime())
+    }
+
+def _process_with_soup(content: str, base_url: str) -> Dict[str, Any]:
     # Parse the content only once
     soup = BeautifulSoup(content, 'html.parser')
 
@@ -25,11 +227,12 @@ def process_html_content(content: str, base_url: str) -> Dict[str, Any]:
     return processed_data
 
 def _get_urls(soup: BeautifulSoup, base_url: str) -> List[str]:
-    urls = []
+    urls = {}
     for link in soup.find_all('a', href=True):
-        abs_url = urllib.parse.urljoin(base_url, link['href'])
-        urls.append(abs_url)
-    return urls
+        abs_url = canonicalize_url(link['href'], base_url)
+        if abs_url:
+            urls[abs_url] = None  # dict keeps first-seen order while dropping repeats
+    return list(urls)
 
 def _get_title(soup: BeautifulSoup) -> str:
     title_tag = soup.find('title')
@@ -66,15 +269,5 @@ def _get_images(soup: BeautifulSoup, base_url: str) -> List[Dict[str, Any]]:
         if not img['src']:
             continue
         abs_url = urllib.parse.urljoin(base_url, img['src'])
-
-        images.append({
-            "url": abs_url,
-            "alt_text": img.get('alt', None),
-            "title": img.get('title', None),
-            "width": int(img.get('width')) if img.get('width') and img.get('width').isdigit() else None,
-            "height": int(img.get('height')) if img.get('height') and img.get('height').isdigit() else None,
-            "file_size": None,
-            "format": None,
-            "last_fetched": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime())
-        })
-    return images
\ No newline at end of file
+        images.append(_image_info(abs_url, img.get('alt', None), img.get('title', None), img.get('width'), img.get('height')))
+    return images
@@ -0,0 +1,78 @@
+# Append-only record logs handed from the crawler's write path to background consumers
+import marshal
+import os
+import struct
+from typing import List, Tuple
+
+_LENGTH = struct.Struct("<I")  # record length prefix
+
+
+class RecordLog:
+    """
+    Append-only log of marshal-able records in numbered files of length-prefixed records.
+    One process appends; a consumer reads from its committed (file, offset) position and
+    trims the files it is done with. Every writer session starts a new file, so a record
+    torn by a crash is only ever at the end of a file and is skipped.
+    """
+
+    def __init__(self, path: str, max_bytes: int = 64 * 1024 * 1024):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.file = None
+
+    def _numbers(self) -> List[int]:
+        return sorted(int(name[:-4]) for name in os.listdir(self.path) if name.endswith(".log"))
+
+    def _file_path(self, number: int) -> str:
+        return os.path.join(self.path, f"{number:08d}.log")
+
+    def append(self, records: list):
+        if not records:
+            return
+        if self.file is None:
+            self.file = open(self._file_path(max(self._numbers(), default=-1) + 1), "ab")
+        data = bytearray()
+        for record in records:
+            record = marshal.dumps(record)
+            data += _LENGTH.pack(len(record))
+            data += record
+        self.file.write(data)
+        self.file.flush()
+        if self.file.tell() >= self.max_bytes:
+            self.file.close()
+            self.file = None
+
+    def read(self, position: Tuple[int, int], max_records: int) -> Tuple[list, Tuple[int, int]]:
+        """Up to max_records complete records after `position`, and the position after them."""
+        number, offset = position
+        records = []
+        numbers = [n for n in self._numbers() if n >= number]
+        for i, n in enumerate(numbers):
+            if n != number:
+                number, offset = n, 0
+            with open(self._file_path(n), "rb") as f:
+                f.seek(offset)
+                data = f.read()
+            pos = 0
+            while len(records) < max_records and pos + _LENGTH.size <= len(data):
+                (length,) = _LENGTH.unpack_from(data, pos)
+                if pos + _LENGTH.size + length > len(data):
+                    break  # still being written, or torn if this is not the newest file
+                records.append(marshal.loads(data[pos + _LENGTH.size:pos + _LENGTH.size + length]))
+                pos += _LENGTH.size + length
+            offset += pos
+            if len(records) >= max_records or i == len(numbers) - 1:
+                break
+        return records, (number, offset)
+
+    def trim(self, position: Tuple[int, int]):
+        """Deletes the files before the one `position` points into."""
+        for number in self._numbers():
+            if number < position[0]:
+                os.remove(self._file_path(number))
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
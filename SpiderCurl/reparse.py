@@ -0,0 +1,179 @@
+# Offline re-parse: runs the current extractor over the page archive and updates the stored pages
+import argparse
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, List, Optional, Tuple
+
+import toml
+
+import archive
+import curler
+import models
+import mongo
+import processInfo
+import revisit
+import simhash
+
+config = toml.load("config.toml")
+
+CHECKPOINT_PATH = config.get("reparse_checkpoint", "data/reparse.json")
+CHUNK_RECORDS = config.get("reparse_chunk", 500)  # Archived pages per work unit and per bulk upsert
+# What the extractor produces; fetch and crawl state (cash, validators, freshness, duplicate_of) is left alone
+REPARSED_FIELDS = ("title", "meta_description", "text_content", "extracted_urls", "image_data", "metadata",
+                   "simhash", "content_hash", "archive")
+
+_reader = None
+
+
+def _open_reader(path: str):
+    global _reader
+    _reader = archive.ArchiveReader(path)
+
+
+def parse_chunk(chunk: Tuple[str, List[Tuple[int, int]]]) -> List[bytes]:
+    """Extracts the pages of one work unit in a pool process; returns them packed (models.pack_webpage)."""
+    segment, entries = chunk
+    pages = []
+    for offset, length in entries:
+        record = _reader.read(segment, offset, length)
+        if record.status_code != 200:
+            continue
+        info = processInfo.process_html_content(curler.decode_body(record.body, record.encoding), record.url)
+        if not info:
+            continue
+        text = info.get("text_content")
+        pages.append(models.pack_webpage(models.WebPage(
+            url=record.url,
+            title=info.get("title"),
+            meta_description=info.get("meta_description"),
+            text_content=text,
+            extracted_urls=info.get("extracted_urls"),
+            image_data=info.get("images_info"),
+            metadata=info.get("metadata"),
+            last_fetched=record.fetched_at.rstrip("Z") if record.fetched_at else None,
+            truncated=record.truncated,
+            simhash=simhash.fingerprint(text),
+            etag=record.etag,
+            last_modified=record.last_modified,
+            content_hash=revisit.content_hash(text),
+            archive=[segment, offset, length],
+        )))
+    return pages
+
+
+def read_checkpoint(path: str) -> Optional[dict]:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def write_checkpoint(path: str, segment: str, offset: int):
+    """Everything before `offset` in `segment` (and in every earlier segment) is stored."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path + ".tmp", "w") as f:
+        json.dump({"segment": segment, "offset": offset}, f)
+    os.replace(path + ".tmp", path)
+
+
+def work_units(reader: archive.ArchiveReader, checkpoint: Optional[dict],
+               chunk_records: int) -> Iterator[Tuple[str, List[Tuple[int, int]], int]]:
+    """(segment, [(offset, length)], next offset) chunks in archive order, starting after the checkpoint."""
+    for segment in reader.segments():
+        if checkpoint and segment < checkpoint["segment"]:
+            continue
+        start = checkpoint["offset"] if checkpoint and segment == checkpoint["segment"] else 0
+        entries = []
+        for offset, length, _ in reader.entries(segment):
+            if offset < start:
+                continue
+            entries.append((offset, length))
+            if len(entries) == chunk_records:
+                yield segment, entries, offset + length
+                entries = []
+        if entries:
+            yield segment, entries, entries[-1][0] + entries[-1][1]
+
+
+def reparse(path: str = archive.ARCHIVE_PATH, workers: Optional[int] = None, chunk_records: int = CHUNK_RECORDS,
+            checkpoint_path: str = CHECKPOINT_PATH, restart: bool = False, index: bool = False,
+            report_seconds: float = 10.0) -> int:
+    """
+    Streams the archive through a process pool and bulk-upserts the extracted fields. A
+    record only updates the stored page whose archive location it is, so other copies of
+    the URL, pages not in Mongo and near-duplicate pointers are left alone. Work units are
+    collected in submission order, which keeps the checkpoint after each upsert exact; at
+    most workers * 2 units are in flight. With `index`, the pages are also appended to the
+    index log, which only works while the crawler is stopped; its indexer replaces their
+    indexed copies on the next start.
+    """
+    reader = archive.ArchiveReader(path)
+    checkpoint = None if restart else read_checkpoint(checkpoint_path)
+    if checkpoint:
+        print(f"Resuming from {checkpoint['segment']} at offset {checkpoint['offset']}")
+    db = mongo.get_db()
+    index_log = lock = None
+    if index:
+        from searchindex import IndexLog
+        from supervisor import crawler_lock
+        # The index log has a single writer, the crawler's database manager while it runs
+        lock = crawler_lock()
+        if lock is None:
+            raise RuntimeError("reparse --index appends to the index log and cannot run while the crawler does")
+        index_log = IndexLog()
+    workers = workers or os.cpu_count() or 1
+    units = work_units(reader, checkpoint, chunk_records)
+    pending = deque()
+    records = stored = 0
+    start = last_report = time.monotonic()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_open_reader, initargs=(path,)) as pool:
+        while True:
+            while len(pending) < workers * 2:
+                unit = next(units, None)
+                if unit is None:
+                    break
+                segment, entries, next_offset = unit
+                pending.append((pool.submit(parse_chunk, (segment, entries)), segment, len(entries), next_offset))
+            if not pending:
+                break
+            future, segment, count, next_offset = pending.popleft()
+            webpages = [models.unpack_webpage(record) for record in future.result()]
+            # Only a page's own archived copy updates it: parsers archive side by side, so
+            # archive order does not tell an older copy of a URL from a newer one
+            locations = mongo.archive_locations(db, [webpage.url for webpage in webpages])
+            webpages = [webpage for webpage in webpages if locations.get(webpage.url) == webpage.archive]
+            mongo.insert_many_webpages(db, [dict({name: getattr(webpage, name) for name in REPARSED_FIELDS}, url=webpage.url)
+                                            for webpage in webpages])
+            if index_log is not None:
+                index_log.append(webpages)
+            write_checkpoint(checkpoint_path, segment, next_offset)
+            records += count
+            stored += len(webpages)
+            now = time.monotonic()
+            if now - last_report >= report_seconds:
+                print(f"{records} archived pages, {stored} stored, {records / (now - start):.1f} pages/s, at {segment}")
+                last_report = now
+    elapsed = time.monotonic() - start
+    print(f"Re-parsed {records} archived pages ({stored} stored) in {elapsed:.1f}s: "
+          f"{records / max(elapsed, 1e-9):.1f} pages/s with {workers} processes")
+    if index_log is not None:
+        index_log.close()
+        lock.close()
+    reader.close()
+    return stored
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-run the extractor over the page archive and update the stored pages")
+    parser.add_argument("--archive", default=archive.ARCHIVE_PATH, help="archive folder")
+    parser.add_argument("--workers", type=int, default=None, help="parser processes (default: one per CPU)")
+    parser.add_argument("--chunk", type=int, default=CHUNK_RECORDS, help="archived pages per work unit and upsert")
+    parser.add_argument("--checkpoint", default=CHECKPOINT_PATH, help="resume state, rewritten after every upsert")
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint and start from the first segment")
+    parser.add_argument("--index", action="store_true", help="also queue the pages for the indexer (crawler stopped)")
+    args = parser.parse_args()
+    reparse(args.archive, args.workers, args.chunk, args.checkpoint, args.restart, args.index)
@@ -0,0 +1,81 @@
+# Change-rate estimation and revisit scheduling for stored pages
+import hashlib
+import math
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+import toml
+
+config = toml.load("config.toml")
+
+TARGET_STALENESS = config.get("revisit_target_staleness", 0.5)  # Revisit once a page has changed with this probability
+MIN_REVISIT = config.get("min_revisit_seconds", 3600)
+MAX_REVISIT = config.get("max_revisit_seconds", 30 * 86400)
+DEFAULT_CHANGE_RATE = 1 / (7 * 86400)  # Changes per second assumed until a page has been fetched twice: weekly
+
+
+def content_hash(text: Optional[str]) -> Optional[int]:
+    """64-bit hash of the extracted text, signed to fit a Mongo int64; markup-only changes do not count."""
+    if text is None:
+        return None
+    value = int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+    return value - (1 << 64) if value >> 63 else value
+
+
+def change_rate(checks: int, changes: int, observed_seconds: float) -> float:
+    """
+    Estimated changes per second from `checks` re-fetches over `observed_seconds`, `changes`
+    of which found new content. Uses Cho and Garcia-Molina's estimator for a Poisson process
+    seen at intervals, -ln((n - X + 0.5) / (n + 0.5)) / interval, which unlike X / T does
+    not underestimate pages that changed more than once between two fetches.
+    """
+    if checks < 1 or observed_seconds <= 0:
+        return DEFAULT_CHANGE_RATE
+    # No change seen yet only says the rate is low, not zero: count it as half a change
+    changes = max(changes, 0.5)
+    return -math.log((checks - changes + 0.5) / (checks + 0.5)) / (observed_seconds / checks)
+
+
+def staleness(rate: float, seconds_since_check: float) -> float:
+    """Probability that a page changed since it was last fetched."""
+    return 1 - math.exp(-rate * max(seconds_since_check, 0.0))
+
+
+def revisit_interval(rate: float) -> float:
+    """Seconds until staleness reaches TARGET_STALENESS, within [MIN_REVISIT, MAX_REVISIT]."""
+    seconds = -math.log(1 - TARGET_STALENESS) / rate if rate > 0 else MAX_REVISIT
+    return min(max(seconds, MIN_REVISIT), MAX_REVISIT)
+
+
+def freshness_update(previous: Optional[dict], webpage, now: datetime) -> dict:
+    """
+    Fields to store for a fetch of `webpage` (a full page or a 304): the check and change
+    counters, the change rate estimated from them and when the page is due again.
+    `previous` holds the stored page's counters and content_hash, None for a new page.
+    """
+    if previous is None or previous.get("first_checked") is None:
+        first_checked, checks, changes = now, 0, 0
+    else:
+        first_checked = previous["first_checked"]
+        checks = previous.get("checks", 0) + 1
+        changes = previous.get("changes", 0)
+        if not webpage.not_modified and webpage.content_hash != previous.get("content_hash"):
+            changes += 1
+    rate = change_rate(checks, changes, (now - first_checked).total_seconds())
+    return {
+        "first_checked": first_checked,
+        "last_checked": now,
+        "checks": checks,
+        "changes": changes,
+        "change_rate": rate,
+        "next_revisit_at": now + timedelta(seconds=revisit_interval(rate)),
+    }
+
+
+def pick_revisits(pages: List[dict], now: datetime, limit: int) -> List[dict]:
+    """The `limit` due pages most likely to have changed by now."""
+    def expected_staleness(page):
+        last_checked = page.get("last_checked") or now
+        rate = page.get("change_rate")
+        return staleness(DEFAULT_CHANGE_RATE if rate is None else rate, (now - last_checked).total_seconds())
+    return sorted(pages, key=expected_staleness, reverse=True)[:limit]
@@ -0,0 +1,198 @@
+# robots.txt rules per origin: parsed once, compiled to a single regex, cached in memory and Mongo
+import re
+import time
+import urllib.parse
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import toml
+
+import mongo
+
+config = toml.load("config.toml")
+
+USER_AGENT = config.get("robots_user_agent", "SpiderCurl").lower()  # Product token robots.txt groups are matched against
+ROBOTS_TTL = config.get("robots_ttl", 86400)  # Seconds fetched rules are trusted (RFC 9309 caps caching at 24h)
+ERROR_TTL = config.get("robots_error_ttl", 3600)  # Seconds before retrying an unreachable robots.txt
+UNKNOWN_RECHECK = config.get("robots_unknown_recheck", 300)  # Seconds an origin without stored rules is not looked up again
+MAX_CRAWL_DELAY = config.get("robots_max_crawl_delay", 60.0)  # Longer Crawl-delays are cut to this
+CACHE_SIZE = config.get("robots_cache_size", 50000)  # Origins kept in memory per process
+MAX_BYTES = 512 * 1024  # robots.txt is only read this far
+
+
+def origin_of(url: str) -> str:
+    parts = urllib.parse.urlsplit(url)
+    return f"{parts.scheme.lower()}://{parts.netloc.lower()}"
+
+
+def robots_url(origin: str) -> str:
+    return origin + "/robots.txt"
+
+
+def _path_of(url: str) -> str:
+    parts = urllib.parse.urlsplit(url)
+    return (parts.path or "/") + ("?" + parts.query if parts.query else "")
+
+
+def _regex(path: str) -> str:
+    anchored = path.endswith("$")
+    if anchored:
+        path = path[:-1]
+    return ".*".join(re.escape(part) for part in path.split("*")) + ("\\Z" if anchored else "")
+
+
+class RobotsRules:
+    """
+    The Allow / Disallow rules of one origin that apply to USER_AGENT. The most specific
+    (longest) matching rule wins and Allow wins ties (RFC 9309), so the rules are compiled
+    into one alternation ordered that way: the first alternative that matches is the answer,
+    found in a single regex match per URL. `available` is False when robots.txt could not be
+    fetched; such an origin is not crawled until it can be.
+    """
+
+    __slots__ = ("rules", "crawl_delay", "available", "matcher", "allows")
+
+    def __init__(self, rules: List[Tuple[str, bool]], crawl_delay: Optional[float] = None, available: bool = True):
+        self.rules = sorted(set(rules), key=lambda rule: (-len(rule[0]), not rule[1]))
+        self.crawl_delay = crawl_delay
+        self.available = available
+        self.allows = [allow for _, allow in self.rules]
+        self.matcher = re.compile("|".join(f"({_regex(path)})" for path, _ in self.rules)) if self.rules else None
+
+    def allowed(self, url: str) -> bool:
+        if self.matcher is None:
+            return True
+        path = _path_of(url)
+        if path == "/robots.txt":
+            return True
+        match = self.matcher.match(path)
+        return match is None or self.allows[match.lastindex - 1]
+
+    def to_doc(self) -> dict:
+        return {"rules": [list(rule) for rule in self.rules], "crawl_delay": self.crawl_delay, "available": self.available}
+
+    @classmethod
+    def from_doc(cls, doc: dict) -> "RobotsRules":
+        return cls([tuple(rule) for rule in doc.get("rules", [])], doc.get("crawl_delay"), doc.get("available", True))
+
+
+ALLOW_ALL = RobotsRules([])
+
+
+def _product_token(user_agent: str) -> str:
+    # "SpiderCurl/2.1 (+https://...)" -> "spidercurl"
+    return re.split(r"[/\s]", user_agent.strip(), 1)[0].lower()
+
+
+def parse(text: str, user_agent: str = USER_AGENT) -> RobotsRules:
+    """
+    Rules of the groups naming the product token of `user_agent`, or of the * groups when
+    none does. Tokens are compared whole and case-insensitively (RFC 9309), so a group for
+    "Spider" does not apply to SpiderCurl.
+    """
+    token = _product_token(user_agent)
+    groups = []  # (agents, rules, crawl_delay)
+    agents, rules, delay = [], [], None
+    in_rules = False
+    for line in text.splitlines():
+        field, _, value = line.split("#", 1)[0].partition(":")
+        field, value = field.strip().lower(), value.strip()
+        if field == "user-agent":
+            if in_rules:
+                groups.append((agents, rules, delay))
+                agents, rules, delay = [], [], None
+                in_rules = False
+            agents.append(_product_token(value) if value != "*" else value)
+        elif field in ("allow", "disallow"):
+            in_rules = True
+            if value:  # An empty Disallow allows everything
+                rules.append((value if value.startswith(("/", "*")) else "/" + value, field == "allow"))
+        elif field == "crawl-delay":
+            in_rules = True
+            try:
+                delay = float(value)
+            except ValueError:
+                pass
+    groups.append((agents, rules, delay))
+
+    named = [group for group in groups if token in group[0]]
+    chosen = named or [group for group in groups if "*" in group[0]]
+    delays = [group[2] for group in chosen if group[2] is not None]
+    return RobotsRules([rule for group in chosen for rule in group[1]],
+                       min(max(delays), MAX_CRAWL_DELAY) if delays else None)
+
+
+def rules_from_response(status_code: Optional[int], text: Optional[str]) -> Tuple[RobotsRules, float]:
+    """
+    Rules and seconds to keep them for a robots.txt fetch. A 4xx means there are no rules;
+    a 5xx or a network error means robots.txt is unreachable, which RFC 9309 treats as
+    disallowing everything for now.
+    """
+    if status_code is not None and 200 <= status_code < 300:
+        return parse(text or ""), ROBOTS_TTL
+    if status_code is not None and 400 <= status_code < 500:
+        return ALLOW_ALL, ROBOTS_TTL
+    return RobotsRules([], available=False), ERROR_TTL
+
+
+class RobotsCache:
+    """
+    Compiled rules per origin in front of the robots collection. Origins nobody has fetched
+    robots.txt for yet are remembered as unknown for UNKNOWN_RECHECK seconds, so a batch of
+    links only queries Mongo for the origins it has not asked about lately.
+    """
+
+    def __init__(self, db=None):
+        self.db = db if db is not None else mongo.get_db()
+        self.entries: Dict[str, Tuple[float, Optional[RobotsRules]]] = {}  # origin -> (expires, rules or None if unknown)
+
+    def get(self, origin: str) -> Tuple[bool, Optional[RobotsRules]]:
+        """(known, rules) from memory alone: known is False when Mongo has to be asked."""
+        entry = self.entries.get(origin)
+        if entry is None or entry[0] <= time.time():
+            return False, None
+        return True, entry[1]
+
+    def _remember(self, origin: str, expires: float, rules: Optional[RobotsRules]):
+        self.entries.pop(origin, None)
+        while len(self.entries) >= CACHE_SIZE:
+            del self.entries[next(iter(self.entries))]
+        self.entries[origin] = (expires, rules)
+
+    def load(self, origins: Iterable[str]):
+        """Fetches the stored rules of the origins not in memory, one query for all of them."""
+        missing = [origin for origin in set(origins) if not self.get(origin)[0]]
+        if not missing:
+            return
+        now = datetime.utcnow()
+        for doc in mongo.load_robots(self.db, missing):
+            expires_at = doc.get("expires_at")
+            if expires_at is not None and expires_at > now:
+                self._remember(doc["origin"], time.time() + (expires_at - now).total_seconds(), RobotsRules.from_doc(doc))
+        for origin in missing:
+            if not self.get(origin)[0]:
+                self._remember(origin, time.time() + UNKNOWN_RECHECK, None)
+
+    def rules_for(self, origin: str) -> Optional[RobotsRules]:
+        known, rules = self.get(origin)
+        if not known:
+            self.load([origin])
+            rules = self.get(origin)[1]
+        return rules
+
+    def store(self, origin: str, rules: RobotsRules, ttl: float):
+        self._remember(origin, time.time() + ttl, rules)
+        now = datetime.utcnow()
+        mongo.save_robots(self.db, dict(rules.to_doc(), origin=origin, fetched_at=now,
+                                        expires_at=now + timedelta(seconds=ttl)))
+
+    def allowed_urls(self, urls: List[str]) -> List[str]:
+        """The URLs robots.txt does not disallow; URLs of origins with unknown rules pass."""
+        origins = [origin_of(url) for url in urls]
+        self.load(origins)
+        allowed = []
+        for url, origin in zip(urls, origins):
+            rules = self.get(origin)[1]
+            if rules is None or rules.allowed(url):
+                allowed.append(url)
+        return allowed
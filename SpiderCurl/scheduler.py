@@ -0,0 +1,127 @@
+# Per-host politeness scheduling for the fetcher processes
+import heapq
+import time
+import zlib
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+import toml
+
+config = toml.load("config.toml")
+
+DEFAULT_CRAWL_DELAY = config.get("crawl_delay", 1.0)  # Seconds between two fetches to the same host
+HOST_CRAWL_DELAYS = config.get("crawl_delays", {})  # Per-host overrides, e.g. "en.wikipedia.org" = 0.5
+MAX_BACKOFF = config.get("max_backoff", 300.0)  # Upper bound on the delay after repeated 429/503s
+BACKOFF_STATUSES = (429, 503)
+
+
+def host_of(url: str) -> str:
+    return urlparse(url).netloc.lower()
+
+
+def shard_for_host(host: str, shards: int) -> int:
+    """
+    Picks the fetcher process that owns a host. Every URL of a host goes to the same
+    fetcher, so that process's scheduler alone decides when the host is fetched next.
+    crc32 rather than hash() because str hashes are salted per process.
+    """
+    return zlib.crc32(host.encode()) % shards
+
+
+class HostScheduler:
+    """
+    Frontier of one fetcher process: a FIFO of URLs per host and a heap of hosts ordered by
+    the time they may be fetched again. At most one fetch per host is in flight, and
+    next_url() never hands out a host before its crawl delay has passed, so fetch slots only
+    wait when no host at all is eligible.
+    """
+
+    def __init__(self, default_delay: float = DEFAULT_CRAWL_DELAY, host_delays: Optional[Dict[str, float]] = None,
+                 max_backoff: float = MAX_BACKOFF):
+        self.default_delay = default_delay
+        self.host_delays = dict(HOST_CRAWL_DELAYS if host_delays is None else host_delays)
+        self.max_backoff = max_backoff
+        self.queues: Dict[str, deque] = {}
+        self.next_allowed: Dict[str, float] = {}
+        self.backoff: Dict[str, float] = {}
+        self.ready = []  # heap of (next_allowed, host) for idle hosts that have queued URLs
+        self.busy = set()  # hosts with a fetch in flight
+        self.queued = 0
+
+    def __len__(self):
+        return self.queued
+
+    def set_crawl_delay(self, host: str, delay: float):
+        self.host_delays[host] = delay
+
+    def set_robots_delay(self, host: str, delay: float):
+        """Crawl-delay from the host's robots.txt; it can lengthen the configured delay, never shorten it."""
+        self.host_delays[host] = max(HOST_CRAWL_DELAYS.get(host, self.default_delay), delay)
+
+    def delay_for(self, host: str) -> float:
+        return self.host_delays.get(host, self.default_delay) * self.backoff.get(host, 1.0)
+
+    def add(self, url: str):
+        host = host_of(url)
+        urls = self.queues.get(host)
+        if urls is None:
+            urls = self.queues[host] = deque()
+        urls.append(url)
+        self.queued += 1
+        # A host goes (back) on the heap when it gets its first URL and nobody is fetching it
+        if len(urls) == 1 and host not in self.busy:
+            heapq.heappush(self.ready, (self.next_allowed.get(host, 0.0), host))
+
+    def pending_urls(self) -> List[str]:
+        """Every queued URL not handed out yet, e.g. to give their tasks back when the fetcher stops."""
+        return [url for urls in self.queues.values() for url in urls]
+
+    def next_url(self, now: Optional[float] = None) -> Tuple[Optional[str], Optional[float]]:
+        """
+        Returns (url, None) for the most overdue eligible host, or (None, seconds) with the time
+        until the next host becomes eligible, or (None, None) when nothing is queued or every
+        host with URLs is being fetched.
+        """
+        if not self.ready:
+            return None, None
+        now = time.monotonic() if now is None else now
+        allowed_at, host = self.ready[0]
+        if allowed_at > now:
+            return None, allowed_at - now
+        heapq.heappop(self.ready)
+        urls = self.queues[host]
+        url = urls.popleft()
+        self.queued -= 1
+        if not urls:
+            del self.queues[host]
+        self.busy.add(host)
+        return url, None
+
+    def done(self, url: str, status_code: Optional[int] = None, retry_after: Optional[float] = None,
+             now: Optional[float] = None):
+        """
+        Records the end of a fetch handed out by next_url. 429/503 double the host's delay
+        (or honour Retry-After when it is longer); anything else halves it back towards the
+        configured crawl delay.
+        """
+        host = host_of(url)
+        now = time.monotonic() if now is None else now
+        base = self.host_delays.get(host, self.default_delay)
+        factor = self.backoff.get(host, 1.0)
+        if status_code in BACKOFF_STATUSES:
+            factor = min(factor * 2, self.max_backoff / max(base, 0.001))
+        else:
+            factor = max(1.0, factor / 2)
+        if factor > 1.0:
+            self.backoff[host] = factor
+        else:
+            self.backoff.pop(host, None)
+
+        delay = base * factor
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_backoff))
+        self.next_allowed[host] = now + delay
+        self.busy.discard(host)
+        if host in self.queues:
+            heapq.heappush(self.ready, (self.next_allowed[host], host))
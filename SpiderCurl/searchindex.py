@@ -0,0 +1,655 @@
+# Inverted index over the crawled pages: tokenizer, on-disk segments and BM25 search
+#   python searchindex.py build            index the webpages collection into index_path
+#   python searchindex.py search "query"   top results for a query
+# While crawling, the database manager appends stored pages to an IndexLog and the indexer
+# process turns it into small segments that are merged in tiers (see IndexWriter).
+import argparse
+import array
+import bisect
+import heapq
+import json
+import math
+import mmap
+import os
+import re
+import struct
+import time
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import toml
+
+from recordlog import RecordLog
+
+config = toml.load("config.toml")
+
+INDEX_PATH = config.get("index_path", "data/index")
+SEGMENT_DOCS = config.get("index_segment_docs", 50000)  # Documents per segment when building
+FLUSH_DOCS = config.get("index_flush_docs", 5000)  # Most documents the indexer puts in one incremental segment
+MERGE_FACTOR = config.get("index_merge_factor", 4)  # Segments of one tier merged into one of the next tier
+LOG_MAX_BYTES = config.get("index_log_max_bytes", 64 * 1024 * 1024)  # Index log file size before a new one is started
+FIELD_WEIGHTS = {"title": 3, "meta_description": 2, "text_content": 1}  # A title word counts as 3 body words
+MAX_TOKEN_LENGTH = 40
+BM25_K1 = 1.2
+BM25_B = 0.75
+BLOCK_SIZE = 128  # Postings per block; every block is a skip target for WAND
+PAGERANK_WEIGHT = config.get("search_pagerank_weight", 1.0)  # Added to BM25 as weight * ln(1 + PageRank)
+RERANK_DEPTH = config.get("search_rerank_depth", 100)  # BM25 results the PageRank prior reorders
+
+_MAGIC = b"NSINDEX1"
+_HEADER = struct.Struct("<8sIIQQQ")  # magic, doc count, term count, total doc length, docs offset, dictionary offset
+_token = re.compile(r"[^\W_]+")
+_END = 1 << 62  # doc id of an exhausted cursor
+
+
+def tokenize(text: str) -> List[str]:
+    return [token for token in _token.findall(text.lower()) if len(token) <= MAX_TOKEN_LENGTH]
+
+
+def _write_varint(out: bytearray, value: int):
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(buffer, pos: int) -> Tuple[int, int]:
+    result = shift = 0
+    while True:
+        byte = buffer[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+def _read_bytes(buffer, pos: int) -> Tuple[bytes, int]:
+    length, pos = _read_varint(buffer, pos)
+    return bytes(buffer[pos:pos + length]), pos + length
+
+
+def document_terms(fields: Dict[str, Optional[str]]) -> Tuple[Dict[str, int], int]:
+    """Weighted term frequencies and length of a page from its indexed fields."""
+    counts = defaultdict(int)
+    length = 0
+    for field, weight in FIELD_WEIGHTS.items():
+        for token in tokenize(fields.get(field) or ""):
+            counts[token] += weight
+            length += weight
+    return counts, length
+
+
+class SegmentWriter:
+    """
+    Accumulates documents in memory and writes them as one immutable segment file:
+    postings lists of (doc delta, tf) varints in blocks of BLOCK_SIZE, a docs table
+    (url, length) and a sorted term dictionary with df, block skip table and the
+    max tf / min doc length the WAND upper bounds are computed from.
+    """
+
+    def __init__(self):
+        self.postings: Dict[str, array.array] = defaultdict(lambda: array.array("I"))
+        self.urls: List[str] = []
+        self.lengths = array.array("I")
+
+    def __len__(self):
+        return len(self.urls)
+
+    def add(self, url: str, fields: Dict[str, Optional[str]]) -> int:
+        counts, length = document_terms(fields)
+        doc = len(self.urls)
+        self.urls.append(url)
+        self.lengths.append(length)
+        for term, tf in counts.items():
+            postings = self.postings[term]
+            postings.append(doc)
+            postings.append(tf)
+        return doc
+
+    def write(self, path: str):
+        out = bytearray(_HEADER.size)
+        dictionary = bytearray()
+        for term in sorted(self.postings):
+            postings = self.postings[term]
+            docs, tfs = postings[0::2], postings[1::2]
+            blocks = bytearray()
+            skip = bytearray()
+            previous_last = 0
+            for start in range(0, len(docs), BLOCK_SIZE):
+                # Skip entry: last doc of the block (delta to the previous block) and its offset
+                block_docs = docs[start:start + BLOCK_SIZE]
+                _write_varint(skip, block_docs[-1] - previous_last)
+                _write_varint(skip, len(blocks))
+                previous_last = block_docs[-1]
+                previous = 0
+                for doc, tf in zip(block_docs, tfs[start:start + BLOCK_SIZE]):
+                    _write_varint(blocks, doc - previous)
+                    _write_varint(blocks, tf)
+                    previous = doc
+            term_bytes = term.encode("utf-8")
+            _write_varint(dictionary, len(term_bytes))
+            dictionary += term_bytes
+            _write_varint(dictionary, len(docs))
+            _write_varint(dictionary, max(tfs))
+            _write_varint(dictionary, min(self.lengths[doc] for doc in docs))
+            _write_varint(dictionary, len(out))
+            dictionary += skip
+            out += blocks
+
+        docs_offset = len(out)
+        for url, length in zip(self.urls, self.lengths):
+            url_bytes = url.encode("utf-8")
+            _write_varint(out, len(url_bytes))
+            out += url_bytes
+            _write_varint(out, length)
+        dictionary_offset = len(out)
+        out += dictionary
+        _HEADER.pack_into(out, 0, _MAGIC, len(self.urls), len(self.postings), sum(self.lengths), docs_offset, dictionary_offset)
+
+        temp_path = path + ".tmp"
+        with open(temp_path, "wb") as f:
+            f.write(out)
+        os.replace(temp_path, path)
+
+
+class _TermInfo:
+    __slots__ = ("df", "max_tf", "min_length", "postings_offset", "block_lasts", "block_offsets")
+
+
+class Segment:
+    """Read side of a segment file, memory-mapped; postings are decoded a block at a time."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.name = os.path.basename(path)
+        with open(path, "rb") as f:
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.doc_count, term_count, self.total_length, docs_offset, dictionary_offset = _HEADER.unpack_from(self.buffer, 0)
+        if magic != _MAGIC:
+            raise ValueError(f"{path} is not an index segment")
+
+        buffer = self.buffer
+        self.urls: List[str] = []
+        self.lengths = array.array("I")
+        pos = docs_offset
+        for _ in range(self.doc_count):
+            url, pos = _read_bytes(buffer, pos)
+            length, pos = _read_varint(buffer, pos)
+            self.urls.append(url.decode("utf-8"))
+            self.lengths.append(length)
+
+        # Only term -> dictionary position is kept; entries are decoded when a query needs them
+        self.terms: Dict[str, int] = {}
+        pos = dictionary_offset
+        for _ in range(term_count):
+            term, pos = _read_bytes(buffer, pos)
+            self.terms[term.decode("utf-8")] = pos
+            df, pos = _read_varint(buffer, pos)
+            for _ in range(3):
+                _, pos = _read_varint(buffer, pos)
+            for _ in range(2 * ((df + BLOCK_SIZE - 1) // BLOCK_SIZE)):
+                _, pos = _read_varint(buffer, pos)
+
+        self._doc_ids: Optional[Dict[str, int]] = None
+        self.load_deletes()
+
+    @property
+    def deletes_path(self) -> str:
+        return self.path[:-len(".seg")] + ".del"
+
+    def load_deletes(self):
+        """Reads the tombstones: docs of this segment superseded by a newer copy of their URL."""
+        deleted = array.array("I")
+        if os.path.exists(self.deletes_path):
+            with open(self.deletes_path, "rb") as f:
+                deleted.frombytes(f.read())
+        self.deleted = set(deleted)
+        self.live_count = self.doc_count - len(self.deleted)
+        self.live_length = self.total_length - sum(self.lengths[doc] for doc in self.deleted)
+
+    def delete(self, docs: Iterable[int]):
+        self.deleted.update(docs)
+        temp_path = self.deletes_path + ".tmp"
+        with open(temp_path, "wb") as f:
+            f.write(array.array("I", sorted(self.deleted)).tobytes())
+        os.replace(temp_path, self.deletes_path)
+        self.load_deletes()
+
+    def doc_id(self, url: str) -> Optional[int]:
+        if self._doc_ids is None:
+            self._doc_ids = {url: doc for doc, url in enumerate(self.urls)}
+        return self._doc_ids.get(url)
+
+    def postings(self, term: str):
+        """All (doc, tf) pairs of a term, including deleted docs."""
+        info = self.term_info(term)
+        if info is None:
+            return
+        cursor = _Cursor(self, info, 0.0, 0.0)
+        while cursor.doc != _END:
+            yield cursor.doc, cursor.tf()
+            cursor.next()
+
+    def term_info(self, term: str) -> Optional[_TermInfo]:
+        pos = self.terms.get(term)
+        if pos is None:
+            return None
+        info = _TermInfo()
+        buffer = self.buffer
+        info.df, pos = _read_varint(buffer, pos)
+        info.max_tf, pos = _read_varint(buffer, pos)
+        info.min_length, pos = _read_varint(buffer, pos)
+        info.postings_offset, pos = _read_varint(buffer, pos)
+        info.block_lasts, info.block_offsets = [], []
+        last = 0
+        for _ in range((info.df + BLOCK_SIZE - 1) // BLOCK_SIZE):
+            delta, pos = _read_varint(buffer, pos)
+            offset, pos = _read_varint(buffer, pos)
+            last += delta
+            info.block_lasts.append(last)
+            info.block_offsets.append(info.postings_offset + offset)
+        return info
+
+    def close(self):
+        self.buffer.close()
+
+    def remove(self):
+        self.close()
+        for path in (self.path, self.deletes_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+class _Cursor:
+    """Iterator over one term's postings in a segment, with block skipping for next_geq."""
+
+    __slots__ = ("buffer", "info", "idf", "upper_bound", "block", "docs", "tfs", "pos", "doc")
+
+    def __init__(self, segment: Segment, info: _TermInfo, idf: float, upper_bound: float):
+        self.buffer = segment.buffer
+        self.info = info
+        self.idf = idf
+        self.upper_bound = upper_bound
+        self.block = -1
+        self._load_block(0)
+
+    def _load_block(self, block: int):
+        info = self.info
+        if block >= len(info.block_offsets):
+            self.block = block
+            self.doc = _END
+            return
+        count = min(BLOCK_SIZE, info.df - block * BLOCK_SIZE)
+        buffer, pos = self.buffer, info.block_offsets[block]
+        docs, tfs = [], []
+        doc = 0
+        for _ in range(count):
+            delta, pos = _read_varint(buffer, pos)
+            tf, pos = _read_varint(buffer, pos)
+            doc += delta
+            docs.append(doc)
+            tfs.append(tf)
+        self.block, self.docs, self.tfs, self.pos = block, docs, tfs, 0
+        self.doc = docs[0]
+
+    def tf(self) -> int:
+        return self.tfs[self.pos]
+
+    def next(self):
+        self.pos += 1
+        if self.pos < len(self.docs):
+            self.doc = self.docs[self.pos]
+        else:
+            self._load_block(self.block + 1)
+
+    def next_geq(self, target: int):
+        if self.doc >= target:
+            return
+        lasts = self.info.block_lasts
+        if target > lasts[self.block]:
+            self._load_block(bisect.bisect_left(lasts, target, self.block + 1))
+            if self.doc == _END:
+                return
+        self.pos = bisect.bisect_left(self.docs, target, self.pos)
+        self.doc = self.docs[self.pos]
+
+
+class IndexSearcher:
+    """
+    BM25 over all segments in an index folder, with WAND top-k pruning: a document is
+    only scored when the upper bounds of the terms that could match it beat the current
+    k-th best score. With `ranks` (urls -> PageRank, e.g. linkgraph.LinkGraph.ranks) the
+    best RERANK_DEPTH BM25 results are reordered with the PageRank as a static prior.
+    """
+
+    def __init__(self, path: str = INDEX_PATH, ranks=None):
+        self.path = path
+        self.ranks = ranks
+        self.segments: List[Segment] = []
+        self.generation = None
+        self.reload()
+
+    def reload(self):
+        """Opens the segments of the current manifest, keeping the ones already open."""
+        opened = {segment.name: segment for segment in self.segments}
+        while True:
+            manifest = read_manifest(self.path)
+            try:
+                for entry in manifest["segments"]:
+                    if entry["name"] not in opened:
+                        opened[entry["name"]] = Segment(os.path.join(self.path, entry["name"]))
+                break
+            except FileNotFoundError:
+                continue  # A merge removed a segment between reading the manifest and opening it
+        live = {entry["name"] for entry in manifest["segments"]}
+        for name in [name for name in opened if name not in live]:
+            opened.pop(name).close()
+        segments = self.segments = [opened[entry["name"]] for entry in manifest["segments"]]
+        for segment in segments:
+            segment.load_deletes()
+        self.generation = manifest["generation"]
+        self.doc_count = sum(segment.live_count for segment in segments)
+        total_length = sum(segment.live_length for segment in segments)
+        self.avg_length = total_length / self.doc_count if self.doc_count else 1.0
+
+    def refresh(self) -> bool:
+        """Picks up segments the indexer committed since the last (re)load; cheap when nothing changed."""
+        if read_manifest(self.path)["generation"] == self.generation:
+            return False
+        self.reload()
+        return True
+
+    def _idf(self, df: int) -> float:
+        df = min(df, self.doc_count)  # tombstoned copies can push df past the live doc count
+        return math.log(1 + (self.doc_count - df + 0.5) / (df + 0.5))
+
+    def search(self, query: str, k: int = 10) -> List[Tuple[float, str]]:
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms or not self.doc_count:
+            return []
+        depth = max(k, RERANK_DEPTH) if self.ranks is not None else k
+        infos = [[segment.term_info(term) for term in terms] for segment in self.segments]
+        # Document frequencies still count tombstoned docs until their segment is merged, as in Lucene
+        dfs = [sum(segment_infos[i].df for segment_infos in infos if segment_infos[i]) for i in range(len(terms))]
+
+        top: List[Tuple[float, str]] = []  # min-heap of (score, url)
+        for segment, segment_infos in zip(self.segments, infos):
+            cursors = []
+            for i, info in enumerate(segment_infos):
+                if info is None:
+                    continue
+                idf = self._idf(dfs[i])
+                # tf / (tf + k1 * norm) grows with tf and shrinks with doc length: max tf over min length bounds it
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * info.min_length / self.avg_length)
+                cursors.append(_Cursor(segment, info, idf, idf * (BM25_K1 + 1) * info.max_tf / (info.max_tf + norm)))
+            self._wand(segment, cursors, top, depth)
+        results = sorted(top, reverse=True)
+        if self.ranks is not None and results:
+            prior = self.ranks([url for _, url in results])
+            results = sorted(((score + PAGERANK_WEIGHT * math.log1p(rank), url)
+                              for (score, url), rank in zip(results, prior)), reverse=True)
+        return results[:k]
+
+    def _wand(self, segment: Segment, cursors: List[_Cursor], top: list, k: int):
+        lengths, avg_length = segment.lengths, self.avg_length
+        cursors = [cursor for cursor in cursors if cursor.doc != _END]
+        while cursors:
+            threshold = top[0][0] if len(top) >= k else 0.0
+            cursors.sort(key=lambda cursor: cursor.doc)
+            # Pivot: first cursor where the summed upper bounds could beat the threshold
+            bound = 0.0
+            pivot = None
+            for i, cursor in enumerate(cursors):
+                bound += cursor.upper_bound
+                if bound > threshold:
+                    pivot = i
+                    break
+            if pivot is None:
+                return
+            pivot_doc = cursors[pivot].doc
+            if cursors[0].doc == pivot_doc:
+                # Every cursor up to the pivot sits on pivot_doc: score it for real
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths[pivot_doc] / avg_length)
+                score = 0.0
+                for cursor in cursors:
+                    if cursor.doc != pivot_doc:
+                        break
+                    tf = cursor.tf()
+                    score += cursor.idf * tf * (BM25_K1 + 1) / (tf + norm)
+                    cursor.next()
+                if score > threshold and pivot_doc not in segment.deleted:
+                    entry = (score, segment.urls[pivot_doc])
+                    if len(top) < k:
+                        heapq.heappush(top, entry)
+                    else:
+                        heapq.heapreplace(top, entry)
+            else:
+                # Nothing before the pivot can score above the threshold: skip ahead to it
+                for cursor in cursors[:pivot]:
+                    cursor.next_geq(pivot_doc)
+            cursors = [cursor for cursor in cursors if cursor.doc != _END]
+
+    def close(self):
+        for segment in self.segments:
+            segment.close()
+        self.segments = []
+
+
+def segment_name(number: int) -> str:
+    return f"{number:08d}.seg"
+
+
+def read_manifest(path: str) -> dict:
+    """
+    The index folder's manifest: which segments are live and in which merge tier, the next
+    segment number and how far into the index log the segments reach. Replaced atomically on
+    every commit, so readers always see a consistent set of segments.
+    """
+    try:
+        with open(os.path.join(path, "manifest.json"), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"generation": 0, "segments": [], "next_segment": 0, "log_position": [0, 0]}
+
+
+class IndexWriter:
+    """
+    The single writer of an index folder (the indexer process, or the build command while
+    the crawler is stopped). New documents go into a fresh tier-0 segment; older copies of
+    their URLs are tombstoned in the existing segments, so indexing cost follows the number
+    of changed pages rather than the corpus size. Whenever merge_factor segments share a
+    tier they are merged into one segment of the next tier, dropping tombstoned docs, which
+    keeps the segment count logarithmic in the corpus size.
+    """
+
+    def __init__(self, path: str = INDEX_PATH, merge_factor: int = MERGE_FACTOR):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.merge_factor = merge_factor
+        manifest = read_manifest(path)
+        self.generation = manifest["generation"]
+        self.next_segment = manifest["next_segment"]
+        self.log_position = tuple(manifest["log_position"])
+        self.tiers: Dict[str, int] = {entry["name"]: entry["tier"] for entry in manifest["segments"]}
+        self.segments: Dict[str, Segment] = {name: Segment(os.path.join(path, name)) for name in self.tiers}
+
+    def _commit(self):
+        self.generation += 1
+        manifest = {
+            "generation": self.generation,
+            "segments": [{"name": name, "tier": self.tiers[name]} for name in sorted(self.tiers)],
+            "next_segment": self.next_segment,
+            "log_position": list(self.log_position),
+        }
+        manifest_path = os.path.join(self.path, "manifest.json")
+        with open(manifest_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+        os.replace(manifest_path + ".tmp", manifest_path)
+
+    def _write_segment(self, writer: SegmentWriter, tier: int) -> Segment:
+        name = segment_name(self.next_segment)
+        self.next_segment += 1
+        writer.write(os.path.join(self.path, name))
+        segment = self.segments[name] = Segment(os.path.join(self.path, name))
+        self.tiers[name] = tier
+        return segment
+
+    def add(self, writer: SegmentWriter, log_position: Optional[Tuple[int, int]] = None, removed: Iterable[str] = ()):
+        """
+        Commits the writer's documents as a new segment; URLs in it replace their earlier
+        versions, and the `removed` URLs lose theirs without a new one.
+        """
+        urls = list(writer.urls) + list(removed)
+        if urls:
+            for segment in self.segments.values():
+                superseded = [doc for doc in map(segment.doc_id, urls) if doc is not None and doc not in segment.deleted]
+                if superseded:
+                    segment.delete(superseded)
+        if len(writer):
+            self._write_segment(writer, 0)
+        if log_position is not None:
+            self.log_position = tuple(log_position)
+        self._commit()
+
+    def merge(self) -> int:
+        """Runs the merges due under the tiered policy; returns how many were done."""
+        merges = 0
+        while True:
+            due = None
+            for tier in sorted(set(self.tiers.values())):
+                names = sorted(name for name, segment_tier in self.tiers.items() if segment_tier == tier)
+                if len(names) >= self.merge_factor:
+                    due = names[:self.merge_factor], tier
+                    break
+            if due is None:
+                return merges
+            self._merge(*due)
+            merges += 1
+
+    def _merge(self, names: List[str], tier: int):
+        sources = [self.segments[name] for name in names]
+        writer = SegmentWriter()
+        remaps = []
+        for segment in sources:
+            remap = {}
+            for doc, url in enumerate(segment.urls):
+                if doc not in segment.deleted:
+                    remap[doc] = len(writer.urls)
+                    writer.urls.append(url)
+                    writer.lengths.append(segment.lengths[doc])
+            remaps.append(remap)
+        # Sources are appended in order, so the remapped doc ids of every term stay ascending
+        for term in set().union(*(segment.terms for segment in sources)):
+            postings = array.array("I")
+            for segment, remap in zip(sources, remaps):
+                for doc, tf in segment.postings(term):
+                    new_doc = remap.get(doc)
+                    if new_doc is not None:
+                        postings.append(new_doc)
+                        postings.append(tf)
+            if postings:
+                writer.postings[term] = postings
+        if len(writer):
+            self._write_segment(writer, tier + 1)
+        for name in names:
+            del self.tiers[name]
+        self._commit()
+        # Searchers that still have the old segments mapped keep reading them until they reload
+        for name in names:
+            self.segments.pop(name).remove()
+
+    def index_log(self, log: "IndexLog", max_docs: int = FLUSH_DOCS) -> int:
+        """Indexes what the log holds past the committed position; returns the number of records read."""
+        records, position = log.read(self.log_position, max_docs)
+        if not records:
+            return 0
+        # The last record of a URL wins; a (url,) record removes the page from the index
+        pages = {}
+        for record in records:
+            pages.pop(record[0], None)
+            pages[record[0]] = {"title": record[1], "meta_description": record[2], "text_content": record[3]} if len(record) > 1 else None
+        writer = SegmentWriter()
+        for url, fields in pages.items():
+            if fields is not None:
+                writer.add(url, fields)
+        self.add(writer, position, [url for url, fields in pages.items() if fields is None])
+        self.merge()
+        log.trim(self.log_position)
+        return len(records)
+
+    def close(self):
+        for segment in self.segments.values():
+            segment.close()
+
+
+class IndexLog(RecordLog):
+    """
+    Log of stored pages waiting to be indexed, under index_path/log. The database manager
+    appends each batch once it is upserted; the indexer reads it from the position committed
+    in the manifest and trims what it has indexed. Pages that left the index (stored as
+    near-duplicates) are logged by remove() as (url,) records.
+    """
+
+    def __init__(self, path: str = os.path.join(INDEX_PATH, "log"), max_bytes: int = LOG_MAX_BYTES):
+        super().__init__(path, max_bytes)
+
+    def append(self, webpages):
+        super().append([(webpage.url, webpage.title, webpage.meta_description, webpage.text_content)
+                        for webpage in webpages])
+
+    def remove(self, urls):
+        super().append([(url,) for url in urls])
+
+
+def build_index(documents: Iterable[Tuple[str, Dict[str, Optional[str]]]], path: str = INDEX_PATH,
+                segment_docs: int = SEGMENT_DOCS) -> int:
+    """Adds (url, fields) documents to the index in `path`; returns the number of documents."""
+    index = IndexWriter(path)
+    writer = SegmentWriter()
+    count = 0
+    for url, fields in documents:
+        writer.add(url, fields)
+        count += 1
+        if len(writer) >= segment_docs:
+            index.add(writer)
+            index.merge()
+            writer = SegmentWriter()
+    index.add(writer)
+    index.merge()
+    index.close()
+    return count
+
+
+def _webpage_documents(db):
+    projection = {"_id": 0, "url": 1, "title": 1, "meta_description": 1, "text_content": 1}
+    for page in db["webpages"].find({}, projection, batch_size=1000):
+        yield page["url"], page
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="NeuroSeek search index")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("build", help="index the webpages collection")
+    search = commands.add_parser("search", help="run a query against the index")
+    search.add_argument("query")
+    search.add_argument("-k", type=int, default=10)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        import mongo
+        start = time.perf_counter()
+        count = build_index(_webpage_documents(mongo.get_db()))
+        elapsed = time.perf_counter() - start
+        print(f"Indexed {count} pages in {elapsed:.1f}s ({count / max(elapsed, 1e-9):.0f} pages/s)")
+    else:
+        ranks = None
+        if os.path.exists(os.path.join(config.get("link_graph_path", "data/graph"), "pagerank.npy")):
+            import linkgraph
+            ranks = linkgraph.LinkGraph().ranks
+        searcher = IndexSearcher(ranks=ranks)
+        start = time.perf_counter()
+        results = searcher.search(args.query, args.k)
+        print(f"{len(results)} results in {(time.perf_counter() - start) * 1000:.1f} ms")
+        for score, url in results:
+            print(f"{score:8.3f}  {url}")
@@ -0,0 +1,220 @@
+# Memory-mapped scalable Bloom filter for URL-seen checks
+import hashlib
+import math
+import mmap
+import os
+import struct
+from typing import Iterable, List, Optional
+
+import toml
+
+config = toml.load("config.toml")
+
+SEEN_FILTER_PATH = config.get("seen_filter_path", "data/seen")
+SEEN_FILTER_CAPACITY = config.get("seen_filter_capacity", 10_000_000)
+SEEN_FILTER_ERROR_RATE = config.get("seen_filter_error_rate", 0.001)
+
+_MAGIC = b"NSBLOOM1"
+_HEADER = struct.Struct("<8sQQdQI")  # magic, capacity, count, error_rate, bit count, hash count
+_GROWTH = 2  # each new slice holds twice as many URLs as the previous one
+_TIGHTENING = 0.5  # and gets half its false-positive budget
+
+
+def _hashes(url: str):
+    digest = hashlib.blake2b(url.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+    return int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+
+
+class _Slice:
+    """One fixed-size Bloom filter living in a (file-backed or anonymous) mmap."""
+
+    def __init__(self, buffer: mmap.mmap):
+        self.buffer = buffer
+        magic, self.capacity, _, self.error_rate, self.bits, self.hash_count = _HEADER.unpack_from(buffer, 0)
+        if magic != _MAGIC:
+            raise ValueError("not a seen-filter slice")
+
+    @staticmethod
+    def size_for(capacity: int, error_rate: float):
+        bits = max(8, math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        hash_count = max(1, round(bits / capacity * math.log(2)))
+        return bits, hash_count
+
+    @staticmethod
+    def init_buffer(buffer: mmap.mmap, capacity: int, error_rate: float, bits: int, hash_count: int):
+        _HEADER.pack_into(buffer, 0, _MAGIC, capacity, 0, error_rate, bits, hash_count)
+
+    @property
+    def count(self) -> int:
+        return _HEADER.unpack_from(self.buffer, 0)[2]
+
+    @count.setter
+    def count(self, value: int):
+        struct.pack_into("<Q", self.buffer, 16, value)
+
+    def _positions(self, h1: int, h2: int):
+        bits = self.bits
+        return [(h1 + i * h2) % bits for i in range(self.hash_count)]
+
+    def contains(self, h1: int, h2: int) -> bool:
+        buffer, base = self.buffer, _HEADER.size
+        for position in self._positions(h1, h2):
+            if not buffer[base + (position >> 3)] & (1 << (position & 7)):
+                return False
+        return True
+
+    def add(self, h1: int, h2: int):
+        buffer, base = self.buffer, _HEADER.size
+        for position in self._positions(h1, h2):
+            index = base + (position >> 3)
+            buffer[index] = buffer[index] | (1 << (position & 7))
+
+
+class ScalableBloomFilter:
+    """
+    Scalable Bloom filter (Almeida et al.): a chain of slices where slice i holds
+    capacity * 2**i URLs at error_rate * 0.5**(i + 1), so the overall false-positive rate
+    stays below error_rate however many URLs are added. A false positive means a new URL is
+    taken for an already-seen one and not crawled, at roughly 1.8 bytes per URL for 0.1%.
+
+    With a path, every slice is a file mapped with mmap: the filter survives restarts and
+    processes opening the same path share the same bits through the page cache. Pass the
+    same multiprocessing.Lock to every process that adds. Without a path the slices are
+    anonymous mmaps private to the process.
+    """
+
+    def __init__(self, path: Optional[str] = None, capacity: int = SEEN_FILTER_CAPACITY,
+                 error_rate: float = SEEN_FILTER_ERROR_RATE, lock=None):
+        self.path = path
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.lock = lock
+        self.slices: List[_Slice] = []
+        if path:
+            os.makedirs(path, exist_ok=True)
+        self._sync_slices()
+
+    def _slice_file(self, index: int) -> str:
+        return os.path.join(self.path, f"slice-{index}.bloom")
+
+    def _sync_slices(self):
+        # Pick up slices another process has added since we last looked
+        while self.path and os.path.exists(self._slice_file(len(self.slices))):
+            with open(self._slice_file(len(self.slices)), "r+b") as f:
+                self.slices.append(_Slice(mmap.mmap(f.fileno(), 0)))
+        if not self.slices:
+            self._add_slice()
+
+    def _add_slice(self):
+        index = len(self.slices)
+        capacity = self.capacity * _GROWTH ** index
+        error_rate = self.error_rate * (1 - _TIGHTENING) * _TIGHTENING ** index
+        bits, hash_count = _Slice.size_for(capacity, error_rate)
+        size = _HEADER.size + (bits + 7) // 8
+        if self.path:
+            temp_file = self._slice_file(index) + ".tmp"
+            with open(temp_file, "wb") as f:
+                f.truncate(size)
+            with open(temp_file, "r+b") as f:
+                buffer = mmap.mmap(f.fileno(), 0)
+            _Slice.init_buffer(buffer, capacity, error_rate, bits, hash_count)
+            buffer.flush()
+            buffer.close()
+            # Only publish the slice once its header is written
+            os.replace(temp_file, self._slice_file(index))
+            with open(self._slice_file(index), "r+b") as f:
+                buffer = mmap.mmap(f.fileno(), 0)
+        else:
+            buffer = mmap.mmap(-1, size)
+            _Slice.init_buffer(buffer, capacity, error_rate, bits, hash_count)
+        self.slices.append(_Slice(buffer))
+
+    def _contains(self, h1: int, h2: int) -> bool:
+        return any(s.contains(h1, h2) for s in reversed(self.slices))
+
+    def _add(self, h1: int, h2: int):
+        current = self.slices[-1]
+        if current.count >= current.capacity:
+            self._add_slice()
+            current = self.slices[-1]
+        current.add(h1, h2)
+        current.count += 1
+
+    def __contains__(self, url: str) -> bool:
+        return self._contains(*_hashes(url))
+
+    def __len__(self) -> int:
+        return sum(s.count for s in self.slices)
+
+    def missing(self, urls: Iterable[str]) -> List[str]:
+        """Returns the URLs (deduplicated, in order) that are definitely not in the filter."""
+        if self.path:
+            self._locked(self._sync_slices)
+        result, batch = [], set()
+        for url in urls:
+            if url not in batch and url not in self:
+                batch.add(url)
+                result.append(url)
+        return result
+
+    def add_many(self, urls: Iterable[str]) -> List[str]:
+        """Adds URLs and returns the ones that were not in the filter yet."""
+        return self._locked(self._add_many, urls)
+
+    def add(self, url: str) -> bool:
+        return bool(self.add_many([url]))
+
+    def _add_many(self, urls: Iterable[str]) -> List[str]:
+        self._sync_slices()
+        added = []
+        for url in urls:
+            h1, h2 = _hashes(url)
+            if not self._contains(h1, h2):
+                self._add(h1, h2)
+                added.append(url)
+        return added
+
+    def _locked(self, func, *args):
+        if self.lock is None:
+            return func(*args)
+        with self.lock:
+            return func(*args)
+
+    @property
+    def backfilled(self) -> bool:
+        """False until mark_backfilled: the filter may be missing URLs stored before it existed."""
+        return not self.path or os.path.exists(os.path.join(self.path, "backfilled"))
+
+    def mark_backfilled(self):
+        self.flush()
+        with open(os.path.join(self.path, "backfilled"), "w"):
+            pass
+
+    def flush(self):
+        for s in self.slices:
+            s.buffer.flush()
+
+    def close(self):
+        for s in self.slices:
+            s.buffer.close()
+        self.slices = []
+
+
+def open_seen_filter(lock=None) -> ScalableBloomFilter:
+    """The crawler-wide persistent filter of every URL that has ever become a crawl task."""
+    return ScalableBloomFilter(SEEN_FILTER_PATH, lock=lock)
+
+
+def backfill(seen: ScalableBloomFilter, url_batches: Iterable[List[str]]) -> int:
+    """
+    Adds the URLs already stored (mongo.known_urls) to a filter that is not backfilled yet,
+    then marks it done; returns the number added. A filter created on an existing database
+    would otherwise take every stored page and task for new. Interrupted, it starts over.
+    """
+    if seen.backfilled:
+        return 0
+    added = 0
+    for urls in url_batches:
+        added += len(seen.add_many(urls))
+    seen.mark_backfilled()
+    return added
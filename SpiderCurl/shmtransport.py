@@ -0,0 +1,234 @@
+# Shared-memory hand-off of raw page bodies from the fetchers to the parser workers
+import multiprocessing
+import os
+import queue
+import shutil
+from multiprocessing import shared_memory
+from typing import Optional
+
+import toml
+
+import curler
+
+config = toml.load("config.toml")
+
+SHM_SLOTS = config.get("shm_slots", 128)  # Pages that can sit between fetch and parse; 0 disables the slab
+SLOT_BYTES = config.get("max_body_bytes", 5 * 1024 * 1024)  # A slot holds one body of at most max_body_bytes
+STORE_TIMEOUT = config.get("shm_store_timeout", 5.0)  # Seconds a fetcher waits for a free slot before sending the body inline
+SHM_SHARE = 0.5  # Most of the free space of /dev/shm the slab may take
+QUEUED = -1  # Owner of a slot whose page waits in the processing queue
+
+
+class PageSlab:
+    """
+    A multiprocessing.shared_memory block cut into fixed-size slots, one page body per slot.
+    Fetchers write a body into a free slot and send only (slot, length, encoding) through the
+    queue; the parser decodes straight out of the shared buffer and hands the slot back. Free
+    slot numbers travel in a multiprocessing.Queue, so a fetcher waiting for one is the
+    backpressure when parsing falls behind.
+    """
+
+    def __init__(self, name: Optional[str] = None, slots: int = SHM_SLOTS, slot_size: int = SLOT_BYTES):
+        self.slots = slots
+        self.slot_size = slot_size
+        self.owner = name is None
+        if self.owner:
+            self.shm = shared_memory.SharedMemory(create=True, size=slots * slot_size)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.name = self.shm.name
+
+    def write(self, slot: int, data: bytes) -> int:
+        length = min(len(data), self.slot_size)
+        offset = slot * self.slot_size
+        self.shm.buf[offset:offset + length] = data[:length]
+        return length
+
+    def view(self, slot: int, length: int) -> memoryview:
+        offset = slot * self.slot_size
+        return self.shm.buf[offset:offset + length]
+
+    def close(self):
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+_attached = {}
+
+
+def attach(name: str) -> PageSlab:
+    """Opens (once per process) the slab created by the main process."""
+    slab = _attached.get(name)
+    if slab is None:
+        slab = _attached[name] = PageSlab(name)
+    return slab
+
+
+def _shm_free_bytes() -> Optional[int]:
+    try:
+        return shutil.disk_usage("/dev/shm").free
+    except OSError:
+        return None  # No /dev/shm (macOS, Windows): shared memory is not a size-limited mount
+
+
+class PageChannel:
+    """
+    What the fetchers and parser workers share to pass page bodies: the slab's name, the
+    queue of free slots and who holds each slot. Passed to the processes as an argument; the
+    slab is attached lazily.
+
+    A slot belongs to the fetcher that stored a body in it until the page is queued, then to
+    no process (QUEUED), then to the parser that loads it, which frees it. reclaim() frees
+    the slots of a process that died holding some. Every free bumps the slot's generation,
+    which the queue item carries, so a page whose slot was reclaimed while it sat in the
+    queue is dropped instead of read from a slot that has been reused.
+
+    A parser that dies between taking an item off the queue and loading it leaves its slot
+    QUEUED with no process to reclaim it from. Every load counts as a take, and queued()
+    notes the count when it marks a slot, so sweep() can free the slots that stayed QUEUED
+    while more items were taken than could have been ahead of them.
+    """
+
+    def __init__(self, slab: Optional[PageSlab], free_slots, owners=None, generations=None, queued_at=None, taken=None):
+        self.slab_name = slab.name if slab is not None else None
+        self.free_slots = free_slots
+        self.owners = owners  # Pid holding each slot, 0 when free, QUEUED while its page is queued
+        self.generations = generations  # Guarded by the owners' lock, like the two below
+        self.queued_at = queued_at  # Value of taken when each slot was marked QUEUED
+        self.taken = taken  # Items loaded off the processing queue so far
+
+    @classmethod
+    def create(cls, slots: int = SHM_SLOTS):
+        """
+        Called once in the main process; returns (channel, slab) and the caller keeps the slab to
+        unlink it. Shared memory past what /dev/shm can hold would crash the processes with
+        SIGBUS when touched, so the slab is cut to SHM_SHARE of its free space.
+        """
+        free = _shm_free_bytes()
+        if slots and free is not None and slots * SLOT_BYTES > free * SHM_SHARE:
+            fitting = int(free * SHM_SHARE) // SLOT_BYTES
+            print(f"/dev/shm has {free / 2 ** 20:.0f} MiB free, too little for {slots} slots of {SLOT_BYTES / 2 ** 20:.1f} MiB: "
+                  f"using {fitting} (enlarge /dev/shm, e.g. docker run --shm-size, or lower shm_slots / max_body_bytes)")
+            slots = fitting
+        if not slots:
+            return cls(None, None), None
+        slab = PageSlab(slots=slots)
+        free_slots = multiprocessing.Queue()
+        for slot in range(slots):
+            free_slots.put(slot)
+        return cls(slab, free_slots, multiprocessing.Array("i", slots), multiprocessing.RawArray("I", slots),
+                   multiprocessing.RawArray("Q", slots), multiprocessing.RawValue("Q", 0)), slab
+
+    def _free(self, slot: int):
+        # Caller holds the owners' lock
+        self.owners[slot] = 0
+        self.generations[slot] += 1
+        self.free_slots.put(slot)
+
+    def store(self, item, body: bytes, encoding: Optional[str]):
+        """
+        Puts the body in a free slot (waiting up to STORE_TIMEOUT for one if the parsers are
+        behind) and records it on the queue item; without a free slot the body goes inline.
+        """
+        slot = None
+        if self.slab_name is not None:
+            try:
+                slot = self.free_slots.get(timeout=STORE_TIMEOUT)
+            except queue.Empty:
+                print(f"No free page slot within {STORE_TIMEOUT:.0f}s, sending {item.url} through the queue")
+        if slot is None:
+            item.webpage_content = curler.decode_body(body, encoding)
+            return item
+        with self.owners.get_lock():
+            self.owners[slot] = os.getpid()
+            item.slot_generation = self.generations[slot]
+        item.slot = slot
+        item.content_length = attach(self.slab_name).write(slot, body)
+        item.encoding = encoding
+        return item
+
+    def _current(self, item) -> bool:
+        # Caller holds the owners' lock. Every free bumps the generation, so a match means
+        # the slot still holds this item's body
+        return self.generations[item.slot] == item.slot_generation
+
+    def queued(self, item):
+        """Called by the fetcher once the item is on the processing queue: its slot no longer dies with the fetcher."""
+        if item.slot is None:
+            return
+        with self.owners.get_lock():
+            if self._current(item) and self.owners[item.slot] == os.getpid():
+                self.owners[item.slot] = QUEUED
+                self.queued_at[item.slot] = self.taken.value
+
+    def discard(self, item):
+        """Frees the slot of an item the fetcher failed to queue."""
+        if item.slot is None:
+            return
+        with self.owners.get_lock():
+            if self._current(item) and self.owners[item.slot] == os.getpid():
+                self._free(item.slot)
+
+    def reclaim(self, pid: int) -> int:
+        """Frees the slots a process that exited was holding; returns how many. Main process only."""
+        if self.owners is None:
+            return 0
+        with self.owners.get_lock():
+            slots = [slot for slot in range(len(self.owners)) if self.owners[slot] == pid]
+            for slot in slots:
+                self._free(slot)
+        return len(slots)
+
+    def sweep(self, stale_after: int) -> int:
+        """
+        Frees the slots that have been QUEUED while more than stale_after items were taken off
+        the queue (its size plus the parsers that may hold an item they have not loaded yet):
+        their page has left the queue with a parser that died before loading it. Returns how
+        many. Should the bound be too low, the page is only dropped by load() and fetched
+        again. Main process only.
+        """
+        if self.owners is None:
+            return 0
+        with self.owners.get_lock():
+            slots = [slot for slot in range(len(self.owners))
+                     if self.owners[slot] == QUEUED and self.taken.value - self.queued_at[slot] > stale_after]
+            for slot in slots:
+                self._free(slot)
+        return len(slots)
+
+    def load(self, item, archive=None) -> Optional[str]:
+        """
+        Decodes the item's page straight out of shared memory and frees its slot. With an
+        archive.ArchiveWriter the raw body is archived first and item.archive says where.
+        None when the slot was reclaimed from a fetcher that died before queueing the page;
+        the caller gives the task back then.
+        """
+        if item.slot is None:
+            if self.taken is not None:
+                with self.owners.get_lock():
+                    self.taken.value += 1
+            if archive is not None and item.webpage_content:
+                item.archive = archive.write(item.url, item.status_code, "utf-8", item.webpage_content.encode("utf-8"),
+                                             item.etag, item.last_modified, item.truncated)
+            return item.webpage_content
+        with self.owners.get_lock():
+            self.taken.value += 1
+            # The slot is ours from here on: if we die, reclaim() gives it back
+            if not self._current(item):
+                # The parser releases the task so it is fetched again
+                print(f"Page slot of {item.url} was reclaimed before it was parsed, page dropped")
+                return None
+            self.owners[item.slot] = os.getpid()
+        try:
+            view = attach(self.slab_name).view(item.slot, item.content_length)
+            try:
+                if archive is not None and item.content_length:
+                    item.archive = archive.write(item.url, item.status_code, item.encoding, view,
+                                                 item.etag, item.last_modified, item.truncated)
+                return curler.decode_body(view, item.encoding)
+            finally:
+                view.release()
+        finally:
+            with self.owners.get_lock():
+                self._free(item.slot)
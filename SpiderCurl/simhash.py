@@ -0,0 +1,101 @@
+# Near-duplicate page detection with 64-bit SimHash fingerprints of the page text
+import hashlib
+import re
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+import toml
+
+config = toml.load("config.toml")
+
+MAX_DISTANCE = config.get("near_duplicate_distance", 3)  # Differing fingerprint bits still counted as the same page; 0 disables
+MIN_TOKENS = config.get("simhash_min_tokens", 50)  # Shorter texts get no fingerprint: too little to tell pages apart
+SHINGLE_SIZE = 3  # Consecutive words hashed together
+
+_word = re.compile(r"[^\W_]+")
+_MASK = (1 << 64) - 1
+# Bit positions set in each byte value, to turn per-byte histograms into per-bit votes
+_BYTE_BITS = [[bit for bit in range(8) if value >> bit & 1] for value in range(256)]
+
+
+def fingerprint(text: Optional[str]) -> Optional[int]:
+    """
+    SimHash of the text's word 3-shingles: every bit is the majority vote of that bit over
+    the shingle hashes, so texts sharing most shingles differ in few bits. Returned as a
+    signed 64-bit int so it fits a Mongo int64; None for texts under MIN_TOKENS words.
+    """
+    if not text:
+        return None
+    words = _word.findall(text.lower())
+    if len(words) < MIN_TOKENS:
+        return None
+    # Count byte values per byte position instead of testing 64 bits per shingle
+    histograms = [[0] * 256 for _ in range(8)]
+    shingles = 0
+    for i in range(len(words) - SHINGLE_SIZE + 1):
+        digest = hashlib.blake2b(" ".join(words[i:i + SHINGLE_SIZE]).encode("utf-8"), digest_size=8).digest()
+        for position, value in enumerate(digest):
+            histograms[position][value] += 1
+        shingles += 1
+    value = 0
+    for position, histogram in enumerate(histograms):
+        votes = [0] * 8
+        for byte_value, count in enumerate(histogram):
+            if count:
+                for bit in _BYTE_BITS[byte_value]:
+                    votes[bit] += count
+        for bit, count in enumerate(votes):
+            if 2 * count > shingles:
+                value |= 1 << (position * 8 + bit)
+    return value - (1 << 64) if value >> 63 else value
+
+
+def distance(a: int, b: int) -> int:
+    return bin((a ^ b) & _MASK).count("1")
+
+
+class SimHashIndex:
+    """
+    Finds a stored fingerprint within max_distance bits of a new one. The 64 bits are cut
+    into max_distance + 1 bands; two fingerprints that differ in at most max_distance bits
+    agree exactly on at least one band, so only pages sharing a band value are compared.
+    """
+
+    def __init__(self, max_distance: int = MAX_DISTANCE):
+        self.max_distance = max_distance
+        bands = max_distance + 1
+        self.bands = [(64 * i // bands, 64 * (i + 1) // bands) for i in range(bands)]
+        self.tables: List[Dict[int, List[str]]] = [defaultdict(list) for _ in self.bands]
+        self.fingerprints: Dict[str, int] = {}
+
+    def __len__(self):
+        return len(self.fingerprints)
+
+    def _keys(self, value: int):
+        for start, end in self.bands:
+            yield (value >> start) & ((1 << (end - start)) - 1)
+
+    def find(self, value: int, exclude: Optional[str] = None) -> Optional[str]:
+        """URL of a stored page near `value` (other than `exclude`), or None."""
+        for table, key in zip(self.tables, self._keys(value)):
+            for url in table.get(key, ()):
+                if url != exclude and distance(self.fingerprints[url], value) <= self.max_distance:
+                    return url
+        return None
+
+    def add(self, url: str, value: int):
+        if url in self.fingerprints:
+            self.remove(url)
+        self.fingerprints[url] = value
+        for table, key in zip(self.tables, self._keys(value)):
+            table[key].append(url)
+
+    def remove(self, url: str):
+        value = self.fingerprints.pop(url, None)
+        if value is None:
+            return
+        for table, key in zip(self.tables, self._keys(value)):
+            urls = table[key]
+            urls.remove(url)
+            if not urls:
+                del table[key]
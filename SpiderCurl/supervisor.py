@@ -0,0 +1,205 @@
+# Keeps the crawler's processes running, restarts the ones that die, and spills queued work on shutdown
+import multiprocessing
+import os
+import signal
+import time
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional
+
+import toml
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+from recordlog import RecordLog
+
+config = toml.load("config.toml")
+
+RESTART_BACKOFF = config.get("restart_backoff", 1.0)  # Seconds before restarting a crashed process, doubled per crash in a row
+MAX_RESTART_BACKOFF = config.get("max_restart_backoff", 60.0)
+STABLE_SECONDS = config.get("restart_stable_seconds", 60.0)  # A process up this long starts its crash count over
+DRAIN_TIMEOUT = config.get("drain_timeout", 60.0)  # Seconds each stage gets to wind down on shutdown
+SPILL_PATH = config.get("spill_path", "data/spill")
+CRAWLER_LOCK = config.get("crawler_lock", "data/crawler.lock")
+
+
+def _run(target: Callable, args: tuple):
+    # Ctrl-C reaches the whole process group; only the main process acts on it, by draining.
+    # SIGTERM is the main process's drain request too, but a child must still die of terminate()
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    target(*args)
+
+
+def _interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+def drain_on_sigterm():
+    """Makes SIGTERM to the main process shut the crawler down like Ctrl-C: drained, nothing lost."""
+    signal.signal(signal.SIGTERM, _interrupt)
+
+
+def crawler_lock(path: str = CRAWLER_LOCK):
+    """
+    Takes the lock a running crawler holds for its lifetime, which the single-writer logs
+    (IndexLog, LinkLog) rely on: the open lock file, or None when a crawler or an offline
+    writer of those logs already holds it. The lock goes with the process.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    lock_file = open(path, "a")
+    try:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            # Locks the first byte; the file may be empty, Windows locks past the end too
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        lock_file.close()
+        return None
+    return lock_file
+
+
+class Child:
+    __slots__ = ("name", "role", "target", "args", "stop", "process", "started_at", "crashes", "restart_at", "retiring", "reaped")
+
+    def __init__(self, name: str, role: str, target: Callable, args: tuple, stop=None):
+        self.name = name
+        self.role = role
+        self.target = target
+        self.args = args
+        self.stop = stop  # Event the process checks between work items; set to retire it
+        self.process: Optional[multiprocessing.Process] = None
+        self.started_at = 0.0
+        self.crashes = 0
+        self.restart_at: Optional[float] = None
+        self.retiring = False
+        self.reaped = False  # on_exit has run for the current process
+
+
+class Supervisor:
+    """
+    The crawler's processes by role (task_manager, fetcher, parser, database, indexer). A
+    process that exits unasked is restarted with the same arguments after RESTART_BACKOFF
+    seconds, doubling with every crash in a row up to MAX_RESTART_BACKOFF, so a process that
+    fails at start does not spin. check() does the restarts and runs from the main loop.
+    Once draining, nothing is restarted: processes are expected to exit. `on_exit` is called
+    with the pid of every process that exited, before anything replaces it, to free what
+    the process held in shared memory.
+    """
+
+    def __init__(self, on_exit: Optional[Callable[[int], None]] = None):
+        self.children: Dict[str, Child] = {}
+        self.numbers = defaultdict(int)
+        self.draining = False
+        self.on_exit = on_exit
+
+    def _reap(self, child: Child):
+        if child.reaped or child.process is None:
+            return
+        child.reaped = True
+        if self.on_exit is not None:
+            try:
+                self.on_exit(child.process.pid)
+            except Exception as e:
+                print(f"Cleaning up after {child.name} failed: {e}")
+
+    def _spawn(self, child: Child):
+        args = child.args + (child.stop,) if child.stop is not None else child.args
+        child.process = multiprocessing.Process(target=_run, args=(child.target, args), name=child.name, daemon=True)
+        child.process.start()
+        child.started_at = time.monotonic()
+        child.restart_at = None
+        child.reaped = False
+
+    def add(self, role: str, target: Callable, args: tuple, stop=None) -> str:
+        """Starts a process; with a stop event it is passed as the last argument and the process can be retired."""
+        name = f"{role}-{self.numbers[role]}"
+        self.numbers[role] += 1
+        child = self.children[name] = Child(name, role, target, args, stop)
+        self._spawn(child)
+        return name
+
+    def running(self, role: str) -> List[str]:
+        """Processes of a role that are up or waiting to be restarted, oldest first; retiring ones are not counted."""
+        return [name for name, child in self.children.items() if child.role == role and not child.retiring]
+
+    def pids(self, min_age: float = 0.0) -> List[int]:
+        """Pids of the processes that have been running for at least min_age seconds."""
+        now = time.monotonic()
+        return [child.process.pid for child in self.children.values()
+                if child.process is not None and child.process.is_alive() and now - child.started_at >= min_age]
+
+    def retire(self, name: str):
+        child = self.children[name]
+        child.retiring = True
+        if child.stop is not None:
+            child.stop.set()
+        elif child.process is not None:
+            child.process.terminate()
+
+    def check(self):
+        now = time.monotonic()
+        for name, child in list(self.children.items()):
+            if child.process is not None and child.process.is_alive():
+                continue
+            if child.retiring or self.draining:
+                if child.process is None or child.process.exitcode is not None:
+                    self._reap(child)
+                    del self.children[name]
+                continue
+            if child.restart_at is None:
+                self._reap(child)
+                child.crashes = 1 if now - child.started_at >= STABLE_SECONDS else child.crashes + 1
+                delay = min(RESTART_BACKOFF * 2 ** (child.crashes - 1), MAX_RESTART_BACKOFF)
+                print(f"{name} exited with code {child.process.exitcode}, restarting in {delay:.1f}s")
+                child.restart_at = now + delay
+            elif now >= child.restart_at:
+                self._spawn(child)
+
+    def stop(self, role: str, timeout: float = DRAIN_TIMEOUT) -> bool:
+        """
+        Waits up to `timeout` for the processes of a role to exit, retiring them first if they
+        have stop events; the ones still running after that are terminated. False if any had to be.
+        """
+        children = [child for child in self.children.values() if child.role == role and child.process is not None]
+        for child in children:
+            if child.stop is not None:
+                child.retiring = True
+                child.stop.set()
+        deadline = time.monotonic() + timeout
+        clean = True
+        for child in children:
+            child.process.join(max(0.0, deadline - time.monotonic()))
+            if child.process.is_alive():
+                print(f"{child.name} did not finish within {timeout:.0f}s, terminating it")
+                child.process.terminate()
+                child.process.join()
+                clean = False
+            self._reap(child)
+            del self.children[child.name]
+        return clean
+
+
+class SpillLog(RecordLog):
+    """
+    What was still queued between the stages when the crawler shut down: ("page", packed
+    webpageQueueItem) fetched but not parsed, ("webpage", packed WebPage) parsed but not
+    stored. Written by the main process at shutdown, queued again and removed at the next start.
+    """
+
+    def __init__(self, path: str = SPILL_PATH):
+        super().__init__(path)
+
+    def read_all(self) -> List[tuple]:
+        records, _ = self.read((0, 0), 1 << 62)
+        return records
+
+    def clear(self):
+        numbers = self._numbers()
+        if numbers:
+            self.trim((numbers[-1] + 1, 0))
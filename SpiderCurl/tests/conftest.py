@@ -0,0 +1,7 @@
+# The crawler's modules read config.toml from the working directory when imported
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.chdir(ROOT)
+sys.path.insert(0, ROOT)
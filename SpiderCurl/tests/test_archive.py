@@ -0,0 +1,47 @@
+import os
+
+from archive import ArchiveReader, ArchiveWriter, _record, parse_record, warc_time
+
+
+def test_record_round_trip():
+    body = "<html>café</html>".encode("utf-8")
+    page = parse_record(_record("https://example.com/", 200, "utf-8", body, etag='"v1"',
+                                last_modified="Tue, 01 Sep 2026 00:00:00 GMT", truncated=True,
+                                fetched_at="2026-09-01T00:00:00Z"))
+    assert (page.url, page.status_code, page.encoding, page.body) == ("https://example.com/", 200, "utf-8", body)
+    assert (page.etag, page.last_modified, page.truncated) == ('"v1"', "Tue, 01 Sep 2026 00:00:00 GMT", True)
+    assert page.fetched_at == "2026-09-01T00:00:00Z"
+
+
+def test_writer_locations_read_back_and_rotate(tmp_path):
+    writer = ArchiveWriter(str(tmp_path), segment_bytes=200)
+    locations = [writer.write(f"https://example.com/{i}", 200, "utf-8", os.urandom(100)) for i in range(3)]
+    writer.close()
+    reader = ArchiveReader(str(tmp_path))
+    assert len(reader.segments()) == 3
+    for i, location in enumerate(locations):
+        assert reader.read(*location).url == f"https://example.com/{i}"
+    assert [page.url for _, page in reader] == [f"https://example.com/{i}" for i in range(3)]
+    reader.close()
+
+
+def test_lookup_returns_the_latest_copy_by_warc_date(tmp_path):
+    path = str(tmp_path)
+    # Two parsers write side by side: the segment that sorts last holds the older copy
+    newer = ArchiveWriter(path)
+    newer.prefix = "20260101000000-100"
+    older = ArchiveWriter(path)
+    older.prefix = "20260101000000-200"
+    older.write("https://example.com/", 200, "utf-8", b"first")
+    newer.write("https://example.com/", 200, "utf-8", b"second")
+    newer.close()
+    older.close()
+    reader = ArchiveReader(path)
+    assert reader.lookup("https://example.com/").body == b"second"
+    assert reader.lookup("https://example.com/missing") is None
+    reader.close()
+
+
+def test_warc_time_with_and_without_fraction():
+    assert warc_time("2026-01-01T00:00:00Z") < warc_time("2026-01-01T00:00:00.5Z") < warc_time("2026-01-01T00:00:01Z")
+    assert warc_time(None) < warc_time("1999-01-01T00:00:00Z")
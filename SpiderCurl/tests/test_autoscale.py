@@ -0,0 +1,88 @@
+import autoscale
+import curler
+from autoscale import Autoscaler, Load
+
+
+def _run(scaler, loads, start=0.0, interval=autoscale.INTERVAL):
+    """Feeds the readings one interval apart; returns the sizes after the last one."""
+    sizes = None
+    for i, load in enumerate(loads):
+        sizes = scaler.update(load, now=start + i * interval)
+    return sizes
+
+
+def test_full_processing_queue_adds_parsers_after_patience():
+    scaler = Autoscaler(fetchers=2, parsers=8, in_flight=100)
+    behind = Load(processing_fill=0.9, webpage_fill=0.0, fetch_waiting=0)
+    assert _run(scaler, [behind] * (autoscale.PATIENCE - 1)) == (8, 100)
+    assert scaler.update(behind, now=autoscale.PATIENCE * autoscale.INTERVAL) == (10, 100)
+
+
+def test_cooldown_holds_a_size_after_a_change():
+    scaler = Autoscaler(fetchers=2, parsers=8, in_flight=100)
+    behind = Load(processing_fill=0.9, webpage_fill=0.0, fetch_waiting=0)
+    _run(scaler, [behind] * autoscale.PATIENCE)
+    assert scaler.parsers == 10
+    changed = scaler.changed["parsers"]
+    _run(scaler, [behind] * autoscale.PATIENCE, start=changed + autoscale.INTERVAL, interval=1.0)
+    assert scaler.parsers == 10
+    _run(scaler, [behind] * autoscale.PATIENCE, start=changed + autoscale.COOLDOWN)
+    assert scaler.parsers == 12
+
+
+def test_full_database_queue_does_not_add_parsers():
+    scaler = Autoscaler(fetchers=2, parsers=8, in_flight=100)
+    assert _run(scaler, [Load(processing_fill=0.9, webpage_fill=0.9, fetch_waiting=0)] * 10)[0] == 8
+
+
+def test_idle_parsers_shrink_to_the_minimum():
+    scaler = Autoscaler(fetchers=2, parsers=autoscale.MIN_PARSERS + 1, in_flight=100)
+    idle = Load(processing_fill=0.0, webpage_fill=0.0, fetch_waiting=0)
+    for round_start in range(0, 10):
+        _run(scaler, [idle] * autoscale.PATIENCE, start=round_start * (autoscale.COOLDOWN + 100))
+    assert scaler.parsers == autoscale.MIN_PARSERS
+
+
+def test_starved_parsers_raise_in_flight_and_unhelpful_raise_is_taken_back():
+    scaler = Autoscaler(fetchers=1, parsers=8, in_flight=100)
+    # Parsers wait, tasks wait, every fetch slot is busy: fetching is the bottleneck
+    fetched = 0.0
+    now = 0.0
+    for _ in range(autoscale.PATIENCE):
+        fetched += 10 * autoscale.INTERVAL  # 10 fetches a second
+        scaler.update(Load(0.0, 0.0, fetch_waiting=500, fetches_in_flight=100, fetched=fetched, parse_seconds=0.0),
+                      now=now)
+        now += autoscale.INTERVAL
+    assert scaler.in_flight == 125
+    raised_at = scaler.changed["in_flight"]
+    # Still 10 fetches a second with more slots: politeness is the limit, so the raise is undone
+    while now < raised_at + autoscale.COOLDOWN + autoscale.INTERVAL:
+        fetched += 10 * autoscale.INTERVAL
+        scaler.update(Load(0.0, 0.0, fetch_waiting=500, fetches_in_flight=125, fetched=fetched, parse_seconds=0.0),
+                      now=now)
+        now += autoscale.INTERVAL
+    assert scaler.in_flight == 100
+    assert scaler.hold_in_flight_until > now
+
+
+def test_full_database_queue_lowers_in_flight():
+    scaler = Autoscaler(fetchers=2, parsers=8, in_flight=100)
+    assert _run(scaler, [Load(processing_fill=0.2, webpage_fill=0.9, fetch_waiting=10)] * autoscale.PATIENCE)[1] == 80
+
+
+def test_sizes_are_clamped():
+    scaler = Autoscaler(fetchers=1, parsers=10 ** 6, in_flight=1)
+    assert (scaler.parsers, scaler.in_flight) == (autoscale.MAX_PARSERS, autoscale.MIN_IN_FLIGHT)
+
+
+def test_upscale_stays_within_the_connection_pool():
+    scaler = Autoscaler(fetchers=1, parsers=8, in_flight=200)
+    pool = autoscale.connection_limit(scaler.in_flight)
+    starved = Load(processing_fill=0.0, webpage_fill=0.0, fetch_waiting=10 ** 6)
+    for reading in range(1000):
+        in_flight = scaler.update(starved, now=reading * autoscale.COOLDOWN)[1]
+        assert in_flight <= pool
+    assert in_flight == autoscale.MAX_IN_FLIGHT
+    # The fetcher's client is built with that many connections
+    client = curler.create_async_client(max_connections=pool)
+    assert client._transport._pool._max_connections == pool
@@ -0,0 +1,40 @@
+from canonicalize import canonicalize_url
+
+
+def test_host_scheme_and_default_port_are_normalized():
+    assert canonicalize_url("HTTPS://Example.COM:443/a") == "https://example.com/a"
+    assert canonicalize_url("http://example.com:8080/") == "http://example.com:8080/"
+    assert canonicalize_url("http://example.com.") == "http://example.com/"
+
+
+def test_fragment_trailing_slash_and_dot_segments():
+    assert canonicalize_url("https://example.com/a/b/#top") == "https://example.com/a/b"
+    assert canonicalize_url("https://example.com/a/./b/../c") == "https://example.com/a/c"
+    assert canonicalize_url("https://www.nytimes.com/international/") == "https://www.nytimes.com/international"
+
+
+def test_query_is_sorted_and_tracking_parameters_dropped():
+    assert (canonicalize_url("https://example.com/p?b=2&utm_source=x&a=1&fbclid=y")
+            == "https://example.com/p?a=1&b=2")
+    assert canonicalize_url("https://example.com/p?utm_medium=x") == "https://example.com/p"
+
+
+def test_percent_encoding_is_normalized():
+    assert canonicalize_url("https://example.com/%7euser") == "https://example.com/~user"
+    assert canonicalize_url("https://example.com/a%2fb") == "https://example.com/a%2Fb"
+    assert canonicalize_url("https://example.com/café menu") == "https://example.com/caf%C3%A9%20menu"
+
+
+def test_relative_links_resolve_against_the_base():
+    assert canonicalize_url("../x?q=1#f", "https://example.com/a/b/c") == "https://example.com/a/x?q=1"
+
+
+def test_international_hosts_are_idna_encoded():
+    assert canonicalize_url("https://bücher.example/") == "https://xn--bcher-kva.example/"
+
+
+def test_uncrawlable_urls_are_rejected():
+    assert canonicalize_url("mailto:someone@example.com") is None
+    assert canonicalize_url("javascript:void(0)") is None
+    assert canonicalize_url("https:///path") is None
+    assert canonicalize_url("https://example.com:port/") is None
@@ -0,0 +1,172 @@
+import asyncio
+
+import httpx
+
+import curler
+from robots import parse
+
+HTML = {"Content-Type": "text/html; charset=utf-8"}
+
+
+def _fetch(routes, url, validators=None, rules=None):
+    """fetch_url against a MockTransport answering from `routes` (url -> httpx.Response); returns (result, requested urls)."""
+    requested = []
+
+    def handler(request):
+        requested.append(str(request.url))
+        return routes.get(str(request.url)) or httpx.Response(404)
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            return await curler.fetch_url(client, url, validators, rules)
+    return asyncio.run(run()), requested
+
+
+def _redirect(status, location):
+    return httpx.Response(status, headers={"Location": location})
+
+
+def test_page_is_fetched():
+    result, _ = _fetch({"https://a.example/": httpx.Response(200, headers=HTML, content=b"<p>hi</p>")}, "https://a.example/")
+    assert (result.status_code, result.body, result.encoding) == (200, b"<p>hi</p>", "utf-8")
+    assert not result.redirected
+
+
+def test_conditional_fetch_sends_validators():
+    seen_headers = {}
+
+    def handler(request):
+        seen_headers.update(request.headers)
+        return httpx.Response(304)
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            return await curler.fetch_url(client, "https://a.example/", {"etag": '"v1"', "last_modified": None})
+    result = asyncio.run(run())
+    assert seen_headers["if-none-match"] == '"v1"'
+    assert (result.status_code, result.etag, result.body) == (304, '"v1"', None)
+
+
+def test_same_origin_redirects_are_followed_for_every_status():
+    for status in curler.REDIRECT_STATUSES:
+        routes = {
+            "https://a.example/old": _redirect(status, "/new#top"),
+            "https://a.example/new": httpx.Response(200, headers=HTML, content=b"<p>new</p>"),
+        }
+        result, requested = _fetch(routes, "https://a.example/old")
+        assert (result.url, result.status_code, result.body) == ("https://a.example/old", 200, b"<p>new</p>")
+        assert result.redirected and result.redirect_url == "https://a.example/new"
+        assert requested == ["https://a.example/old", "https://a.example/new"]
+
+
+def test_cross_origin_redirect_is_not_fetched():
+    routes = {"https://a.example/": _redirect(301, "https://B.example:443/page")}
+    result, requested = _fetch(routes, "https://a.example/")
+    assert requested == ["https://a.example/"]
+    assert (result.status_code, result.redirect_url, result.body) == (301, "https://b.example/page", None)
+
+
+def test_redirect_disallowed_by_robots_is_not_fetched():
+    routes = {"https://a.example/": _redirect(302, "/private/x")}
+    rules = parse("User-agent: *\nDisallow: /private\n", "SpiderCurl")
+    result, requested = _fetch(routes, "https://a.example/", rules=rules)
+    assert requested == ["https://a.example/"]
+    assert result.redirect_url == "https://a.example/private/x"
+
+
+def test_redirect_loop_stops_at_the_hop_limit():
+    routes = {"https://a.example/a": _redirect(302, "/b"), "https://a.example/b": _redirect(302, "/a")}
+    result, requested = _fetch(routes, "https://a.example/a")
+    assert len(requested) == curler.MAX_REDIRECTS + 1
+    assert result.body is None and "redirects" in result.skip_reason
+
+
+def test_redirect_without_location_is_skipped():
+    result, _ = _fetch({"https://a.example/": httpx.Response(302)}, "https://a.example/")
+    assert result.redirect_url is None and result.skip_reason
+
+
+def test_errors_carry_status_and_retry_after():
+    routes = {"https://a.example/": httpx.Response(503, headers={"Retry-After": "120"})}
+    result, _ = _fetch(routes, "https://a.example/")
+    assert (result.status_code, result.retry_after, result.body) == (503, 120.0, None)
+    result, _ = _fetch({}, "https://a.example/missing")
+    assert result.status_code == 404
+
+
+def test_network_error_has_no_status():
+    def handler(request):
+        raise httpx.ConnectTimeout("timed out", request=request)
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            return await curler.fetch_url(client, "https://a.example/")
+    assert asyncio.run(run()).status_code is None
+
+
+def test_non_html_is_not_downloaded():
+    routes = {"https://a.example/x.png": httpx.Response(200, headers={"Content-Type": "image/png"}, content=b"\x89PNG")}
+    result, _ = _fetch(routes, "https://a.example/x.png")
+    assert result.body is None and result.skip_reason.startswith("non-HTML")
+
+
+def test_client_pools_connections():
+    client = curler.create_async_client(max_connections=7)
+    assert client._transport._pool._max_connections == 7
+    assert client.headers["User-Agent"] == curler.HEADERS["User-Agent"]
+    asyncio.run(client.aclose())
+
+
+def _chunked(*chunks):
+    # A streamed body with no Content-Length, so only reading it shows its size
+    async def body():
+        for chunk in chunks:
+            yield chunk
+    return body()
+
+
+def test_body_over_the_cap_is_truncated(monkeypatch):
+    monkeypatch.setattr(curler, "MAX_BODY_BYTES", 10)
+    routes = {"https://a.example/": httpx.Response(200, headers=HTML, content=_chunked(b"<p>1234", b"5678</p>"))}
+    result, _ = _fetch(routes, "https://a.example/")
+    assert (result.body, result.truncated) == (b"<p>1234567", True)
+
+
+def test_body_over_the_cap_by_content_length_is_skipped(monkeypatch):
+    monkeypatch.setattr(curler, "MAX_BODY_BYTES", 10)
+    routes = {"https://a.example/": httpx.Response(200, headers=HTML, content=b"<p>" + b"x" * 20 + b"</p>")}
+    result, _ = _fetch(routes, "https://a.example/")
+    assert result.body is None and "max_body_bytes" in result.skip_reason
+
+
+def test_header_charset_wins():
+    body = '<meta charset="utf-8"><p>café</p>'.encode("latin-1")
+    routes = {"https://a.example/": httpx.Response(200, headers={"Content-Type": 'text/html; Charset="ISO-8859-1"'},
+                                                   content=body)}
+    result, _ = _fetch(routes, "https://a.example/")
+    assert result.encoding == "iso-8859-1"
+    assert curler.decode_body(result.body, result.encoding) == '<meta charset="utf-8"><p>café</p>'
+
+
+def test_meta_charset_is_sniffed_from_the_first_kilobyte():
+    head = b'<html><head><meta http-equiv="Content-Type" content="text/html; charset=windows-1251">'
+    tail = "<p>привет</p>".encode("windows-1251") * 200
+    routes = {"https://a.example/": httpx.Response(200, headers={"Content-Type": "text/html"},
+                                                   content=_chunked(head, tail))}
+    result, _ = _fetch(routes, "https://a.example/")
+    assert result.encoding == "windows-1251"
+    assert curler.decode_body(result.body, result.encoding).endswith("<p>привет</p>")
+
+
+def test_body_without_charset_decodes_as_utf8():
+    routes = {"https://a.example/": httpx.Response(200, headers={"Content-Type": "text/html"},
+                                                   content="<p>naïve</p>".encode("utf-8"))}
+    result, _ = _fetch(routes, "https://a.example/")
+    assert result.encoding == "utf-8"
+    assert curler.decode_body(memoryview(result.body), result.encoding) == "<p>naïve</p>"
+
+
+def test_decode_body_survives_bad_bytes_and_unknown_charsets():
+    assert curler.decode_body(b"<p>\xff</p>", "utf-8") == "<p>�</p>"
+    assert curler.decode_body(b"<p>ok</p>", "x-no-such-charset") == "<p>ok</p>"
+    assert curler.decode_body(b"<p>ok</p>", None) == "<p>ok</p>"
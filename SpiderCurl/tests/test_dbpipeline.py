@@ -0,0 +1,87 @@
+import queue
+import threading
+import time
+
+import pymongo
+import pytest
+
+import mongo
+from dbpipeline import WritePipeline, next_batch
+from models import WebPage, pack_webpage
+from seenfilter import ScalableBloomFilter
+
+mongomock = pytest.importorskip("mongomock")
+
+
+@pytest.fixture
+def db():
+    return mongomock.MongoClient()["spidercurl_test"]
+
+
+def _page(url, links=()):
+    return WebPage(url=url, title="t", text_content="text", extracted_urls=list(links))
+
+
+def _claimed(db, *urls):
+    db["crawlTasks"].insert_many([{"url": url, "status": "pending", "attempts": 0, "priority": 1.0} for url in urls])
+    mongo.claim_tasks(db, "crawler-1")
+
+
+def _task_urls(db):
+    return sorted(task["url"] for task in db["crawlTasks"].find())
+
+
+def test_next_batch_stops_at_batch_size_or_max_wait():
+    webpage_queue = queue.Queue()
+    for i in range(5):
+        webpage_queue.put(pack_webpage(_page(f"https://{i}.example/")))
+    assert [page.url for page in next_batch(webpage_queue, 3, 1.0)] == [f"https://{i}.example/" for i in range(3)]
+    start = time.monotonic()
+    assert len(next_batch(webpage_queue, 3, 0.1)) == 2
+    assert time.monotonic() - start < 1.0
+    assert next_batch(webpage_queue, 3, 0.05) == []
+
+
+def test_batch_is_stored_its_links_queued_and_its_tasks_removed(db):
+    _claimed(db, "https://a.example/", "https://b.example/")
+    pipeline = WritePipeline(db, ScalableBloomFilter(capacity=100))
+    pipeline.submit([_page("https://a.example/", ["https://c.example/"]), _page("https://b.example/")])
+    pipeline.drain()
+    assert db["webpages"].count_documents({}) == 2
+    assert _task_urls(db) == ["https://c.example/"]
+    assert "upsert: 1 batches" in pipeline.report()
+
+
+def test_failed_upsert_keeps_the_tasks_and_the_pipeline_running(db, monkeypatch):
+    _claimed(db, "https://a.example/", "https://b.example/")
+    insert_many_webpages = mongo.insert_many_webpages
+
+    def fail_once(db, batch, freshness=None):
+        monkeypatch.setattr(mongo, "insert_many_webpages", insert_many_webpages)
+        raise pymongo.errors.AutoReconnect("connection refused")
+    monkeypatch.setattr(mongo, "insert_many_webpages", fail_once)
+    pipeline = WritePipeline(db, ScalableBloomFilter(capacity=100))
+    pipeline.submit([_page("https://a.example/")])
+    pipeline.drain()
+    # Not stored, so not removed: the task is claimed again once its lease expires
+    assert _task_urls(db) == ["https://a.example/", "https://b.example/"]
+    assert "upsert: idle, 1 errors" in pipeline.report()
+    pipeline.submit([_page("https://b.example/")])
+    pipeline.drain()
+    assert _task_urls(db) == ["https://a.example/"]
+    assert "errors" not in pipeline.report()
+
+
+def test_submit_blocks_while_the_stage_is_behind(db, monkeypatch):
+    release = threading.Event()
+    monkeypatch.setattr(mongo, "insert_many_webpages", lambda db, batch, freshness=None: release.wait(5))
+    pipeline = WritePipeline(db, ScalableBloomFilter(capacity=100), in_flight_batches=1)
+    # One batch in the stage, one waiting: the third has to wait for room
+    submitter = threading.Thread(target=lambda: [pipeline.submit([_page(f"https://{i}.example/")]) for i in range(3)])
+    submitter.start()
+    submitter.join(0.3)
+    assert submitter.is_alive()
+    release.set()
+    submitter.join(5)
+    assert not submitter.is_alive()
+    pipeline.drain()
@@ -0,0 +1,91 @@
+import asyncio
+import socket
+import time
+
+import pytest
+
+import dnscache
+from dnscache import DNSCache
+
+
+class _Resolver(DNSCache):
+    """DNSCache answering from a table instead of the network, counting the queries made."""
+
+    def __init__(self, answers, ttl=60.0):
+        super().__init__()
+        self.answers = answers
+        self.ttl = ttl
+        self.queries = []
+
+    async def _query(self, host):
+        self.queries.append(host)
+        await asyncio.sleep(0.01)
+        if host not in self.answers:
+            raise socket.gaierror(socket.EAI_NONAME, "Name or service not known")
+        return self.answers[host], self.ttl
+
+
+def test_answer_is_cached():
+    async def run():
+        cache = _Resolver({"a.example": ["10.0.0.1"]})
+        assert await cache.resolve("a.example") == ["10.0.0.1"]
+        assert await cache.resolve("a.example") == ["10.0.0.1"]
+        return cache
+    cache = asyncio.run(run())
+    assert cache.queries == ["a.example"]
+    assert (cache.misses, cache.hits) == (1, 1)
+
+
+def test_concurrent_lookups_share_one_query():
+    async def run():
+        cache = _Resolver({"a.example": ["10.0.0.1"]})
+        cache.prefetch("a.example")
+        results = await asyncio.gather(*(cache.resolve("a.example") for _ in range(5)))
+        return cache, results
+    cache, results = asyncio.run(run())
+    assert results == [["10.0.0.1"]] * 5
+    assert cache.queries == ["a.example"]
+
+
+def test_failure_is_remembered():
+    async def run():
+        cache = _Resolver({})
+        for _ in range(2):
+            with pytest.raises(socket.gaierror):
+                await cache.resolve("missing.example")
+        return cache
+    cache = asyncio.run(run())
+    assert cache.queries == ["missing.example"]
+    assert (cache.failures, cache.negative_hits) == (1, 1)
+
+
+def test_ttl_is_clamped_and_expired_answers_are_looked_up_again():
+    async def run():
+        cache = _Resolver({"a.example": ["10.0.0.1"]}, ttl=1.0)
+        await cache.resolve("a.example")
+        expires, addresses, error = cache.entries["a.example"]
+        assert expires - time.monotonic() > dnscache.MIN_TTL - 1
+        cache.entries["a.example"] = (time.monotonic() - 1, addresses, error)
+        await cache.resolve("a.example")
+        return cache
+    assert asyncio.run(run()).queries == ["a.example", "a.example"]
+
+
+def test_addresses_are_not_looked_up():
+    cache = _Resolver({})
+    assert asyncio.run(cache.resolve("127.0.0.1")) == ["127.0.0.1"]
+    assert cache.queries == []
+
+
+def test_oldest_entries_go_when_full(monkeypatch):
+    monkeypatch.setattr(dnscache, "MAX_ENTRIES", 3)
+    cache = _Resolver({})
+    for i in range(5):
+        cache._store(f"host{i}.example", ["10.0.0.1"], 60.0)
+    assert list(cache.entries) == ["host2.example", "host3.example", "host4.example"]
+
+
+def test_cache_is_built_outside_an_event_loop():
+    # With aiodns installed the resolver needs a running loop; the fetcher builds the cache before it has one
+    cache = DNSCache()
+    assert cache.resolver is None
@@ -0,0 +1,43 @@
+import pytest
+
+from frontier import SEED_CASH, credit_outlinks, cross_host_links, priority, url_depth
+from models import WebPage
+
+
+def _page(url, links, cash=None):
+    return WebPage(url=url, title=None, meta_description=None, text_content=None, extracted_urls=links, cash=cash)
+
+
+def test_url_depth():
+    assert url_depth("https://example.com/") == 0
+    assert url_depth("https://example.com/a/b/") == 2
+    assert url_depth("https://example.com/a?page=2") == 2
+
+
+def test_priority_orders_by_importance_and_depth():
+    assert priority(0.1, 0, 0, 0) > priority(0.001, 0, 0, 0)
+    assert priority(0.0, 10, 0, 0) > priority(0.0, 1, 0, 0)
+    assert priority(0.0, 0, 0, 0, pagerank=3.0) > priority(0.0, 0, 0, 0, pagerank=1.0)
+    assert priority(0.01, 2, 1, 5) > priority(0.01, 2, 4, 5)
+
+
+def test_cash_is_split_over_distinct_outlinks():
+    pages = [
+        _page("https://a.example/", ["https://b.example/", "https://c.example/", "https://c.example/",
+                                     "https://a.example/"], cash=0.5),
+        _page("https://b.example/", ["https://c.example/"]),
+    ]
+    credits = credit_outlinks(pages)
+    # Self-links and repeats do not count; a page without cash spends a seed's share
+    assert credits["https://b.example/"] == [pytest.approx(0.25), 1]
+    assert credits["https://c.example/"] == [pytest.approx(0.25 + SEED_CASH), 2]
+    assert "https://a.example/" not in credits
+
+
+def test_cross_host_links_count_pages_from_other_hosts():
+    pages = [
+        _page("https://a.example/1", ["https://b.example/x", "https://b.example/y", "https://a.example/2"]),
+        _page("https://a.example/2", ["https://b.example/z"]),
+        _page("https://b.example/x", ["https://b.example/y"]),
+    ]
+    assert dict(cross_host_links(pages)) == {"b.example": 2}
@@ -0,0 +1,65 @@
+import os
+
+from linkgraph import LinkGraph, LinkLog
+from recordlog import RecordLog
+
+
+def _edges(graph):
+    return {(graph.url(source), graph.url(int(target)))
+            for source in range(graph.node_count)
+            for target in graph.indices[graph.indptr[source]:graph.indptr[source + 1]]}
+
+
+def _fold(path, records):
+    # (url, outlinks) records as LinkLog.append writes them from the crawled pages
+    log = LinkLog(os.path.join(path, "log"))
+    RecordLog.append(log, records)
+    log.close()
+    graph = LinkGraph(path)
+    graph.update(log)
+    return graph
+
+
+def test_update_builds_csr_and_replaces_outlinks(tmp_path):
+    path = str(tmp_path)
+    graph = _fold(path, [("a", ["b", "c", "a", "b"]), ("b", ["c"])])
+    assert graph.manifest["nodes"] == 3
+    assert _edges(graph) == {("a", "b"), ("a", "c"), ("b", "c")}
+
+    graph = _fold(path, [("a", ["d"])])
+    assert _edges(graph) == {("a", "d"), ("b", "c")}
+    assert graph.manifest["edges"] == 2
+    reopened = LinkGraph(path)
+    assert _edges(reopened) == _edges(graph)
+
+
+def test_only_the_committed_edge_version_is_kept(tmp_path):
+    path = str(tmp_path)
+    _fold(path, [("a", ["b"])])
+    graph = _fold(path, [("b", ["a"])])
+    version = graph.manifest["edges_version"]
+    edge_files = sorted(name for name in os.listdir(path) if name.startswith(("indices", "indptr")))
+    assert edge_files == [f"indices.{version}.npy", f"indptr.{version}.npy"]
+
+
+def test_interrupted_update_leaves_the_committed_graph(tmp_path):
+    path = str(tmp_path)
+    _fold(path, [("a", ["b"]), ("b", ["c"])])
+    before = _edges(LinkGraph(path))
+
+    # An update that wrote its arrays but died before the manifest
+    graph = LinkGraph(path)
+    graph._apply([("a", ["c", "d", "e"]), ("f", ["a"])])
+    reopened = LinkGraph(path)
+    assert reopened.manifest["nodes"] == 3
+    assert _edges(reopened) == before
+
+
+def test_pagerank_favours_linked_nodes(tmp_path):
+    graph = _fold(str(tmp_path), [("a", ["hub"]), ("b", ["hub"]), ("c", ["hub"]), ("hub", ["a"])])
+    rank = graph.compute_pagerank()
+    assert abs(rank.mean() - 1) < 1e-6
+    ranks = graph.ranks(["hub", "a", "b", "missing"])
+    assert ranks[0] == ranks.max()
+    assert ranks[1] > ranks[2]
+    assert ranks[3] == 0
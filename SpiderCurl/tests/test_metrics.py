@@ -0,0 +1,76 @@
+import multiprocessing
+import socket
+import urllib.request
+
+import metrics
+
+
+def _publish_and_exit(channel, pages):
+    metrics.start(channel, "test", interval=3600)
+    metrics.counter("test_pages_total", "", ("outcome",)).inc("stored", amount=pages)
+    metrics.gauge("test_queued", "").set(pages)
+    metrics.stop()
+
+
+def _run(channel, pages) -> int:
+    process = multiprocessing.get_context("fork").Process(target=_publish_and_exit, args=(channel, pages))
+    process.start()
+    process.join()
+    return process.pid
+
+
+def test_released_slots_are_reused_and_counts_kept():
+    channel = metrics.MetricsChannel.create(slots=2)
+    try:
+        for pages in (1, 2, 3, 4, 5):
+            pid = _run(channel, pages)
+            merged = metrics.collect(channel)
+            assert metrics.total(merged, "test_queued") == pages
+            assert channel.release(pid) == 1
+        merged = metrics.collect(channel)
+        # Counters of reaped processes stay in the sum, their gauges leave it
+        assert metrics.total(merged, "test_pages_total") == 15
+        assert metrics.total(merged, "test_queued") == 0
+        assert metrics.total(merged, "spidercurl_processes") == 0
+        assert channel.slots_in_use() == [0]
+    finally:
+        channel.close()
+
+
+def test_allocate_returns_none_when_every_slot_is_owned():
+    channel = metrics.MetricsChannel.create(slots=2)
+    try:
+        assert channel.allocate() == 1
+        assert channel.allocate() == 2
+        assert channel.allocate() is None
+        assert channel.owned([multiprocessing.current_process().pid, 1]) == {multiprocessing.current_process().pid}
+    finally:
+        channel.close()
+
+
+def test_render_sums_histograms_into_prometheus_text():
+    merged = {}
+    metrics._merge(merged, "t_seconds", "histogram", "help", ("stage",), (0.1, 1.0), {("a",): [1, 0, 0, 0.05, 1]})
+    metrics._merge(merged, "t_seconds", "histogram", "help", ("stage",), (0.1, 1.0), {("a",): [0, 1, 1, 2.5, 2]})
+    text = metrics.render(merged)
+    assert 't_seconds_bucket{stage="a",le="0.1"} 1' in text
+    assert 't_seconds_bucket{stage="a",le="+Inf"} 3' in text
+    assert 't_seconds_count{stage="a"} 3' in text
+    assert metrics.total(merged, "t_seconds") == 2.55
+
+
+def test_endpoint_serves_metrics_and_a_taken_port_is_skipped():
+    channel = metrics.MetricsChannel.create(slots=1)
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    server = metrics.serve(channel, port)
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics") as response:
+            assert response.status == 200
+        # A second crawler on the same machine crawls on without its own endpoint
+        assert metrics.serve(channel, port) is None
+    finally:
+        server.shutdown()
+        server.server_close()
+        channel.close()
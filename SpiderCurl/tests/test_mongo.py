@@ -0,0 +1,200 @@
+import time
+from datetime import datetime, timedelta
+
+import pymongo
+import pytest
+
+import frontier
+import mongo
+from models import WebPage
+from seenfilter import ScalableBloomFilter
+
+mongomock = pytest.importorskip("mongomock")
+
+
+@pytest.fixture
+def db():
+    return mongomock.MongoClient()["spidercurl_test"]
+
+
+def _task(db, url):
+    return db["crawlTasks"].find_one({"url": url}, {"_id": 0})
+
+
+def _add_tasks(db, *tasks):
+    db["crawlTasks"].insert_many([dict({"status": "pending", "attempts": 0, "next_attempt_at": None}, **task)
+                                  for task in tasks])
+
+
+def test_claim_takes_due_tasks_by_priority_once(db):
+    _add_tasks(db, {"url": "https://a.example/", "priority": 1.0},
+               {"url": "https://b.example/", "priority": 3.0},
+               {"url": "https://c.example/", "priority": 2.0},
+               {"url": "https://later.example/", "priority": 9.0,
+                "next_attempt_at": datetime.utcnow() + timedelta(hours=1)})
+    claimed = mongo.claim_tasks(db, "crawler-1", limit=2)
+    assert [task["url"] for task in claimed] == ["https://b.example/", "https://c.example/"]
+    assert _task(db, "https://b.example/")["status"] == "in_progress"
+    assert _task(db, "https://b.example/")["lease_owner"] == "crawler-1"
+    # Claimed tasks and tasks in backoff are not handed out again
+    assert [task["url"] for task in mongo.claim_tasks(db, "crawler-2")] == ["https://a.example/"]
+    assert mongo.claim_tasks(db, "crawler-2") == []
+
+
+def test_expired_lease_is_claimed_again(db):
+    _add_tasks(db, {"url": "https://a.example/", "priority": 1.0})
+    mongo.claim_tasks(db, "crawler-1", lease_seconds=-1)
+    assert [task["url"] for task in mongo.claim_tasks(db, "crawler-2")] == ["https://a.example/"]
+    assert mongo.leased_urls(db, "crawler-1") == []
+    assert mongo.leased_urls(db, "crawler-2") == ["https://a.example/"]
+
+
+def test_renewed_lease_is_not_claimed_again(db):
+    _add_tasks(db, {"url": "https://a.example/", "priority": 1.0}, {"url": "https://b.example/", "priority": 1.0})
+    mongo.claim_tasks(db, "crawler-1", lease_seconds=-1)
+    mongo.renew_leases(db, ["https://a.example/"])
+    assert _task(db, "https://a.example/")["lease_expires"] > datetime.utcnow()
+    assert [task["url"] for task in mongo.claim_tasks(db, "crawler-2")] == ["https://b.example/"]
+
+
+def test_released_task_is_pending_without_an_attempt(db):
+    _add_tasks(db, {"url": "https://a.example/", "priority": 1.0})
+    mongo.claim_tasks(db, "crawler-1")
+    mongo.release_tasks(db, ["https://a.example/"])
+    task = _task(db, "https://a.example/")
+    assert task["status"] == "pending" and task["attempts"] == 0
+    assert "lease_owner" not in task and "claim_id" not in task
+    assert mongo.leased_urls(db, "crawler-1") == []
+    assert [task["url"] for task in mongo.claim_tasks(db, "crawler-2")] == ["https://a.example/"]
+
+
+def test_release_leaves_settled_tasks_alone(db):
+    _add_tasks(db, {"url": "https://a.example/", "status": "completed"})
+    mongo.release_tasks(db, ["https://a.example/"])
+    assert _task(db, "https://a.example/")["status"] == "completed"
+
+
+def test_retry_backs_off_then_fails(db):
+    _add_tasks(db, {"url": "https://a.example/", "priority": 1.0})
+    for attempt in range(1, mongo.MAX_ATTEMPTS):
+        mongo.claim_tasks(db, "crawler-1")
+        before = datetime.utcnow()
+        mongo.retry_task(db, "https://a.example/", "HTTP 503")
+        task = _task(db, "https://a.example/")
+        assert (task["status"], task["attempts"], task["error_message"]) == ("pending", attempt, "HTTP 503")
+        assert "lease_owner" not in task
+        backoff = timedelta(seconds=mongo.RETRY_BACKOFF * 2 ** (attempt - 1))
+        assert before + backoff - timedelta(seconds=1) <= task["next_attempt_at"] <= datetime.utcnow() + backoff
+        # Not due again before the backoff is over
+        assert mongo.claim_tasks(db, "crawler-1") == []
+        db["crawlTasks"].update_one({"url": "https://a.example/"}, {"$set": {"next_attempt_at": None}})
+    mongo.claim_tasks(db, "crawler-1")
+    mongo.retry_task(db, "https://a.example/", "HTTP 503")
+    assert _task(db, "https://a.example/")["status"] == "failed"
+
+
+def test_non_retryable_failure_fails_at_once(db):
+    _add_tasks(db, {"url": "https://a.example/", "priority": 1.0})
+    mongo.claim_tasks(db, "crawler-1")
+    mongo.retry_task(db, "https://a.example/", "HTTP 404", retryable=False)
+    task = _task(db, "https://a.example/")
+    assert (task["status"], task["attempts"]) == ("failed", 1)
+    assert mongo.leased_urls(db, "crawler-1") == []
+
+
+def test_status_writer_settles_dropped_pages(db):
+    _add_tasks(db, {"url": "https://a.example/", "priority": 1.0}, {"url": "https://b.example/", "priority": 1.0})
+    mongo.claim_tasks(db, "crawler-1")
+    writer = mongo.StatusWriter(db, batch_size=100, flush_seconds=60)
+    writer.release("https://a.example/")
+    writer.retry("https://b.example/", "Parse error: ValueError")
+    writer.close()
+    assert _task(db, "https://a.example/")["status"] == "pending"
+    assert _task(db, "https://a.example/")["attempts"] == 0
+    assert _task(db, "https://b.example/")["attempts"] == 1
+    assert mongo.leased_urls(db, "crawler-1") == []
+
+
+def _wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def _statuses(db):
+    return {task["url"]: task["status"] for task in db["crawlTasks"].find()}
+
+
+def test_status_writer_flushes_when_the_batch_is_full(db):
+    _add_tasks(db, *({"url": f"https://{i}.example/"} for i in range(3)))
+    writer = mongo.StatusWriter(db, batch_size=2, flush_seconds=60)
+    writer.status("https://0.example/", "completed")
+    time.sleep(0.1)
+    assert set(_statuses(db).values()) == {"pending"}
+    writer.status("https://1.example/", "completed")
+    _wait_for(lambda: _statuses(db)["https://1.example/"] == "completed")
+    assert _statuses(db)["https://0.example/"] == "completed"
+    writer.status("https://2.example/", "skipped")
+    writer.close()
+    assert _statuses(db)["https://2.example/"] == "skipped"
+
+
+def test_status_writer_flushes_after_flush_seconds(db):
+    _add_tasks(db, {"url": "https://a.example/"})
+    writer = mongo.StatusWriter(db, batch_size=100, flush_seconds=0.05)
+    writer.attempt("https://a.example/", "in_progress")
+    _wait_for(lambda: _task(db, "https://a.example/")["attempts"] == 1)
+    writer.close()
+
+
+def test_status_writer_keeps_operations_when_a_write_fails(db, monkeypatch):
+    _add_tasks(db, {"url": "https://a.example/"})
+    writer = mongo.StatusWriter(db, batch_size=100, flush_seconds=60)
+    writer.status("https://a.example/", "completed")
+    collection = type(db["crawlTasks"])
+    bulk_write = collection.bulk_write
+
+    def down(self, *args, **kwargs):
+        raise pymongo.errors.AutoReconnect("connection refused")
+    monkeypatch.setattr(collection, "bulk_write", down)
+    writer.flush()
+    assert _task(db, "https://a.example/")["status"] == "pending"
+    monkeypatch.setattr(collection, "bulk_write", bulk_write)
+    writer.close()
+    assert _task(db, "https://a.example/")["status"] == "completed"
+
+
+def _fetch_and_store(db, seen, url, links):
+    """What the crawler does with a claimed task: store the page, credit its outlinks, drop the task."""
+    [task] = [task for task in mongo.claim_tasks(db, "crawler-1") if task["url"] == url]
+    page = WebPage(url=url, title=None, meta_description=None, text_content=None, extracted_urls=links,
+                   cash=task.get("cash"))
+    mongo.insert_many_webpages(db, [page])
+    credits = frontier.credit_outlinks([page])
+    mongo.create_many_tasks(db, list(credits), seen, credits)
+    mongo.remove_tasks(db, [url])
+
+
+def _task_cash(db):
+    """Cash the tasks hold, not paid out yet."""
+    return sum(task.get("cash") or 0.0 for task in db["crawlTasks"].find())
+
+
+def test_revisit_does_not_pay_cash_out_again(db):
+    seen = ScalableBloomFilter(capacity=100)
+    links = ["https://b.example/", "https://c.example/"]
+    mongo.seed_tasks(db, ["https://a.example/"])
+    seen.add("https://a.example/")
+    _fetch_and_store(db, seen, "https://a.example/", links)
+    assert _task_cash(db) == pytest.approx(frontier.SEED_CASH)
+
+    page = db["webpages"].find_one({"url": "https://a.example/"})
+    mongo.queue_revisits(db, [page])
+    revisit_task = _task(db, "https://a.example/")
+    assert revisit_task["cash"] == 0.0
+    # Ranked on the cash the page has paid out, above a URL nothing has paid anything to
+    assert revisit_task["priority"] > frontier.priority(0.0, 0, 0, 0)
+    _fetch_and_store(db, seen, "https://a.example/", links)
+    assert _task_cash(db) == pytest.approx(frontier.SEED_CASH)
+    assert db["webpages"].find_one({"url": "https://a.example/"})["cash"] == pytest.approx(frontier.SEED_CASH)
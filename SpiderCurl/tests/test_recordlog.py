@@ -0,0 +1,57 @@
+import os
+
+from recordlog import RecordLog
+
+
+def test_append_and_read_in_order(tmp_path):
+    log = RecordLog(str(tmp_path))
+    log.append([("a", 1), ("b", 2)])
+    log.append([("c", 3)])
+    records, position = log.read((0, 0), 10)
+    assert records == [("a", 1), ("b", 2), ("c", 3)]
+    log.append([("d", 4)])
+    records, _ = log.read(position, 10)
+    assert records == [("d", 4)]
+
+
+def test_read_stops_at_max_records_and_resumes(tmp_path):
+    log = RecordLog(str(tmp_path))
+    log.append(list(range(5)))
+    records, position = log.read((0, 0), 3)
+    assert records == [0, 1, 2]
+    records, position = log.read(position, 3)
+    assert records == [3, 4]
+    assert log.read(position, 3)[0] == []
+
+
+def test_rotates_files_and_trims_read_ones(tmp_path):
+    log = RecordLog(str(tmp_path), max_bytes=1)
+    log.append(["first"])
+    log.append(["second"])
+    log.append(["third"])
+    assert len(log._numbers()) == 3
+    records, position = log.read((0, 0), 2)
+    assert records == ["first", "second"]
+    log.trim(position)
+    assert log._numbers() == [1, 2]
+    assert log.read(position, 10)[0] == ["third"]
+
+
+def test_each_writer_session_starts_a_new_file(tmp_path):
+    first = RecordLog(str(tmp_path))
+    first.append(["a"])
+    first.close()
+    second = RecordLog(str(tmp_path))
+    second.append(["b"])
+    assert len(second._numbers()) == 2
+    assert second.read((0, 0), 10)[0] == ["a", "b"]
+
+
+def test_torn_record_is_skipped(tmp_path):
+    log = RecordLog(str(tmp_path))
+    log.append(["whole"])
+    log.close()
+    with open(os.path.join(str(tmp_path), "00000000.log"), "ab") as f:
+        f.write(b"\xff\x00\x00\x00partial")
+    log.append(["next"])
+    assert log.read((0, 0), 10)[0] == ["whole", "next"]
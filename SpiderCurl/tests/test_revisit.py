@@ -0,0 +1,79 @@
+import math
+from datetime import datetime, timedelta
+
+import pytest
+
+import revisit
+from models import WebPage
+from revisit import change_rate, content_hash, freshness_update, pick_revisits, revisit_interval, staleness
+
+DAY = 86400
+START = datetime(2024, 1, 1)
+
+
+def _fetch(text, not_modified=False):
+    return WebPage(url="https://example.com/", title=None, meta_description=None, text_content=text,
+                   content_hash=content_hash(text), not_modified=not_modified)
+
+
+def test_content_hash_fits_int64():
+    hashes = [content_hash(f"page {i}") for i in range(1000)]
+    assert all(-(1 << 63) <= value < (1 << 63) for value in hashes)
+    assert any(value < 0 for value in hashes)
+    assert content_hash("same") == content_hash("same")
+    assert content_hash(None) is None
+
+
+def test_change_rate_estimator():
+    # Changed at every one of 10 daily checks: more than once a day, above the naive 10 / 10 days
+    assert change_rate(10, 10, 10 * DAY) == pytest.approx(math.log(21) / DAY)
+    assert change_rate(10, 10, 10 * DAY) > 1 / DAY
+    # Never changed: low but not zero
+    assert 0 < change_rate(10, 0, 10 * DAY) < change_rate(10, 1, 10 * DAY)
+    assert change_rate(0, 0, 0) == revisit.DEFAULT_CHANGE_RATE
+
+
+def test_revisit_interval_meets_the_target_staleness():
+    rate = 1 / DAY
+    interval = revisit_interval(rate)
+    assert staleness(rate, interval) == pytest.approx(revisit.TARGET_STALENESS)
+    assert revisit_interval(1.0) == revisit.MIN_REVISIT
+    assert revisit_interval(0.0) == revisit.MAX_REVISIT
+
+
+def test_freshness_counts_checks_and_changes():
+    fields = freshness_update(None, _fetch("v1"), START)
+    assert (fields["checks"], fields["changes"]) == (0, 0)
+    assert fields["next_revisit_at"] == START + timedelta(seconds=revisit_interval(revisit.DEFAULT_CHANGE_RATE))
+
+    stored = dict(fields, content_hash=content_hash("v1"))
+    fields = freshness_update(stored, _fetch("v1"), START + timedelta(days=1))
+    assert (fields["checks"], fields["changes"]) == (1, 0)
+    fields = freshness_update(dict(fields, content_hash=content_hash("v1")), _fetch("v2"), START + timedelta(days=2))
+    assert (fields["checks"], fields["changes"]) == (2, 1)
+    # A 304 is a check that found no change
+    fields = freshness_update(dict(fields, content_hash=content_hash("v2")), _fetch(None, not_modified=True),
+                              START + timedelta(days=3))
+    assert (fields["checks"], fields["changes"]) == (3, 1)
+    assert fields["first_checked"] == START
+    assert fields["change_rate"] == pytest.approx(change_rate(3, 1, 3 * DAY))
+
+
+def test_often_changing_pages_are_revisited_sooner():
+    stable = frequent = freshness_update(None, _fetch("v0"), START)
+    for day in range(1, 6):
+        now = START + timedelta(days=day)
+        stable = freshness_update(dict(stable, content_hash=content_hash("v0")), _fetch("v0"), now)
+        frequent = freshness_update(dict(frequent, content_hash=content_hash(f"v{day - 1}")), _fetch(f"v{day}"), now)
+    assert frequent["next_revisit_at"] < stable["next_revisit_at"]
+
+
+def test_pick_revisits_prefers_likely_changed_pages():
+    now = START + timedelta(days=10)
+    pages = [
+        {"url": "slow", "change_rate": 1 / (30 * DAY), "last_checked": START},
+        {"url": "fast", "change_rate": 1 / DAY, "last_checked": now - timedelta(days=2)},
+        {"url": "unknown", "change_rate": None, "last_checked": START},
+        {"url": "just_checked", "change_rate": 1 / DAY, "last_checked": now},
+    ]
+    assert [page["url"] for page in pick_revisits(pages, now, 3)] == ["fast", "unknown", "slow"]
@@ -0,0 +1,60 @@
+from robots import RobotsRules, parse, rules_from_response
+
+ROBOTS = """
+User-agent: *
+Disallow: /private
+Crawl-delay: 5
+
+User-agent: Spider
+Disallow: /
+
+User-agent: spidercurl/2.0
+User-agent: OtherBot
+Disallow: /search
+Allow: /search/about
+Crawl-delay: 2
+"""
+
+
+def test_group_is_chosen_by_exact_product_token():
+    rules = parse(ROBOTS, "SpiderCurl")
+    assert not rules.allowed("https://example.com/search?q=x")
+    assert rules.allowed("https://example.com/search/about")
+    assert rules.allowed("https://example.com/private")
+    assert rules.crawl_delay == 2
+
+
+def test_token_is_matched_case_insensitively_and_without_version():
+    assert not parse(ROBOTS, "SPIDERCURL/3.1 (+https://example.com/bot)").allowed("https://example.com/search")
+    assert not parse("User-agent: SPIDERCURL\nDisallow: /a\n", "spidercurl").allowed("https://example.com/a")
+
+
+def test_substring_of_the_token_does_not_match():
+    # "Spider" is a different crawler; SpiderCurl falls back to * only if nothing names it
+    rules = parse("User-agent: Spider\nDisallow: /\n\nUser-agent: *\nDisallow: /private\n", "SpiderCurl")
+    assert rules.allowed("https://example.com/page")
+    assert not rules.allowed("https://example.com/private")
+
+
+def test_star_group_is_the_fallback():
+    rules = parse(ROBOTS, "UnknownBot")
+    assert not rules.allowed("https://example.com/private/x")
+    assert rules.allowed("https://example.com/search")
+    assert rules.crawl_delay == 5
+
+
+def test_longest_match_wins_and_allow_wins_ties():
+    rules = RobotsRules([("/a", False), ("/a/b", True), ("/c", False), ("/c", True), ("/*.pdf$", False)])
+    assert not rules.allowed("https://example.com/a/x")
+    assert rules.allowed("https://example.com/a/b/x")
+    assert rules.allowed("https://example.com/c")
+    assert not rules.allowed("https://example.com/doc.pdf")
+    assert rules.allowed("https://example.com/doc.pdf?download=1")
+    assert rules.allowed("https://example.com/robots.txt")
+
+
+def test_rules_from_response_status():
+    assert rules_from_response(404, None)[0].allowed("https://example.com/anything")
+    unreachable, _ = rules_from_response(503, None)
+    assert not unreachable.available
+    assert rules_from_response(None, None)[0].available is False
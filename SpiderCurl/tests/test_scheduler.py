@@ -0,0 +1,87 @@
+from scheduler import HostScheduler, shard_for_host
+
+
+def _scheduler(host_delays=None, max_backoff=60.0):
+    return HostScheduler(default_delay=2.0, host_delays=host_delays or {}, max_backoff=max_backoff)
+
+
+def test_one_fetch_per_host_in_flight():
+    scheduler = _scheduler()
+    scheduler.add("https://a.example/1")
+    scheduler.add("https://a.example/2")
+    assert scheduler.next_url(now=0.0) == ("https://a.example/1", None)
+    # a.example is being fetched and nothing else is queued
+    assert scheduler.next_url(now=100.0) == (None, None)
+    scheduler.done("https://a.example/1", 200, now=10.0)
+    assert scheduler.next_url(now=11.0) == (None, 1.0)
+    assert scheduler.next_url(now=12.0) == ("https://a.example/2", None)
+    assert len(scheduler) == 0
+
+
+def test_other_hosts_fill_the_wait():
+    scheduler = _scheduler()
+    for url in ["https://a.example/1", "https://a.example/2", "https://b.example/1"]:
+        scheduler.add(url)
+    assert scheduler.next_url(now=0.0)[0] == "https://a.example/1"
+    assert scheduler.next_url(now=0.0)[0] == "https://b.example/1"
+    scheduler.done("https://a.example/1", 200, now=0.5)
+    assert scheduler.pending_urls() == ["https://a.example/2"]
+
+
+def test_most_overdue_host_goes_first():
+    scheduler = _scheduler(host_delays={"slow.example": 10.0})
+    for url in ["https://slow.example/1", "https://fast.example/1"]:
+        scheduler.add(url)
+        scheduler.done(scheduler.next_url(now=0.0)[0], 200, now=0.0)
+    scheduler.add("https://slow.example/2")
+    scheduler.add("https://fast.example/2")
+    assert scheduler.next_url(now=5.0)[0] == "https://fast.example/2"
+    assert scheduler.next_url(now=5.0) == (None, 5.0)
+
+
+def test_backoff_doubles_and_recovers():
+    scheduler = _scheduler()
+    url = "https://a.example/"
+    scheduler.add(url)
+    scheduler.next_url(now=0.0)
+    scheduler.done(url, 429, now=0.0)
+    assert scheduler.delay_for("a.example") == 4.0
+    scheduler.add(url)
+    scheduler.next_url(now=4.0)
+    scheduler.done(url, 503, now=4.0)
+    assert scheduler.delay_for("a.example") == 8.0
+    scheduler.add(url)
+    scheduler.next_url(now=12.0)
+    scheduler.done(url, 200, now=12.0)
+    assert scheduler.delay_for("a.example") == 4.0
+
+
+def test_backoff_is_capped_and_retry_after_honoured():
+    scheduler = _scheduler(max_backoff=10.0)
+    url = "https://a.example/"
+    for _ in range(5):
+        scheduler.add(url)
+        scheduler.next_url(now=1000.0)
+        scheduler.done(url, 429, now=0.0)
+    assert scheduler.delay_for("a.example") == 10.0
+    scheduler.add(url)
+    scheduler.next_url(now=1000.0)
+    scheduler.done(url, 503, retry_after=7.0, now=1000.0)
+    assert scheduler.next_url(now=1000.0) == (None, None)
+    scheduler.add(url)
+    assert scheduler.next_url(now=1005.0) == (None, 5.0)
+
+
+def test_robots_delay_only_lengthens():
+    scheduler = _scheduler()
+    scheduler.set_robots_delay("a.example", 5.0)
+    scheduler.set_robots_delay("b.example", 0.1)
+    assert scheduler.delay_for("a.example") == 5.0
+    assert scheduler.delay_for("b.example") == 2.0
+
+
+def test_shard_is_stable_per_host():
+    hosts = [f"host{i}.example" for i in range(200)]
+    shards = [shard_for_host(host, 6) for host in hosts]
+    assert shards == [shard_for_host(host, 6) for host in hosts]
+    assert set(shards) == set(range(6))
@@ -0,0 +1,134 @@
+import math
+import os
+import random
+
+import pytest
+
+from models import WebPage
+from searchindex import (BM25_B, BM25_K1, IndexLog, IndexSearcher, IndexWriter, SegmentWriter, document_terms,
+                         tokenize)
+
+
+def _page(url, text):
+    return WebPage(url=url, title=None, meta_description=None, text_content=text)
+
+
+def test_removed_page_stops_matching(tmp_path):
+    path = str(tmp_path)
+    log = IndexLog(os.path.join(path, "log"))
+    log.append([_page("https://a.example/", "apple banana"), _page("https://b.example/", "apple cherry")])
+    writer = IndexWriter(path)
+    writer.index_log(log)
+    assert {url for _, url in IndexSearcher(path).search("apple")} == {"https://a.example/", "https://b.example/"}
+
+    # Stored as a near-duplicate: the old postings must stop matching
+    log.remove(["https://b.example/"])
+    writer.index_log(log)
+    searcher = IndexSearcher(path)
+    assert [url for _, url in searcher.search("apple")] == ["https://a.example/"]
+    assert searcher.search("cherry") == []
+    assert searcher.doc_count == 1
+
+
+def test_last_record_of_a_url_wins_within_a_batch(tmp_path):
+    path = str(tmp_path)
+    log = IndexLog(os.path.join(path, "log"))
+    log.append([_page("https://a.example/", "apple")])
+    log.remove(["https://a.example/"])
+    log.append([_page("https://a.example/", "banana")])
+    IndexWriter(path).index_log(log)
+    searcher = IndexSearcher(path)
+    assert searcher.search("apple") == []
+    assert [url for _, url in searcher.search("banana")] == ["https://a.example/"]
+
+
+WORDS = ["apple", "banana", "cherry", "date", "elder", "fig", "grape", "honeydew", "kiwi", "lemon",
+         "mango", "nectarine", "olive", "papaya", "quince", "raspberry"]
+
+
+def _random_fields(rng):
+    # Skewed word frequencies give terms with long and short postings lists
+    text = " ".join(rng.choices(WORDS, weights=range(len(WORDS), 0, -1), k=rng.randint(1, 40)))
+    title = " ".join(rng.choices(WORDS, k=rng.randint(0, 3)))
+    return {"title": title, "meta_description": None, "text_content": text}
+
+
+def _brute_force(stored, live, query, k):
+    """BM25 of every live document, with df over every stored copy as the searcher counts it."""
+    terms = list(dict.fromkeys(tokenize(query)))
+    docs = {url: document_terms(fields) for url, fields in live.items()}
+    stored_terms = [document_terms(fields)[0] for fields in stored]
+    dfs = {term: min(sum(term in counts for counts in stored_terms), len(docs)) for term in terms}
+    avg_length = sum(length for _, length in docs.values()) / len(docs)
+    scores = []
+    for url, (counts, length) in docs.items():
+        score = 0.0
+        for term in terms:
+            if term in counts:
+                idf = math.log(1 + (len(docs) - dfs[term] + 0.5) / (dfs[term] + 0.5))
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * length / avg_length)
+                score += idf * counts[term] * (BM25_K1 + 1) / (counts[term] + norm)
+        if score > 0:
+            scores.append((score, url))
+    return sorted(scores, reverse=True)[:k]
+
+
+def _assert_same_results(results, expected):
+    assert [score for score, _ in results] == pytest.approx([score for score, _ in expected])
+    # URLs must agree except among documents tied with the last score kept
+    cutoff = expected[-1][0] + 1e-9 if expected else 0
+    assert {url for score, url in results if score > cutoff} == {url for score, url in expected if score > cutoff}
+
+
+QUERIES = ["apple", "quince raspberry", "apple banana cherry", "papaya olive apple", "kiwi kiwi lemon", "durian"]
+
+
+def test_wand_matches_brute_force_bm25(tmp_path):
+    rng = random.Random(7)
+    path = str(tmp_path)
+    writer = IndexWriter(path, merge_factor=10)
+    stored = []
+    live = {}
+    # Segments of more than one block, so WAND skips whole blocks
+    for segment in range(3):
+        segment_writer = SegmentWriter()
+        for i in range(300):
+            url = f"https://example.com/{segment}/{i}"
+            fields = _random_fields(rng)
+            segment_writer.add(url, fields)
+            stored.append(fields)
+            live[url] = fields
+        writer.add(segment_writer)
+    searcher = IndexSearcher(path)
+    for query in QUERIES:
+        for k in (1, 10, 1000):
+            _assert_same_results(searcher.search(query, k), _brute_force(stored, live, query, k))
+
+
+def test_wand_skips_superseded_copies(tmp_path):
+    rng = random.Random(11)
+    path = str(tmp_path)
+    writer = IndexWriter(path, merge_factor=10)
+    stored = []
+    live = {}
+    for _ in range(3):
+        # Later rounds rewrite some of the earlier pages, tombstoning their old copies
+        segment_writer = SegmentWriter()
+        for i in rng.sample(range(400), 200):
+            url = f"https://example.com/{i}"
+            fields = _random_fields(rng)
+            segment_writer.add(url, fields)
+            stored.append(fields)
+            live[url] = fields
+        writer.add(segment_writer)
+    searcher = IndexSearcher(path)
+    assert searcher.doc_count == len(live)
+    for query in QUERIES:
+        _assert_same_results(searcher.search(query, 20), _brute_force(stored, live, query, 20))
+
+    # Merging drops the tombstoned copies, and their document frequencies with them
+    writer.merge_factor = 3
+    assert writer.merge() == 1
+    searcher = IndexSearcher(path)
+    for query in QUERIES:
+        _assert_same_results(searcher.search(query, 20), _brute_force(list(live.values()), live, query, 20))
@@ -0,0 +1,42 @@
+from seenfilter import ScalableBloomFilter, backfill
+
+
+def test_added_urls_are_seen_and_reported_once():
+    seen = ScalableBloomFilter(capacity=100)
+    assert seen.add_many(["https://a.example/1", "https://a.example/2", "https://a.example/1"]) == [
+        "https://a.example/1", "https://a.example/2"]
+    assert "https://a.example/1" in seen
+    assert not seen.add("https://a.example/2")
+    assert seen.missing(["https://a.example/2", "https://a.example/3", "https://a.example/3"]) == ["https://a.example/3"]
+    assert len(seen) == 2
+
+
+def test_grows_past_its_capacity_within_the_error_rate():
+    seen = ScalableBloomFilter(capacity=1000, error_rate=0.01)
+    urls = [f"https://example.com/page/{i}" for i in range(10000)]
+    seen.add_many(urls)
+    assert len(seen.slices) > 1
+    assert all(url in seen for url in urls)
+    false_positives = sum(f"https://example.org/other/{i}" in seen for i in range(10000))
+    assert false_positives < 10000 * 0.01
+
+
+def test_persists_and_is_shared_through_its_files(tmp_path):
+    first = ScalableBloomFilter(str(tmp_path), capacity=100)
+    second = ScalableBloomFilter(str(tmp_path), capacity=100)
+    first.add_many([f"https://example.com/{i}" for i in range(500)])
+    assert second.missing(["https://example.com/499", "https://example.com/new"]) == ["https://example.com/new"]
+    first.close()
+    reopened = ScalableBloomFilter(str(tmp_path), capacity=100)
+    assert "https://example.com/0" in reopened
+    assert len(reopened) == 500
+
+
+def test_backfill_loads_stored_urls_once(tmp_path):
+    seen = ScalableBloomFilter(str(tmp_path), capacity=100)
+    assert not seen.backfilled
+    assert backfill(seen, [["https://example.com/a", "https://example.com/b"], ["https://example.com/a"]]) == 2
+    assert "https://example.com/b" in seen
+    reopened = ScalableBloomFilter(str(tmp_path), capacity=100)
+    assert reopened.backfilled
+    assert backfill(reopened, [["https://example.com/c"]]) == 0
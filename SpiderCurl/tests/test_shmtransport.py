@@ -0,0 +1,92 @@
+import multiprocessing
+
+import pytest
+
+import shmtransport
+from models import webpageQueueItem
+from shmtransport import PageChannel
+
+
+@pytest.fixture
+def channel():
+    channel, slab = PageChannel.create(slots=2)
+    yield channel
+    slab.close()
+
+
+def _store_and_die(channel):
+    channel.store(webpageQueueItem(url="https://example.com/"), b"<p>lost</p>", "utf-8")
+
+
+def test_store_and_load_round_trip_frees_the_slot(channel):
+    item = channel.store(webpageQueueItem(url="https://example.com/"), "<p>café</p>".encode("utf-8"), "utf-8")
+    assert item.slot is not None and item.webpage_content is None
+    channel.queued(item)
+    assert channel.load(item) == "<p>café</p>"
+    assert list(channel.owners) == [0, 0]
+    assert channel.reclaim(multiprocessing.current_process().pid) == 0
+
+
+def test_without_a_free_slot_the_body_goes_inline(channel, monkeypatch):
+    monkeypatch.setattr(shmtransport, "STORE_TIMEOUT", 0.05)
+    held = [channel.store(webpageQueueItem(url=f"https://example.com/{i}"), b"x", "utf-8") for i in range(2)]
+    item = channel.store(webpageQueueItem(url="https://example.com/inline"), b"<p>inline</p>", "utf-8")
+    assert item.slot is None
+    assert channel.load(item) == "<p>inline</p>"
+    for other in held:
+        channel.discard(other)
+    assert channel.store(webpageQueueItem(url="https://example.com/again"), b"x", "utf-8").slot is not None
+
+
+def test_slots_of_a_dead_fetcher_are_reclaimed(channel):
+    process = multiprocessing.get_context("fork").Process(target=_store_and_die, args=(channel,))
+    process.start()
+    process.join()
+    assert channel.reclaim(process.pid) == 1
+    assert list(channel.owners) == [0, 0]
+
+
+def test_a_reclaimed_slot_is_not_read_by_the_parser(channel):
+    item = channel.store(webpageQueueItem(url="https://example.com/"), b"<p>old</p>", "utf-8")
+    # The fetcher died after queueing the item but before marking it queued
+    assert channel.reclaim(multiprocessing.current_process().pid) == 1
+    reused = channel.store(webpageQueueItem(url="https://example.com/new"), b"<p>new</p>", "utf-8")
+    assert channel.load(item) is None
+    assert channel.load(reused) == "<p>new</p>"
+
+
+def test_queued_slots_survive_their_fetcher(channel):
+    item = channel.store(webpageQueueItem(url="https://example.com/"), b"<p>kept</p>", "utf-8")
+    channel.queued(item)
+    assert channel.reclaim(multiprocessing.current_process().pid) == 0
+    assert channel.load(item) == "<p>kept</p>"
+
+
+def test_slab_is_cut_to_the_free_space_of_dev_shm(monkeypatch):
+    monkeypatch.setattr(shmtransport, "_shm_free_bytes", lambda: 5 * shmtransport.SLOT_BYTES)
+    channel, slab = PageChannel.create(slots=128)
+    try:
+        assert slab.slots == 2
+    finally:
+        slab.close()
+    monkeypatch.setattr(shmtransport, "_shm_free_bytes", lambda: shmtransport.SLOT_BYTES)
+    channel, slab = PageChannel.create(slots=128)
+    assert slab is None and channel.slab_name is None
+
+
+def test_slot_of_a_page_whose_parser_died_is_swept(channel):
+    lost = channel.store(webpageQueueItem(url="https://example.com/lost"), b"<p>lost</p>", "utf-8")
+    channel.queued(lost)
+    # Its parser died after taking it off the queue: nothing owns the slot, so no exit reclaims it
+    assert channel.reclaim(multiprocessing.current_process().pid) == 0
+    for i in range(2):
+        channel.load(webpageQueueItem(url=f"https://example.com/inline{i}", webpage_content="<p>x</p>"))
+    waiting = channel.store(webpageQueueItem(url="https://example.com/waiting"), b"<p>waiting</p>", "utf-8")
+    channel.queued(waiting)
+    assert channel.sweep(stale_after=2) == 0
+    channel.load(webpageQueueItem(url="https://example.com/inline2", webpage_content="<p>x</p>"))
+    # Three items taken since the lost one was queued, with at most two ahead of it: it has left the queue
+    assert channel.sweep(stale_after=2) == 1
+    assert list(channel.owners) == [0, shmtransport.QUEUED]
+    assert channel.load(waiting) == "<p>waiting</p>"
+    assert channel.load(lost) is None
@@ -0,0 +1,57 @@
+import random
+
+from simhash import SimHashIndex, distance, fingerprint
+
+random.seed(7)
+VOCABULARY = [f"word{i}" for i in range(2000)]
+TEXT = " ".join(random.choice(VOCABULARY) for _ in range(400))
+
+
+def test_short_texts_get_no_fingerprint():
+    assert fingerprint(None) is None
+    assert fingerprint("only a few words here") is None
+
+
+def test_fingerprint_fits_a_signed_int64_and_ignores_case_and_punctuation():
+    value = fingerprint(TEXT)
+    assert -(1 << 63) <= value < 1 << 63
+    assert fingerprint(TEXT.upper().replace(" ", ", ")) == value
+
+
+def test_small_edits_stay_near_and_other_texts_far():
+    words = TEXT.split()
+    words[200] = "changed"
+    edited = fingerprint(" ".join(words))
+    other = fingerprint(" ".join(random.choice(VOCABULARY) for _ in range(400)))
+    assert distance(fingerprint(TEXT), edited) <= 3
+    assert distance(fingerprint(TEXT), other) > 10
+
+
+def test_index_finds_fingerprints_within_the_distance():
+    index = SimHashIndex(max_distance=3)
+    index.add("https://a.example/", 0b1011 << 40)
+    assert index.find((0b1011 << 40) ^ 0b111) == "https://a.example/"
+    assert index.find((0b1011 << 40) ^ 0b1111) is None
+    assert index.find(0b1011 << 40, exclude="https://a.example/") is None
+
+
+def test_index_matches_a_brute_force_scan():
+    index = SimHashIndex(max_distance=3)
+    stored = {f"https://example.com/{i}": random.getrandbits(64) - (1 << 63) for i in range(300)}
+    for url, value in stored.items():
+        index.add(url, value)
+    for value in list(stored.values())[:100]:
+        probe = value ^ (1 << random.randrange(64)) ^ (1 << random.randrange(64))
+        found = index.find(probe)
+        assert found is not None and distance(stored[found], probe) <= 3
+
+
+def test_remove_and_replace():
+    index = SimHashIndex(max_distance=3)
+    index.add("https://a.example/", 0)
+    index.add("https://a.example/", -1)
+    assert len(index) == 1
+    assert index.find(0) is None
+    index.remove("https://a.example/")
+    assert index.find(-1) is None
+    assert not any(index.tables)
@@ -0,0 +1,81 @@
+import os
+
+from supervisor import crawler_lock
+
+
+def test_crawler_lock_is_held_by_one_holder_at_a_time(tmp_path):
+    path = os.path.join(str(tmp_path), "crawler.lock")
+    held = crawler_lock(path)
+    assert held is not None
+    assert crawler_lock(path) is None
+    held.close()
+    again = crawler_lock(path)
+    assert again is not None
+    again.close()
+
+
+def _exit():
+    pass
+
+
+def test_exited_process_is_reaped_once_before_its_restart(monkeypatch):
+    import supervisor
+
+    monkeypatch.setattr(supervisor, "RESTART_BACKOFF", 0.0)
+    reaped = []
+    processes = supervisor.Supervisor(on_exit=reaped.append)
+    name = processes.add("worker", _exit, ())
+    first = processes.children[name].process
+    first.join()
+    processes.check()
+    processes.check()
+    assert reaped == [first.pid]
+    processes.check()
+    second = processes.children[name].process
+    assert second is not first
+    second.join()
+    processes.draining = True
+    processes.check()
+    assert reaped == [first.pid, second.pid]
+    assert name not in processes.children
+
+
+def _wait():
+    import time
+    time.sleep(5)
+
+
+def test_pids_leaves_out_processes_younger_than_min_age():
+    import supervisor
+
+    processes = supervisor.Supervisor()
+    name = processes.add("worker", _wait, ())
+    pid = processes.children[name].process.pid
+    assert processes.pids() == [pid]
+    assert processes.pids(min_age=60.0) == []
+    processes.retire(name)
+    processes.children[name].process.terminate()
+    processes.children[name].process.join()
+
+
+def _crash():
+    raise SystemExit(1)
+
+
+def test_crashed_process_is_reaped_before_it_is_restarted(monkeypatch):
+    import supervisor
+
+    monkeypatch.setattr(supervisor, "RESTART_BACKOFF", 0.0)
+    events = []
+    processes = supervisor.Supervisor(on_exit=lambda pid: events.append(("reaped", pid)))
+    name = processes.add("worker", _crash, ())
+    original_spawn = processes._spawn
+    monkeypatch.setattr(processes, "_spawn", lambda child: (events.append(("spawned", None)), original_spawn(child)))
+    first = processes.children[name].process
+    first.join()
+    processes.check()
+    processes.check()
+    assert events[:2] == [("reaped", first.pid), ("spawned", None)]
+    processes.draining = True
+    processes.children[name].process.join()
+    processes.check()
@@ -0,0 +1,54 @@
+import os
+import signal
+
+import pytest
+
+import tracing
+
+
+def test_sampled_trace_records_its_events(monkeypatch):
+    monkeypatch.setattr(tracing, "SAMPLE_RATE", 1.0)
+    trace = tracing.new_trace()
+    tracing.mark(trace, "dequeue")
+    tracing.mark(trace, "fetch_start")
+    assert [event for event, _ in trace] == ["enqueue", "dequeue", "fetch_start"]
+    assert trace[0][1] <= trace[1][1] <= trace[2][1]
+
+
+def test_unsampled_task_has_no_trace(monkeypatch):
+    monkeypatch.setattr(tracing, "SAMPLE_RATE", 0.0)
+    assert tracing.new_trace() is None
+    tracing.mark(None, "dequeue")
+
+
+def test_stored_traces_are_reported_per_stage(tmp_path):
+    log = tracing.TraceLog(str(tmp_path))
+    log.append([("https://a.example/", [("enqueue", 0.0), ("dequeue", 1.0), ("fetch_start", 4.0), ("fetch_end", 5.0)])])
+    # A 304 never reaches the parser: its parse stages are missing, not zero
+    log.append([("https://b.example/", [("enqueue", 0.0), ("dequeue", 1.0), ("fetch_start", 1.0), ("fetch_end", 2.0),
+                                       ("batched", 3.0)])])
+    traces = log.read_all()
+    assert [url for url, _ in traces] == ["https://a.example/", "https://b.example/"]
+    assert tracing.stage_times(traces[0][1]) == {"fetch queue": 1.0, "host scheduler (politeness)": 3.0, "fetch_url": 1.0}
+    assert "parse" not in tracing.stage_times(traces[1][1])
+    report = tracing.report(traces)
+    assert report.startswith("2 traced pages")
+    assert "host scheduler (politeness)" in report and "page upsert" not in report
+    assert tracing.report([]) == "No traces yet"
+
+
+@pytest.mark.skipif(not hasattr(signal, "SIGUSR1"), reason="no SIGUSR1 on this platform")
+def test_sigusr1_starts_and_stops_the_profiler(tmp_path, monkeypatch):
+    monkeypatch.setattr(tracing, "PROFILE_PATH", str(tmp_path))
+    previous = signal.getsignal(signal.SIGUSR1)
+    try:
+        tracing.install_profiler()
+        os.kill(os.getpid(), signal.SIGUSR1)
+        assert tracing._profiler is not None
+        sum(range(1000))
+        os.kill(os.getpid(), signal.SIGUSR1)
+        assert tracing._profiler is None
+    finally:
+        signal.signal(signal.SIGUSR1, previous)
+    [profile] = os.listdir(tmp_path)
+    assert profile.endswith(".prof") and os.path.getsize(tmp_path / profile) > 0
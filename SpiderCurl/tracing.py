@@ -0,0 +1,134 @@
+# Sampled per-URL timelines through the crawl pipeline, and a cProfile switch for any process
+import argparse
+import cProfile
+import multiprocessing
+import os
+import random
+import signal
+import time
+from collections import defaultdict
+from typing import List, Optional
+
+import toml
+
+from recordlog import RecordLog
+
+config = toml.load("config.toml")
+
+SAMPLE_RATE = config.get("trace_sample_rate", 0.001)  # Fraction of tasks traced; 0 disables tracing
+TRACE_PATH = config.get("trace_path", "data/traces")
+PROFILE_PATH = config.get("profile_path", "data/profiles")
+
+# Events in pipeline order; the stage between two events is named after the later one's wait
+EVENTS = ("enqueue", "dequeue", "fetch_start", "fetch_end", "handoff", "parse_start", "parse_end", "batched", "persisted")
+STAGES = {
+    ("enqueue", "dequeue"): "fetch queue",
+    ("dequeue", "fetch_start"): "host scheduler (politeness)",
+    ("fetch_start", "fetch_end"): "fetch_url",
+    ("fetch_end", "handoff"): "body to shared memory",
+    ("handoff", "parse_start"): "processing queue",
+    ("parse_start", "parse_end"): "parse",
+    ("parse_end", "batched"): "webpage queue and batching",
+    ("batched", "persisted"): "page upsert",
+}
+
+
+def new_trace() -> Optional[list]:
+    """A trace for a task about to be queued, or None if the task is not sampled."""
+    if SAMPLE_RATE and random.random() < SAMPLE_RATE:
+        return [("enqueue", time.time())]
+    return None
+
+
+def mark(trace: Optional[list], event: str):
+    """Appends an event to a sampled trace. Wall-clock time, so events from different processes line up."""
+    if trace is not None:
+        trace.append((event, time.time()))
+
+
+class TraceLog(RecordLog):
+    """Finished traces, (url, [(event, time), ...]), appended by the database manager once a page is stored."""
+
+    def __init__(self, path: str = TRACE_PATH, max_bytes: int = 16 * 1024 * 1024):
+        super().__init__(path, max_bytes)
+
+    def read_all(self) -> List[tuple]:
+        records = []
+        position = (0, 0)
+        while True:
+            batch, position = self.read(position, 100000)
+            if not batch:
+                return records
+            records.extend(batch)
+
+
+def stage_times(trace) -> dict:
+    """Seconds per stage of one trace; stages whose events are missing (a 304, a retry) are left out."""
+    times = dict(trace)
+    return {stage: times[end] - times[start] for (start, end), stage in STAGES.items() if start in times and end in times}
+
+
+def report(traces: List[tuple]) -> str:
+    durations = defaultdict(list)
+    totals = []
+    for _, trace in traces:
+        for stage, seconds in stage_times(trace).items():
+            durations[stage].append(seconds)
+        totals.append(trace[-1][1] - trace[0][1])
+    if not totals:
+        return "No traces yet"
+    total_time = sum(sum(values) for values in durations.values())
+    lines = [f"{len(traces)} traced pages, end to end p50 {sorted(totals)[len(totals) // 2]:.2f}s",
+             f"{'stage':<30}{'pages':>8}{'p50 s':>10}{'p90 s':>10}{'share':>8}"]
+    for stage in STAGES.values():
+        values = sorted(durations.get(stage, []))
+        if values:
+            lines.append(f"{stage:<30}{len(values):>8}{values[len(values) // 2]:>10.3f}"
+                         f"{values[min(len(values) - 1, int(len(values) * 0.9))]:>10.3f}{sum(values) / total_time:>8.1%}")
+    return "\n".join(lines)
+
+
+_profiler = None
+
+
+def _toggle_profiler(signum, frame):
+    global _profiler
+    if _profiler is None:
+        _profiler = cProfile.Profile()
+        _profiler.enable()
+        print(f"{multiprocessing.current_process().name} profiling started")
+        return
+    _profiler.disable()
+    os.makedirs(PROFILE_PATH, exist_ok=True)
+    path = os.path.join(PROFILE_PATH, f"{multiprocessing.current_process().name}-{os.getpid()}-{int(time.time())}.prof")
+    _profiler.dump_stats(path)
+    _profiler = None
+    print(f"{multiprocessing.current_process().name} profile written to {path} (python -m pstats {path})")
+
+
+def install_profiler():
+    """
+    Lets `kill -USR1 <pid>` start cProfile in this process and a second one stop it and write
+    the stats under profile_path. Profiles the process's main thread (the event loop of a
+    fetcher, the parse loop of a worker). Not available where there is no SIGUSR1 (Windows).
+    """
+    if hasattr(signal, "SIGUSR1"):
+        signal.signal(signal.SIGUSR1, _toggle_profiler)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-URL pipeline traces")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("report", help="latency per pipeline stage and its share of the end-to-end time")
+    timelines = commands.add_parser("timelines", help="the latest traces, one event per line")
+    timelines.add_argument("-n", type=int, default=5)
+    args = parser.parse_args()
+
+    traces = TraceLog().read_all()
+    if args.command == "report":
+        print(report(traces))
+    else:
+        for url, trace in traces[-args.n:]:
+            print(url)
+            for event, at in trace:
+                print(f"  {event:<12} +{at - trace[0][1]:8.3f}s")